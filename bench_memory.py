@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for large Apple Health queries.
+
+Builds a synthetic apple_health.db, then loads one record type three ways, each in a fresh process so peak RSS
+is not shared between them:
+    dict    get_apple_health_records with plain dataclasses, the way records were built before they had slots
+    slots   get_apple_health_records, with the slotted AppleHealthRecord
+    series  get_apple_health_series, parallel arrays of ts and value
+
+Usage:
+    python bench_memory.py [--records 300000]
+"""
+
+import argparse
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+MODES = ("dict", "slots", "series")
+RECORD_TYPE = "HKQuantityTypeIdentifierHeartRate"
+
+
+def build_database(db_path: Path, count: int) -> None:
+    from preprocess_apple_health import create_database_schema
+
+    conn = sqlite3.connect(db_path)
+    create_database_schema(conn)
+    start = 1_700_000_000
+    rows = []
+    for i in range(count):
+        ts = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(start + i * 60))
+        rows.append((RECORD_TYPE, "count/min", 60 + i % 40, "Apple Watch", "10.0", None, ts, ts, ts))
+    conn.executemany("""
+        INSERT INTO apple_health_records (type, unit, value, source_name, source_version, device,
+                                          creation_date, start_date, end_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    conn.commit()
+    conn.close()
+
+
+def peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # bytes on macOS, KiB on Linux
+
+
+def run_mode(mode: str) -> dict:
+    """Runs in the child process, in the directory holding apple_health.db."""
+    import tracemalloc
+    from dataclasses import dataclass, fields, make_dataclass
+    import health_lib_apple
+
+    if mode == "dict":
+        health_lib_apple.AppleHealthRecord = dataclass(make_dataclass(
+            "AppleHealthRecord", [(f.name, f.type) for f in fields(health_lib_apple.AppleHealthRecord)]))
+
+    before = peak_rss_kb()
+    tracemalloc.start()
+    started = time.perf_counter()
+    if mode == "series":
+        result = health_lib_apple.get_apple_health_series(RECORD_TYPE)
+    else:
+        result = health_lib_apple.get_apple_health_records(RECORD_TYPE)
+    elapsed = time.perf_counter() - started
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "mode": mode,
+        "rows": len(result),
+        "seconds": elapsed,
+        "traced_peak_mb": traced_peak / 2**20,
+        "rss_growth_mb": (peak_rss_kb() - before) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare memory use of record objects and array-backed series.")
+    parser.add_argument("--records", type=int, default=300_000, help="rows in the synthetic database")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)  # used by the child processes
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode)))
+        return
+
+    repo = Path(__file__).resolve().parent
+    with tempfile.TemporaryDirectory() as d:
+        print(f"Building a database with {args.records:,} records...")
+        build_database(Path(d) / "apple_health.db", args.records)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(repo), os.environ.get("PYTHONPATH")])))
+        results = []
+        for mode in MODES:
+            out = subprocess.run([sys.executable, str(repo / "bench_memory.py"), "--mode", mode],
+                                 cwd=d, env=env, check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(out.strip().splitlines()[-1]))
+
+    print(f"{'mode':<8}{'rows':>10}{'seconds':>10}{'traced peak MB':>16}{'RSS growth MB':>15}")
+    for r in results:
+        print(f"{r['mode']:<8}{r['rows']:>10,}{r['seconds']:>10.2f}{r['traced_peak_mb']:>16.1f}{r['rss_growth_mb']:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
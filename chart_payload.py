@@ -0,0 +1,226 @@
+"""
+Compact chart payloads.
+
+A chart endpoint answers with a whole ECharts option, and most of it, like the grid, the tooltip and the
+dataZoom handles, is the same for every chart of its kind. The points are [[timestamp, value], ...] pairs, which
+cost brackets, commas and a full timestamp per point. The columnar form splits the option into:
+
+    scaffold    the static part of the option for a kind of chart, served once from its own URL and cached
+    option      how this chart's option differs from the scaffold, without the series' data
+    columns     each series' data as columns: t, the times, delta encoded from a base, and v, the values,
+                rounded to some significant digits if asked
+
+For clients that accept BINARY_MEDIA_TYPE, pack_binary() turns it into a JSON header followed by little-endian
+Int64 timestamps and Float64 values. static/js/chart_payload.js puts the chart back together.
+"""
+
+import calendar
+import json
+import math
+import struct
+import time
+from datetime import datetime
+from typing import Any, Optional
+
+import numpy as np
+
+BINARY_MEDIA_TYPE = "application/octet-stream"
+MAGIC = b"HCOL"
+
+
+def option_diff(option: Any, base: Any) -> Any:
+    """
+    What merge_option(base, diff) needs to make option. Keys of base that option doesn't have are None in the diff,
+    so a None value in option comes back as no value at all, which ECharts treats the same.
+    """
+    if not isinstance(option, dict) or not isinstance(base, dict):
+        return option
+    diff = {}
+    for key, value in option.items():
+        if key not in base:
+            diff[key] = value
+        elif value != base[key]:
+            diff[key] = option_diff(value, base[key])
+    for key in base:
+        if key not in option:
+            diff[key] = None
+    return diff
+
+
+def merge_option(base: Any, diff: Any) -> Any:
+    """The option option_diff() made diff from"""
+    if not isinstance(base, dict) or not isinstance(diff, dict):
+        return diff
+    merged = dict(base)
+    for key, value in diff.items():
+        if value is None:
+            merged.pop(key, None)
+        elif key in merged:
+            merged[key] = merge_option(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+# Formats of the time labels charts use, tried in order. Labels in one of them go as numbers, like timestamps.
+TIME_LABEL_FORMATS = ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%Y-%m")
+
+
+def _is_timestamp(x: Any) -> bool:
+    return isinstance(x, (int, float)) and not isinstance(x, bool) and float(x).is_integer()
+
+
+def _label_times(labels: list) -> Optional[tuple[str, list[int]]]:
+    """(format, ms) if every label is a time in one format that formats back to exactly the label, else None"""
+    if not labels or not all(isinstance(x, str) for x in labels):
+        return None
+    for time_format in TIME_LABEL_FORMATS:
+        try:
+            times = [datetime.strptime(x, time_format) for x in labels]
+        except ValueError:
+            continue
+        if all(t.strftime(time_format) == x for t, x in zip(times, labels)):
+            return time_format, [calendar.timegm(t.timetuple()) * 1000 for t in times]
+    return None
+
+
+def _compact_value(v: Any, precision: Optional[int]) -> Any:
+    if not isinstance(v, float) or math.isnan(v) or math.isinf(v):
+        return v
+    if precision is not None:
+        v = float(f"{v:.{precision}g}")
+    return int(v) if v.is_integer() and abs(v) < 2 ** 53 else v
+
+
+def encode_column(data: list, precision: Optional[int] = None) -> Optional[dict]:
+    """
+    A series' [[x, value], ...] data as columns. When x are timestamps, or time labels like "2024-05-01", that's
+    {"base", "step", "t", "v"}: x is base plus step times the sum of t up to that point, so regular times are
+    runs of 1s. Time labels also have their "format", to turn the times back into the labels. Other x, like week
+    labels, go as they are, as {"x", "v"}.
+    :param precision: significant digits to round values to, None to keep them as they are
+    :return: None if the data isn't [x, value] pairs, so it stays in the option
+    """
+    if not all(isinstance(point, (list, tuple)) and len(point) == 2 for point in data):
+        return None
+    values = [_compact_value(point[1], precision) for point in data]
+    xs = [point[0] for point in data]
+    column = {}
+    if all(_is_timestamp(x) for x in xs):
+        times = xs
+    else:
+        label_times = _label_times(xs)
+        if label_times is None:
+            return {"x": xs, "v": values}
+        column["format"], times = label_times
+    t = np.asarray(times, dtype=np.int64)
+    base = int(t[0]) if len(t) else 0
+    deltas = np.diff(t, prepend=base)
+    step = int(np.gcd.reduce(deltas)) if len(t) > 1 else 0
+    step = step or 1
+    column.update({"base": base, "step": step, "t": (deltas // step).tolist(), "v": values})
+    return column
+
+
+def column_times(column: dict) -> list[int]:
+    """The timestamps of a column of times, in ms"""
+    return (column["base"] + np.cumsum(np.asarray(column["t"], dtype=np.int64)) * column["step"]).tolist()
+
+
+def decode_column(column: dict) -> list:
+    """[[x, value], ...] from encode_column()'s columns"""
+    if "x" in column:
+        xs = column["x"]
+    else:
+        xs = column_times(column)
+        if "format" in column:
+            xs = [time.strftime(column["format"], time.gmtime(t // 1000)) for t in xs]
+    return [[x, v] for x, v in zip(xs, column["v"])]
+
+
+def make_scaffold(option: dict, series: dict) -> dict:
+    """A scaffold: the static option, and the static part of each series"""
+    return {"option": option, "series": series}
+
+
+def columnar(chart_config: dict, scaffold: dict, scaffold_url: str, precision: Optional[int] = None) -> dict:
+    """
+    The columnar form of a chart_config. With series i's data in columns[i], merge_option(scaffold["option"],
+    option) is the chart_config, and merge_option(scaffold["series"], option["series"][i]) its series i. A series
+    whose data can't be columns keeps it, and its column is None.
+    """
+    config = dict(chart_config)
+    series = config.pop("series", [])
+    columns = []
+    series_diffs = []
+    for s in series:
+        column = encode_column(s.get("data", []), precision)
+        columns.append(column)
+        if column is not None:
+            s = {key: value for key, value in s.items() if key != "data"}
+        series_diffs.append(option_diff(s, scaffold["series"]))
+    option = option_diff(config, scaffold["option"])
+    option["series"] = series_diffs
+    return {"scaffold": scaffold_url, "option": option, "columns": columns}
+
+
+def restore_chart_config(payload: dict, scaffold: dict) -> dict:
+    """The chart_config columnar() made payload from, as the client puts it together"""
+    option = merge_option(scaffold["option"], {k: v for k, v in payload["option"].items() if k != "series"})
+    series = []
+    for s, column in zip(payload["option"]["series"], payload["columns"]):
+        s = merge_option(scaffold["series"], s)
+        if column is not None:
+            s["data"] = decode_column(column)
+        series.append(s)
+    option["series"] = series
+    return option
+
+
+def pack_binary(payload: dict) -> bytes:
+    """
+    A columnar payload as bytes, for clients that accept BINARY_MEDIA_TYPE. The layout, all little-endian:
+
+        4 bytes   MAGIC
+        uint32    length of the JSON header in bytes
+        header    the payload as JSON, padded with spaces to a multiple of 8 bytes. Columns of times are
+                  {"binary": n}, with n their length, and their "format" if they are time labels.
+        columns   for each binary column, in order: n Int64 timestamps in ms, then n Float64 values, NaN for none
+    """
+    header = dict(payload)
+    header["columns"] = []
+    arrays = []
+    for column in payload["columns"]:
+        if column is None or "x" in column:
+            header["columns"].append(column)
+            continue
+        header["columns"].append({key: value for key, value in column.items() if key == "format"} |
+                                 {"binary": len(column["t"])})
+        v = np.asarray([np.nan if x is None else x for x in column["v"]], dtype=np.float64)
+        arrays += [np.asarray(column_times(column), dtype="<i8").tobytes(), v.astype("<f8").tobytes()]
+    text = json.dumps(header, separators=(",", ":")).encode()
+    text += b" " * (-(len(MAGIC) + 4 + len(text)) % 8)
+    return b"".join([MAGIC, struct.pack("<I", len(text)), text] + arrays)
+
+
+def unpack_binary(body: bytes) -> dict:
+    """The columnar payload pack_binary() made body from, with step 1 and values that were None as NaN"""
+    if body[:4] != MAGIC:
+        raise ValueError("Not a columnar chart payload")
+    (length,) = struct.unpack_from("<I", body, 4)
+    payload = json.loads(body[8:8 + length])
+    offset = 8 + length
+    columns = []
+    for column in payload["columns"]:
+        if column is None or "binary" not in column:
+            columns.append(column)
+            continue
+        n = column.pop("binary")
+        t = np.frombuffer(body, dtype="<i8", count=n, offset=offset)
+        v = np.frombuffer(body, dtype="<f8", count=n, offset=offset + 8 * n)
+        offset += 16 * n
+        base = int(t[0]) if n else 0
+        column.update({"base": base, "step": 1, "t": np.diff(t, prepend=base).tolist(), "v": v.tolist()})
+        columns.append(column)
+    payload["columns"] = columns
+    return payload
@@ -31,6 +31,73 @@ def has_cda_database() -> bool:
     return get_cda_database_path().exists()
 
 
+def get_fhir_index_path() -> Path:
+    """
+    Get path to the FHIR observation index. Like the CDA database, this is stored in the current directory,
+    unless HEALTH_FHIR_INDEX points somewhere else, like an index written by convert_synthea.py --output-format index.
+    """
+    return Path(os.environ.get('HEALTH_FHIR_INDEX', 'fhir_index.db'))
+
+
+def get_fhir_scan_interval() -> float:
+    """
+    Seconds between background scans of clinical-records for new, changed or deleted files. 0 disables the
+    background scan; the index is still synced when a page notices the directory has changed.
+    """
+    return float(os.environ.get('HEALTH_FHIR_SCAN_INTERVAL', '0'))
+
+
+def get_unified_database_path() -> Path:
+    """
+    Get path to the unified observation store, which merges FHIR, CDA and Apple Health values into one table.
+    Stored in the current directory, next to the databases it is built from.
+    """
+    return Path(os.environ.get('HEALTH_UNIFIED_DB', 'unified_observations.db'))
+
+
+def get_sqlite_mmap_size() -> int:
+    """Bytes of each database the server memory-maps for reading. 0 turns memory mapping off."""
+    return int(os.environ.get('HEALTH_SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+
+
+def get_sqlite_cache_kb() -> int:
+    """KiB of page cache for each read-only database connection the server keeps open."""
+    return int(os.environ.get('HEALTH_SQLITE_CACHE_KB', '65536'))
+
+
+def get_sqlite_immutable() -> bool:
+    """
+    Open the preprocessed databases with immutable=1, which skips locking. Only safe if the preprocessors are not
+    run while the server is up; a replaced file is still noticed and reopened.
+    """
+    return os.environ.get('HEALTH_SQLITE_IMMUTABLE', '0').lower() in ('1', 'true', 'yes')
+
+
+def get_worker_threads() -> int:
+    """Threads that run the web server's blocking work: SQLite queries, reading FHIR files and rendering pages."""
+    return int(os.environ.get('HEALTH_WORKER_THREADS', '40'))
+
+
+def get_heavy_query_limit() -> int:
+    """Chart queries that may run at the same time. The rest wait, so cheap pages keep the other worker threads."""
+    return int(os.environ.get('HEALTH_HEAVY_QUERY_LIMIT', '4'))
+
+
+def get_chart_width() -> int:
+    """Pixel width to downsample raw chart series to when the request doesn't say"""
+    return int(os.environ.get('HEALTH_CHART_WIDTH', '1200'))
+
+
+def get_downsample_method() -> str:
+    """How raw chart series are downsampled, "m4" (min/max/first/last per pixel) or "lttb", see downsample.py"""
+    return os.environ.get('HEALTH_DOWNSAMPLE', 'm4')
+
+
+def get_response_cache_mb() -> float:
+    """MiB of chart and data responses the server keeps to answer repeated requests with. 0 turns the cache off."""
+    return float(os.environ.get('HEALTH_RESPONSE_CACHE_MB', '64'))
+
+
 def get_apple_health_database_path() -> Path:
     """Get path to Apple Health database"""
     return Path("apple_health.db")
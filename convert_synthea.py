@@ -2,38 +2,28 @@
 """
 Convert Synthea FHIR bundles to individual resource files matching Apple Health export format.
 This allows testing the dynamic resource system with synthetic health data.
+
+For large populations, thousands of small files are mostly filesystem overhead, so there are two other outputs:
+    --output-format ndjson  One clinical-records/<ResourceType>.ndjson file per type, one resource per line.
+    --output-format index   Observations go straight into <output_dir>/fhir_index.db. No files are written.
 """
 
 import json
+import os
+import time
 import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import argparse
-from typing import Dict, List
+from collections import Counter
+from typing import Dict, Iterable, List
 
+from health_lib import ObservationIndex, observation_postings
 
-def extract_resources_from_bundle(bundle_path: Path) -> Dict[str, List[Dict]]:
-    """Extract individual resources from a FHIR bundle file."""
-    resources_by_type = {}
-    
-    with open(bundle_path, 'r') as f:
-        bundle = json.load(f)
-    
-    if bundle.get('resourceType') != 'Bundle':
-        raise ValueError(f"Expected Bundle, got {bundle.get('resourceType')}")
-    
-    entries = bundle.get('entry', [])
-    print(f"Processing {len(entries)} entries from bundle...")
-    
-    for entry in entries:
-        resource = entry.get('resource', {})
-        resource_type = resource.get('resourceType')
-        
-        if resource_type:
-            if resource_type not in resources_by_type:
-                resources_by_type[resource_type] = []
-            resources_by_type[resource_type].append(resource)
-    
-    return resources_by_type
+OUTPUT_FORMATS = ("files", "ndjson", "index")
+
+# Big enough that every resource file is written with a single write() call
+WRITE_BUFFER_SIZE = 1 << 16
 
 
 def normalize_fhir_to_apple_format(resource: Dict) -> Dict:
@@ -84,34 +74,149 @@ def normalize_fhir_to_apple_format(resource: Dict) -> Dict:
     return resource
 
 
-def save_individual_resources(resources_by_type: Dict[str, List[Dict]], output_dir: Path):
-    """Save resources as individual files matching Apple Health format."""
-    # Create the expected directory structure: output_dir/clinical-records/
+def write_resource(resource: Dict, clinical_dir: Path) -> str:
+    """
+    Normalize one resource and write it to its own file, as compact JSON in one buffered write.
+    :return: The resource type
+    """
+    resource_type = resource['resourceType']
+    normalized_resource = normalize_fhir_to_apple_format(resource)
+
+    # Use existing ID if available, otherwise generate one
+    resource_id = normalized_resource.get('id', str(uuid.uuid4()))
+
+    # Create filename matching Apple Health pattern: ResourceType-UUID.json
+    file_path = clinical_dir / f"{resource_type}-{resource_id}.json"
+    with open(file_path, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+        f.write(json.dumps(normalized_resource, separators=(',', ':')))
+    return resource_type
+
+
+def bundle_resources(bundle_path: Path) -> Iterable[Dict]:
+    """
+    Yield the normalized resources of one bundle. Entries are dropped as we go, so each resource can be freed once
+    the caller is done with it.
+    """
+    with open(bundle_path, 'r') as f:
+        bundle = json.load(f)
+
+    if bundle.get('resourceType') != 'Bundle':
+        raise ValueError(f"Expected Bundle, got {bundle.get('resourceType')}")
+
+    entries = bundle.pop('entry', [])
+    del bundle
+    entries.reverse()
+    while entries:
+        resource = entries.pop().get('resource', {})
+        if resource.get('resourceType'):
+            yield normalize_fhir_to_apple_format(resource)
+
+
+def convert_bundle(bundle_path: Path, clinical_dir: Path) -> Counter:
+    """
+    Convert one bundle, streaming each resource straight to its own file. This runs in a worker process, so
+    only one bundle per worker is in memory at a time.
+    :return: Counter of resource type -> files written
+    """
+    counts = Counter()
+    for resource in bundle_resources(bundle_path):
+        counts[write_resource(resource, clinical_dir)] += 1
+    return counts
+
+
+def convert_bundle_task(bundle_path: Path, clinical_dir: Path, output_format: str):
+    """
+    The work done in a worker process for one bundle. For ndjson and index, the worker does the JSON encoding and
+    the index parsing, and the main process only appends the results, since there is a single writer for each.
+    :return: (Counter of resource type -> resources, output for the main process to write)
+    """
+    if output_format == "files":
+        return convert_bundle(bundle_path, clinical_dir), None
+
+    counts = Counter()
+    if output_format == "ndjson":
+        lines: Dict[str, List[str]] = {}
+        for resource in bundle_resources(bundle_path):
+            resource_type = resource['resourceType']
+            counts[resource_type] += 1
+            lines.setdefault(resource_type, []).append(json.dumps(resource, separators=(',', ':')))
+        return counts, lines
+
+    # index: only Observations are indexed
+    postings = []
+    for ordinal, resource in enumerate(bundle_resources(bundle_path)):
+        resource_type = resource['resourceType']
+        counts[resource_type] += 1
+        if resource_type == 'Observation':
+            postings.append((ordinal, observation_postings(f"{bundle_path.name}#{resource.get('id')}", resource)))
+    return counts, postings
+
+
+def convert_bundles(bundle_files: List[Path], output_dir: Path, workers: int, output_format: str = "files") -> Counter:
+    """
+    Convert bundles in a process pool, one bundle per task, printing progress as each one finishes.
+    :return: Counter of resource type -> resources converted, over all bundles
+    """
     clinical_dir = output_dir / "clinical-records"
     clinical_dir.mkdir(parents=True, exist_ok=True)
-    
-    total_files = 0
-    for resource_type, resources in resources_by_type.items():
-        print(f"Processing {len(resources)} {resource_type} resources...")
-        
-        for resource in resources:
-            # Normalize FHIR format to Apple Health format
-            normalized_resource = normalize_fhir_to_apple_format(resource)
-            
-            # Use existing ID if available, otherwise generate one
-            resource_id = normalized_resource.get('id', str(uuid.uuid4()))
-            
-            # Create filename matching Apple Health pattern: ResourceType-UUID.json
-            filename = f"{resource_type}-{resource_id}.json"
-            file_path = clinical_dir / filename
-            
-            # Save individual resource
-            with open(file_path, 'w') as f:
-                json.dump(normalized_resource, f, indent=2)
-            
-            total_files += 1
-    
-    print(f"Created {total_files} individual resource files in {clinical_dir}")
+
+    ndjson_files = {}
+    index = ObservationIndex(output_dir / "fhir_index.db", clinical_dir) if output_format == "index" else None
+
+    total_resources = Counter()
+    start_time = time.time()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(convert_bundle_task, bundle_file, clinical_dir, output_format): bundle_file
+                       for bundle_file in bundle_files}
+            # Finished futures are popped, so their results can be freed
+            for done, future in enumerate(as_completed(futures), start=1):
+                bundle_file = futures.pop(future)
+                try:
+                    counts, output = future.result()
+                except Exception as e:
+                    print(f"Error processing {bundle_file}: {e}")
+                    continue
+                if output_format == "ndjson":
+                    for resource_type, lines in output.items():
+                        if resource_type not in ndjson_files:
+                            # Written aside and renamed at the end, so the server never reads a half-written file
+                            ndjson_files[resource_type] = open(clinical_dir / f"{resource_type}.ndjson.tmp", 'w',
+                                                               buffering=WRITE_BUFFER_SIZE * 16)
+                        ndjson_files[resource_type].write('\n'.join(lines) + '\n')
+                elif output_format == "index":
+                    index.add_postings(f"synthea/{bundle_file.name}", output)
+                total_resources.update(counts)
+                elapsed = time.time() - start_time
+                total_count = sum(total_resources.values())
+                print(f"  [{done}/{len(bundle_files)}] {bundle_file.name}: {sum(counts.values()):,} resources "
+                      f"({total_count / elapsed:,.0f} resources/sec overall)")
+    except BaseException:
+        for f in ndjson_files.values():
+            Path(f.name).unlink(missing_ok=True)
+        raise
+    finally:
+        for f in ndjson_files.values():
+            f.close()
+        if index is not None:
+            index.close()
+    for f in ndjson_files.values():
+        os.replace(f.name, f.name.removesuffix(".tmp"))
+
+    elapsed = time.time() - start_time
+    total_count = sum(total_resources.values())
+    rate = total_count / elapsed if elapsed > 0 else 0
+    if output_format == "files":
+        print(f"Created {total_count:,} individual resource files in {clinical_dir} "
+              f"in {elapsed:.1f} seconds ({rate:,.0f} files/sec)")
+    elif output_format == "ndjson":
+        print(f"Wrote {total_count:,} resources to {len(ndjson_files)} NDJSON files in {clinical_dir} "
+              f"in {elapsed:.1f} seconds ({rate:,.0f} resources/sec)")
+    else:
+        print(f"Indexed {total_resources['Observation']:,} observations into {output_dir / 'fhir_index.db'} "
+              f"in {elapsed:.1f} seconds ({rate:,.0f} resources/sec). Other resource types were skipped.")
+        print(f"Run the server with HEALTH_DATA_DIR={output_dir} HEALTH_FHIR_INDEX={output_dir / 'fhir_index.db'}")
+    return total_resources
 
 
 def main():
@@ -120,6 +225,11 @@ def main():
     parser.add_argument("output_dir", help="Directory to save individual resource files")
     parser.add_argument("--patient-only", action="store_true", 
                        help="Only process patient bundle (skip hospital/practitioner)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                       help="Number of bundles to convert in parallel (default: number of CPUs)")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="files",
+                       help="files: one JSON file per resource (default). ndjson: one file per resource type. "
+                            "index: write Observations straight into the FHIR index, without files.")
     
     args = parser.parse_args()
     
@@ -136,9 +246,7 @@ def main():
         print(f"Error: No JSON files found in {input_dir}")
         return 1
     
-    print(f"Found {len(bundle_files)} bundle files:")
-    for f in bundle_files:
-        print(f"  - {f.name}")
+    print(f"Found {len(bundle_files)} bundle files")
     
     # Filter to patient bundles only if requested
     if args.patient_only:
@@ -146,47 +254,32 @@ def main():
                                                           for x in ['hospital', 'practitioner'])]
         print(f"Processing {len(bundle_files)} patient bundle files only")
     
-    total_resources = {}
-    
-    for bundle_file in bundle_files:
-        print(f"\nProcessing {bundle_file.name}...")
-        
-        try:
-            resources = extract_resources_from_bundle(bundle_file)
-            
-            # Merge resources by type
-            for resource_type, resource_list in resources.items():
-                if resource_type not in total_resources:
-                    total_resources[resource_type] = []
-                total_resources[resource_type].extend(resource_list)
-            
-        except Exception as e:
-            print(f"Error processing {bundle_file}: {e}")
-            continue
+    total_resources = convert_bundles(bundle_files, output_dir, args.workers, args.output_format)
     
     # Print summary
     print("\nResource Summary:")
-    for resource_type, resources in sorted(total_resources.items()):
-        print(f"  {resource_type}: {len(resources)}")
+    for resource_type, count in sorted(total_resources.items()):
+        print(f"  {resource_type}: {count}")
     
-    # Save all resources
     if total_resources:
-        save_individual_resources(total_resources, output_dir)
-        
         # Create a summary file
         summary = {
             "conversion_info": {
                 "source_format": "Synthea FHIR Bundle",
-                "target_format": "Apple Health Export (individual files)",
-                "total_files_created": sum(len(resources) for resources in total_resources.values()),
-                "resource_types": {rt: len(resources) for rt, resources in total_resources.items()}
+                "target_format": {
+                    "files": "Apple Health Export (individual files)",
+                    "ndjson": "NDJSON (one file per resource type)",
+                    "index": "FHIR observation index",
+                }[args.output_format],
+                "total_resources": sum(total_resources.values()),
+                "resource_types": dict(total_resources)
             }
         }
         
         with open(output_dir / "conversion_summary.json", 'w') as f:
             json.dump(summary, f, indent=2)
         
-        print(f"\nConversion complete! Check {output_dir} for individual resource files.")
+        print(f"\nConversion complete! Check {output_dir} for the converted resources.")
         print("You can now use this synthetic data to test your health data explorer.")
     else:
         print("No resources found to convert.")
@@ -195,4 +288,4 @@ def main():
 
 
 if __name__ == "__main__":
-    exit(main())
\ No newline at end of file
+    exit(main())
@@ -0,0 +1,114 @@
+"""
+Read-only SQLite connections for the web server, one per thread per database, kept open between requests.
+
+Opening a connection for every query throws away SQLite's page cache and parses the schema again each time. The
+databases the server reads (apple_health.db, cda_observations.db, the unified store) are written by the
+preprocessors, not the server, so a thread can keep a read-only connection open for as long as the file is the
+same file. Before a connection is handed out, the file is stat()ed, and if it was replaced or modified, a new
+connection is opened.
+
+Connections are opened with mode=ro, and also immutable=1 if config.get_sqlite_immutable() is set. Immutable skips
+all locking, which is faster, but is only safe if nothing writes to the file while the server is running.
+"""
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+from urllib.parse import quote
+
+import config
+from timing import timed
+
+# Statements kept compiled per connection. The server has a few dozen distinct queries.
+CACHED_STATEMENTS = 256
+
+
+def file_signature(db_path: Path) -> Optional[tuple[int, int, int, int]]:
+    """Changes when the file is replaced (new inode) or written to (new size or mtime). None if it doesn't exist."""
+    try:
+        st = os.stat(db_path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def connect_read_only(db_path: Path, immutable: bool = False) -> sqlite3.Connection:
+    """Open a tuned, read-only connection. Raises FileNotFoundError if the database doesn't exist."""
+    if not Path(db_path).exists():
+        raise FileNotFoundError(f"Database not found: {db_path}")
+    uri = f"file:{quote(str(Path(db_path).resolve()))}?mode=ro" + ("&immutable=1" if immutable else "")
+    # check_same_thread=False: a streaming response can resume a generator on another thread than the one that
+    # started it. The thread-local pool still means no two threads start queries on the same connection.
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+    conn.execute(f"PRAGMA mmap_size = {int(config.get_sqlite_mmap_size())}")
+    conn.execute(f"PRAGMA cache_size = {-int(config.get_sqlite_cache_kb())}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+class ReadOnlyPool:
+    """
+    Hands each thread its own read-only connection to a database, opening it on first use and reopening it when
+    the file changes.
+    """
+
+    def __init__(self, row_factory: Optional[Callable] = None, allow_immutable: bool = True):
+        """
+        :param row_factory: Set on every connection, like sqlite3.Row. Each pool has one, so callers never change
+            the row_factory of a shared connection.
+        :param allow_immutable: False for databases the server writes itself, which must never be opened immutable.
+        """
+        self.row_factory = row_factory
+        self.allow_immutable = allow_immutable
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._reopened = 0
+
+    @timed("db_connect")
+    def connection(self, db_path: Path) -> sqlite3.Connection:
+        """The calling thread's connection to db_path. Don't close it."""
+        db_path = Path(db_path)
+        signature = file_signature(db_path)
+        if signature is None:
+            raise FileNotFoundError(f"Database not found: {db_path}")
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        cached = connections.get(db_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        # A replaced connection isn't closed here: a generator on this thread may still be reading from it.
+        # It is closed when the last reference goes away.
+        conn = connect_read_only(db_path, immutable=self.allow_immutable and config.get_sqlite_immutable())
+        conn.row_factory = self.row_factory
+        connections[db_path] = (signature, conn)
+        with self._lock:
+            self._opened += 1
+            if cached is not None:
+                self._reopened += 1
+        return conn
+
+    def close_thread(self) -> None:
+        """Close the calling thread's connections, like when the thread is done."""
+        for _, conn in getattr(self._local, "connections", {}).values():
+            conn.close()
+        self._local.connections = {}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"opened": self._opened, "reopened": self._reopened}
+
+
+def tuple_cursor(conn: sqlite3.Connection) -> sqlite3.Cursor:
+    """A cursor on a pooled connection that returns plain tuples, whatever the connection's row_factory is."""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return cursor
+
+
+# The pool the Apple Health and CDA code share: rows are sqlite3.Row, like the connections they used to open.
+row_pool = ReadOnlyPool(row_factory=sqlite3.Row)
@@ -0,0 +1,114 @@
+"""
+Downsampling of time series for charts, so a series is sent at about as many points as the chart can draw.
+
+A chart is a few hundred to a couple of thousand pixels wide, and a line through 400,000 points draws the same as
+one through the few points per pixel column that decide what the line looks like. Two ways to pick those points:
+
+    m4      first, last, min and max of each pixel column. At most 4 points a column, and the line drawn through
+            them is the same as the line through all the points (Jugel et al., "M4", VLDB 2014).
+    lttb    Largest-Triangle-Three-Buckets: one point per column, the one making the largest triangle with the
+            point kept before it and the average of the next column (Steinarsson, 2013). Fewer points, and it
+            keeps the shape, but not every peak.
+
+Both take timestamps in ascending order and return indices into them, so the caller can pick from whatever
+arrays it has: epoch seconds, ms, or the original date strings.
+"""
+
+from typing import Sequence
+
+import numpy as np
+
+METHODS = ("m4", "lttb")
+DEFAULT_METHOD = "m4"
+
+
+def m4_indices(ts: np.ndarray, values: np.ndarray, width: int) -> np.ndarray:
+    """
+    Indices of the first, last, min and max point of each of width equal time columns.
+    :param ts: Timestamps, ascending
+    :param values: Values, none NaN
+    :return: Sorted indices, at most 4 * width of them
+    """
+    n = len(ts)
+    if n <= 4 * width:
+        return np.arange(n)
+    t = np.asarray(ts, dtype=np.float64)
+    span = t[-1] - t[0]
+    if span > 0:
+        columns = np.minimum(((t - t[0]) * (width / span)).astype(np.int64), width - 1)
+    else:
+        columns = np.zeros(n, dtype=np.int64)
+
+    starts = np.flatnonzero(np.concatenate(([True], columns[1:] != columns[:-1])))
+    ends = np.concatenate((starts[1:], [n])) - 1
+    # Sorted by column, then value, each column sits at the same positions as in ts, lowest value first
+    by_value = np.lexsort((values, columns))
+    return np.unique(np.concatenate((starts, ends, by_value[starts], by_value[ends])))
+
+
+def lttb_indices(ts: np.ndarray, values: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Indices of the threshold points Largest-Triangle-Three-Buckets keeps. The first and last point are always kept.
+    :param ts: Timestamps, ascending
+    :param values: Values, none NaN
+    :return: Sorted indices, threshold of them
+    """
+    n = len(ts)
+    if n <= threshold:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1][:max(threshold, 1)])
+    t = np.asarray(ts, dtype=np.float64)
+    v = np.asarray(values, dtype=np.float64)
+
+    # Buckets between the first and last point, and each one's average, to aim the next triangle at
+    buckets = threshold - 2
+    starts = (np.arange(buckets) * ((n - 2) / buckets)).astype(np.int64) + 1
+    ends = np.concatenate((starts[1:], [n - 1]))
+    counts = ends - starts
+    avg_t = np.add.reduceat(t[:n - 1], starts) / counts
+    avg_v = np.add.reduceat(v[:n - 1], starts) / counts
+    avg_t = np.concatenate((avg_t[1:], [t[-1]]))
+    avg_v = np.concatenate((avg_v[1:], [v[-1]]))
+
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(buckets):
+        s, e = starts[i], ends[i]
+        # Twice the triangle's area, for each candidate in the bucket at once
+        area = np.abs((t[a] - avg_t[i]) * (v[s:e] - v[a]) - (t[a] - t[s:e]) * (avg_v[i] - v[a]))
+        a = s + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+def downsample_indices(ts: Sequence, values: Sequence, width: int, method: str = DEFAULT_METHOD) -> np.ndarray:
+    """
+    Indices of the points to draw a series at width pixels. Points with no value are dropped, and timestamps
+    don't have to be sorted.
+    :param method: "m4" or "lttb"
+    :return: Indices into ts and values, in time order
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    if width < 1:
+        raise ValueError(f"Width must be at least 1, not {width}")
+    t = np.asarray(ts, dtype=np.float64)
+    v = np.asarray(values, dtype=np.float64)
+    index = np.flatnonzero(~np.isnan(v))
+    if len(index) and np.any(np.diff(t[index]) < 0):
+        index = index[np.argsort(t[index], kind="stable")]
+    if method == "m4":
+        picked = m4_indices(t[index], v[index], width)
+    else:
+        picked = lttb_indices(t[index], v[index], width)
+    return index[picked]
+
+
+def downsample_pairs(pairs: list, width: int, method: str = DEFAULT_METHOD) -> list:
+    """Downsample [[ts, value], ...], the form ECharts takes, and return the same form."""
+    if len(pairs) <= width:
+        return pairs
+    points = np.array(pairs, dtype=np.float64)
+    return [pairs[i] for i in downsample_indices(points[:, 0], points[:, 1], width, method)]
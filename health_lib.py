@@ -6,23 +6,31 @@ I try to put assertions in, to verify my assumptions, like "A referenceRange onl
 I have seen, but there are probably millions of cases I have not seen, yet. It's better to hit an assertion and fix
 it, than to silently hide information.
 """
+import hashlib
 import json
+import os
+import sqlite3
 import sys
+import threading
+from array import array
+from functools import lru_cache
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import Callable, Iterable, Optional
 import re
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from collections import Counter
 
+from db_pool import file_signature
 
-@dataclass
+
+@dataclass(slots=True)
 class StatInfo:
     category_name: str
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class ValueQuantity:
     """
     Represents a "valueQuantity", from an Observation. It provides a value, a unit and optionally a name.
@@ -60,7 +68,7 @@ class ValueQuantity:
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class ValueString:
     """
     Represents a "valueString", from an Observation. Used for lab results that contain text rather than numeric values.
@@ -71,8 +79,7 @@ class ValueString:
     name: str
 
 
-reference_range_pattern = re.compile(r"[<=>]+")
-@dataclass
+@dataclass(slots=True)
 class ReferenceRange:
     """
     The normal or "referenceRange" from the Observation file.
@@ -111,10 +118,23 @@ class ReferenceRange:
 
     The "<" or "<=" could be parsed, and are the most common format. Odd, and annoying that they have something that
     could be expressed with "low" and "high", but aren't.
+
+    Numbers in the text are in the unit the file gave the value, so they are converted with convert_units like the
+    value was.
     """
     low: Optional[ValueQuantity]
     high: Optional[ValueQuantity]
     text: str
+    unit: Optional[str] = None  # The value's unit in the file, before convert_units
+
+    def _text_bounds(self) -> Optional[tuple[Optional[float], Optional[float], str]]:
+        bounds = parse_reference_range_text(self.text)
+        if bounds is None:
+            return None
+        low, high, op = bounds
+        return (None if low is None else convert_units(low, self.unit)[0],
+                None if high is None else convert_units(high, self.unit)[0], op)
+
     def get_range(self):
         """
         we need to have get range, because we can try to extract the range from the text field, if there
@@ -127,25 +147,87 @@ class ReferenceRange:
             assert self.high.value is not None
             return self.low.value, self.high.value
         if self.text is not None:
-            operators = reference_range_pattern.findall(self.text)
-            if not operators:
+            bounds = self._text_bounds()
+            if bounds is None:
                 return None
-            assert len(operators) == 1
-            op = operators[0]
-            value = self.text[len(op):]
-            assert value
-            value = float(value)
+            low, high, _ = bounds
             # TODO what do I return for high for ">10", max int? max value on the graph? None?
-            # TODO: Just found: text: "6.0 - 7.7 g/dL
-            match op:
-                case "<" | "<=":
-                    return -sys.maxsize, value
-                case ">" | ">=":
-                    return value, sys.maxsize
-                case "=":
-                    return value, value
+            return -sys.maxsize if low is None else low, sys.maxsize if high is None else high
+
+        return None
+
+    def bounds(self) -> Optional[tuple[Optional[float], Optional[float], str]]:
+        """
+        The range as numbers, from low and high if they are there, otherwise from the text.
+        :return: (low, high, op) as from parse_reference_range_text, or None if there are no numbers.
+        """
+        if self.low is not None and self.high is not None:
+            return self.low.value, self.high.value, "between"
+        if self.low is not None:
+            return self.low.value, None, ">="
+        if self.high is not None:
+            return None, self.high.value, "<="
+        if self.text is not None:
+            return self._text_bounds()
+        return None
+
 
-        return None  # TODO extract from text field, where possible.
+_range_comparison_pattern = re.compile(r"^\s*(<=|>=|<|>|=)\s*(-?\d+(?:\.\d*)?|-?\.\d+)\s*(?:\S.*)?$")
+_range_between_pattern = re.compile(
+    r"^\s*(-?\d+(?:\.\d*)?|-?\.\d+)\s*-\s*(-?\d+(?:\.\d*)?|-?\.\d+)\s*(?:\S.*)?$")
+
+
+@lru_cache(maxsize=4096)
+def parse_reference_range_text(text: str) -> Optional[tuple[Optional[float], Optional[float], str]]:
+    """
+    Parse the text of a referenceRange that has no low or high. There are only a few hundred distinct texts, so the
+    results are cached.
+        "<=1.34"          -> (None, 1.34, "<=")
+        ">7.7"            -> (7.7, None, ">")
+        "=7.9"            -> (7.9, 7.9, "=")
+        "6.0 - 7.7 g/dL"  -> (6.0, 7.7, "between")
+        "NEGATIVE"        -> None
+    :return: (low, high, op), with None for an open end, or None if the text isn't numeric.
+    """
+    match = _range_comparison_pattern.match(text)
+    if match:
+        op, value = match.group(1), float(match.group(2))
+        match op:
+            case "<" | "<=":
+                return None, value, op
+            case ">" | ">=":
+                return value, None, op
+            case "=":
+                return value, value, op
+    match = _range_between_pattern.match(text)
+    if match:
+        return float(match.group(1)), float(match.group(2)), "between"
+    return None
+
+
+def out_of_range(value: float, low: Optional[float], high: Optional[float], op: str) -> bool:
+    """Is value outside the range (low, high, op) from ReferenceRange.bounds? Must agree with OUT_OF_RANGE_SQL."""
+    match op:
+        case "<":
+            return value >= high
+        case "<=":
+            return value > high
+        case ">":
+            return value <= low
+        case ">=":
+            return value < low
+        case "=":
+            return value != low
+    return (low is not None and value < low) or (high is not None and value > high)
+
+
+# out_of_range, for the value and ref_ columns of the observation index
+OUT_OF_RANGE_SQL = """
+    (o.ref_op = '<' AND o.value >= o.ref_high) OR (o.ref_op = '<=' AND o.value > o.ref_high)
+    OR (o.ref_op = '>' AND o.value <= o.ref_low) OR (o.ref_op = '>=' AND o.value < o.ref_low)
+    OR (o.ref_op = '=' AND o.value <> o.ref_low)
+    OR (o.ref_op = 'between' AND (o.value < o.ref_low OR o.value > o.ref_high))
+"""
 
 @dataclass(kw_only=True, slots=True )
 class Observation:
@@ -162,6 +244,241 @@ class Observation:
     source_name: str = None
 
 
+@dataclass(slots=True)
+class TimeSeries:
+    """
+    A large query result as two parallel arrays, instead of one object per row: 16 bytes a point, not a few hundred.
+    Use it when there can be hundreds of thousands of points, like Apple Health heart rate.
+    """
+    name: str
+    unit: Optional[str] = None
+    ts: array = field(default_factory=lambda: array("q"))  # seconds since the epoch
+    values: array = field(default_factory=lambda: array("d"))
+
+    def append(self, ts: int, value: float) -> None:
+        self.ts.append(ts)
+        self.values.append(value)
+
+    def extend(self, rows: Iterable[tuple[int, float]]) -> "TimeSeries":
+        """Add (ts, value) rows, like a sqlite3 cursor, without building a list of them first."""
+        for ts, value in rows:
+            self.ts.append(ts)
+            self.values.append(value)
+        return self
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def __iter__(self):
+        return zip(self.ts, self.values)
+
+    def pairs_ms(self) -> list[list]:
+        """[[ms, value], ...], the form ECharts takes for a time axis"""
+        return [[t * 1000, v] for t, v in zip(self.ts, self.values)]
+
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def iter_cursor(cursor: sqlite3.Cursor, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterable:
+    """Yield a cursor's rows, fetching chunk_size at a time, so a large result never sits in memory all at once."""
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def projection(columns: Optional[Iterable[str]], allowed: Iterable[str]) -> str:
+    """
+    The SELECT list for an optional projection. Column names can't be bound as parameters, so they are checked
+    against the table's columns instead.
+    :return: "*" if columns is None, otherwise the columns joined with commas
+    """
+    if columns is None:
+        return "*"
+    columns = list(columns)
+    unknown = [c for c in columns if c not in allowed]
+    if unknown or not columns:
+        raise ValueError(f"Unknown columns: {unknown}" if unknown else "No columns to select")
+    return ", ".join(columns)
+
+
+@dataclass(slots=True)
+class CatalogEntry:
+    """One row of a preprocessed database's catalog: what one record type or observation name holds"""
+    kind: str  # "record" (Apple record type), "observation" (CDA observation) or "table" (a whole table)
+    category: str
+    name: str
+    slug: str
+    count: int
+    min_date: Optional[str] = None
+    max_date: Optional[str] = None
+    units: list = field(default_factory=list)
+    sources: dict = field(default_factory=dict)  # source name -> count
+
+    def source_names(self) -> list:
+        """Source names in the order of ORDER BY source_name"""
+        return sorted(self.sources, key=lambda s: (s is not None, s or ""))
+
+
+# Written by the preprocessors after an import, so pages that list types, counts and sources read a few hundred
+# rows instead of grouping millions. units and sources are JSON; sources as [name, count] pairs, since a name
+# can be null.
+CATALOG_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS catalog (
+        kind TEXT NOT NULL,
+        category TEXT NOT NULL,
+        name TEXT NOT NULL,
+        slug TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        min_date TEXT,
+        max_date TEXT,
+        units TEXT NOT NULL,
+        sources TEXT NOT NULL,
+        PRIMARY KEY (kind, category, name)
+    )
+"""
+
+
+def fold_catalog(groups: Iterable[tuple], slug: Callable[[str], str]) -> list[CatalogEntry]:
+    """
+    Catalog entries, most rows first, from the rows of a GROUP BY kind, category, name, source, unit.
+    :param groups: (kind, category, name, source, unit, count, min_date, max_date) tuples
+    :param slug: makes the URL slug of a name
+    """
+    entries: dict[tuple, CatalogEntry] = {}
+    for kind, category, name, source, unit, count, min_date, max_date in groups:
+        entry = entries.get((kind, category, name))
+        if entry is None:
+            entry = entries[(kind, category, name)] = CatalogEntry(kind, category, name, slug(name), 0)
+        entry.count += count
+        if min_date is not None and (entry.min_date is None or min_date < entry.min_date):
+            entry.min_date = min_date
+        if max_date is not None and (entry.max_date is None or max_date > entry.max_date):
+            entry.max_date = max_date
+        if unit is not None and unit not in entry.units:
+            entry.units.append(unit)
+        if count:
+            entry.sources[source] = entry.sources.get(source, 0) + count
+    return sorted(entries.values(), key=lambda e: e.count, reverse=True)
+
+
+def write_catalog(conn: sqlite3.Connection, entries: Iterable[CatalogEntry]) -> None:
+    """Replace the catalog table's rows with entries."""
+    with conn:
+        conn.execute(CATALOG_SCHEMA)
+        conn.execute("DELETE FROM catalog")
+        conn.executemany("INSERT INTO catalog VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+            (e.kind, e.category, e.name, e.slug, e.count, e.min_date, e.max_date,
+             json.dumps(e.units), json.dumps(list(e.sources.items())))
+            for e in entries
+        ])
+
+
+def read_catalog(conn: sqlite3.Connection, groups_query: str, slug: Callable[[str], str]) -> list[CatalogEntry]:
+    """
+    The catalog, most rows first. A database preprocessed before there was a catalog table gets the same entries
+    from groups_query, the slow way.
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    try:
+        rows = cursor.execute("""
+            SELECT kind, category, name, slug, count, min_date, max_date, units, sources
+            FROM catalog ORDER BY count DESC
+        """).fetchall()
+    except sqlite3.OperationalError:
+        return fold_catalog(cursor.execute(groups_query), slug)
+    return [CatalogEntry(kind, category, name, slug_, count, min_date, max_date, json.loads(units),
+                         {source: n for source, n in json.loads(sources)})
+            for kind, category, name, slug_, count, min_date, max_date, units, sources in rows]
+
+
+class CatalogIndex:
+    """
+    A catalog keyed both ways for the pages and APIs: entries by name and by URL slug, and categories by slug.
+    Built once per version of a database, by get_catalog_index(), so each lookup is a dict access.
+    """
+
+    def __init__(self, entries: list[CatalogEntry], category_slug: Callable[[str], str] = lambda c: c):
+        self.entries = entries
+        self._by_name: dict[tuple[str, str, str], CatalogEntry] = {}
+        self._by_slug: dict[tuple[str, str, str], CatalogEntry] = {}
+        self._categories: dict[str, str] = {}
+        # Entries come most rows first, so when two names have the same slug, it goes to the bigger one
+        for entry in entries:
+            slug = category_slug(entry.category)
+            self._by_name.setdefault((entry.kind, entry.category, entry.name), entry)
+            self._by_slug.setdefault((entry.kind, slug, entry.slug), entry)
+            self._categories.setdefault(slug, entry.category)
+
+    def entry(self, kind: str, name: str, category: str = '') -> Optional[CatalogEntry]:
+        """The entry of a name, or None if there are no rows of it"""
+        return self._by_name.get((kind, category, name))
+
+    def entry_by_slug(self, kind: str, slug: str, category_slug: str = '') -> Optional[CatalogEntry]:
+        """The entry whose slug, and whose category's slug, are these, or None"""
+        return self._by_slug.get((kind, category_slug, slug))
+
+    def category(self, slug: str) -> Optional[str]:
+        """The category with this slug, or None if there are no rows in it"""
+        return self._categories.get(slug)
+
+
+_catalog_indexes: dict[Path, tuple[Optional[tuple], CatalogIndex]] = {}
+_catalog_indexes_lock = threading.Lock()
+
+
+def get_catalog_index(db_path: Path, read: Callable[[], list[CatalogEntry]],
+                      category_slug: Callable[[str], str] = lambda c: c) -> CatalogIndex:
+    """
+    The CatalogIndex of a database, rebuilt from read() when the file changes, like after an import. The index is
+    shared, so don't modify it.
+    """
+    signature = file_signature(db_path)
+    with _catalog_indexes_lock:
+        cached = _catalog_indexes.get(db_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+    index = CatalogIndex(read() if signature is not None else [], category_slug)
+    with _catalog_indexes_lock:
+        _catalog_indexes[db_path] = (signature, index)
+    return index
+
+
+# Chart tiles: a tile of level L has TILE_BUCKETS buckets of 2**L seconds, and tile i of a level starts at
+# i * TILE_BUCKETS * 2**L seconds since the epoch. A client zoomed in on a window asks for the few tiles of the level
+# that gives about one bucket per pixel, and can cache them, since a tile never changes until the data does.
+TILE_BUCKETS = 256
+MAX_TILE_LEVEL = 32
+
+
+def tile_bounds(level: int, index: int) -> tuple[int, int, int]:
+    """
+    :return: (start, end, bucket_seconds) of a tile, start and end in seconds since the epoch, end not included
+    """
+    if not 0 <= level <= MAX_TILE_LEVEL:
+        raise ValueError(f"Tile level must be from 0 to {MAX_TILE_LEVEL}, not {level}")
+    bucket_seconds = 2 ** level
+    start = index * TILE_BUCKETS * bucket_seconds
+    return start, start + TILE_BUCKETS * bucket_seconds, bucket_seconds
+
+
+def fold_tile(rows: Iterable[tuple], start: int, bucket_seconds: int) -> list[dict]:
+    """
+    The series of a tile, from query rows.
+    :param rows: (source, slot, mean, min, max, count) tuples, in slot order. slot is the bucket's number in the
+        tile, and source is None when sources are combined.
+    :return: [{"source": source, "points": [[ms, mean, min, max, count], ...]}, ...], sources in order of their
+        first point
+    """
+    series: dict[Optional[str], list] = {}
+    for source, slot, mean, low, high, count in rows:
+        series.setdefault(source, []).append([(start + slot * bucket_seconds) * 1000, mean, low, high, count])
+    return [{"source": source, "points": points} for source, points in series.items()]
+
+
 def convert_units(v, u):
     # TODO this should be optional, but we are parsing US data.
     if u == "kg":
@@ -172,6 +489,20 @@ def convert_units(v, u):
         u = "Fah"
     return v, u
 
+
+def unconvert_units(v, u):
+    """
+    Undo convert_units: the value in the unit the file had. Pounds are taken to be converted kilograms, since the
+    files record weight in kg.
+    """
+    if u == "lb":
+        v = v / 2.2
+        u = "kg"
+    elif u == "Fah":
+        v = (v - 32.0) * 5.0 / 9.0
+        u = "Cel"
+    return v, u
+
 def get_value_quantity(val: dict, test_name) -> ValueQuantity:
     v = val["value"]
     if 'unit' not in val:
@@ -182,7 +513,10 @@ def get_value_quantity(val: dict, test_name) -> ValueQuantity:
     vq = ValueQuantity(v, u, test_name)
     return vq
 
-def get_reference_range(rl: list) -> ReferenceRange:
+def get_reference_range(rl: list, unit: Optional[str] = None) -> ReferenceRange:
+    """
+    :param unit: The unit of the observation's value in the file, for numbers in the text, see ReferenceRange
+    """
     assert 1 == len(rl) # I've never seen a refernef
     r = rl[0]
     # if len(r) != 3
@@ -194,7 +528,7 @@ def get_reference_range(rl: list) -> ReferenceRange:
         low = None
         high = None
     text = r['text']
-    return ReferenceRange(low, high, text)
+    return ReferenceRange(low, high, text, unit)
 
 
 value_strings_seen = set()
@@ -236,7 +570,7 @@ def extract_value_helper(*, filename: str, condition: dict, stat_info) -> Option
                 v, u = convert_units(v, u)
             vq = ValueQuantity(v, u, sign_name)
             if "referenceRange" in condition:
-                rr = get_reference_range(condition["referenceRange"])
+                rr = get_reference_range(condition["referenceRange"], condition["valueQuantity"].get("unit"))
             else:
                 rr = None
             return Observation(name=t, date=d, data=[vq], range=rr, filename=Path(filename))
@@ -342,6 +676,113 @@ def list_prefixes(dir_path: Path) -> Counter:
     return extensions
 
 
+@dataclass
+class PrefixCatalog:
+    """
+    The resource types found in a clinical-records directory, like "Observation" or "Condition", with the files
+    for each. The prefix is the part of the file name before the first "-", same as list_prefixes.
+    prefixes counts the resources of each type: one per .json file, and one per line of an .ndjson file.
+    """
+    prefixes: Counter = field(default_factory=Counter)
+    files: dict[str, list[Path]] = field(default_factory=dict)
+
+    def resolve(self, resource_type: str) -> Optional[str]:
+        """
+        Find the exact prefix for a resource type from a URL, like "condition" -> "Condition".
+        :return: The prefix, or None if there are no files of that type.
+        """
+        lowered = resource_type.lower()
+        for prefix in self.prefixes:
+            if prefix.lower() == lowered:
+                return prefix
+        return None
+
+
+def build_prefix_catalog(dir_path: Path) -> PrefixCatalog:
+    catalog = PrefixCatalog()
+    for p in dir_path.glob("*.json"):
+        prefix = p.stem.split("-")[0]
+        catalog.prefixes[prefix] += 1
+        catalog.files.setdefault(prefix, []).append(p)
+    # convert_synthea.py --output-format ndjson writes one file per type, with a resource on each line
+    for p in dir_path.glob("*.ndjson"):
+        prefix = p.stem.split("-")[0]
+        with open(p, "rb") as f:
+            catalog.prefixes[prefix] += sum(1 for line in f if line.strip())
+        catalog.files.setdefault(prefix, []).append(p)
+    return catalog
+
+
+def directory_signature(dir_path: Path) -> Optional[tuple[int, int, int]]:
+    """
+    A cheap fingerprint of a directory's list of entries. Adding, removing or renaming a file changes the mtime of
+    the directory, and replacing the directory changes the inode. Editing a file in place changes neither, which is
+    fine for anything that only depends on file names.
+    :return: (inode, mtime_ns, link count), or None if the directory does not exist.
+    """
+    try:
+        st = os.stat(dir_path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_nlink
+
+
+_ndjson_files: dict[Path, tuple[tuple[int, int, int], list[Path]]] = {}
+_ndjson_files_lock = threading.Lock()
+
+
+def ndjson_files(dir_path: Path) -> list[Path]:
+    """The directory's .ndjson files. The directory is only listed again when directory_signature changes."""
+    signature = directory_signature(dir_path)
+    if signature is None:
+        return []
+    with _ndjson_files_lock:
+        cached = _ndjson_files.get(dir_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    files = sorted(dir_path.glob("*.ndjson"))
+    with _ndjson_files_lock:
+        _ndjson_files[dir_path] = (signature, files)
+    return files
+
+
+def content_signature(dir_path: Path) -> Optional[tuple]:
+    """
+    directory_signature, plus the file_signature of each .ndjson file. An .ndjson file holds many resources and can
+    be rewritten in place, which the directory's signature doesn't show.
+    :return: None if the directory does not exist
+    """
+    signature = directory_signature(dir_path)
+    if signature is None:
+        return None
+    return signature, tuple(file_signature(p) for p in ndjson_files(dir_path))
+
+
+_prefix_catalogs: dict[Path, tuple[Optional[tuple], PrefixCatalog]] = {}
+_prefix_catalogs_lock = threading.Lock()
+
+
+def get_prefix_catalog(dir_path: Path) -> PrefixCatalog:
+    """
+    Same information as build_prefix_catalog, but only rescans the directory when content_signature changes.
+    The returned catalog is shared, so don't modify it.
+    """
+    signature = content_signature(dir_path)
+    with _prefix_catalogs_lock:
+        cached = _prefix_catalogs.get(dir_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+    catalog = build_prefix_catalog(dir_path) if signature is not None else PrefixCatalog()
+    with _prefix_catalogs_lock:
+        _prefix_catalogs[dir_path] = (signature, catalog)
+    return catalog
+
+
+def clear_prefix_catalogs() -> None:
+    with _prefix_catalogs_lock:
+        _prefix_catalogs.clear()
+
+
 def list_categories(dir_path: Path, only_first, *, one_prefix) -> (list[tuple], Counter, int):
     """
     The schema of this data is not well-designed. I have seen category expressed FOUR ways so far.
@@ -405,3 +846,558 @@ def list_categories(dir_path: Path, only_first, *, one_prefix) -> (list[tuple],
 
     c_sorted = sorted(counter, key=lambda x: counter[x], reverse=True)
     return c_sorted, counter, count
+
+
+def _category_texts(category_info) -> list[str]:
+    """
+    The category text for each entry of an Observation's "category" list. See list_categories for the formats.
+    """
+    if isinstance(category_info, dict):
+        category_info = [category_info]
+    assert isinstance(category_info, list)
+    return [ci['text'] if isinstance(ci, dict) else ci for ci in category_info]
+
+
+def _observation_to_payload(ob: Observation) -> str:
+    data = []
+    for d in ob.data or []:
+        if isinstance(d, ValueString):
+            data.append(["s", d.value, d.name])
+        else:
+            data.append(["q", d.value, d.unit, d.name])
+    rr = None
+    if ob.range is not None:
+        rr = [
+            [ob.range.low.value, ob.range.low.unit] if ob.range.low else None,
+            [ob.range.high.value, ob.range.high.unit] if ob.range.high else None,
+            ob.range.text,
+            ob.range.unit,
+        ]
+    return json.dumps({"data": data, "range": rr}, separators=(",", ":"))
+
+
+def _observation_from_payload(name: str, date: str, payload: str, filename: Path) -> Observation:
+    decoded = json.loads(payload)
+    data = []
+    for d in decoded["data"]:
+        if d[0] == "s":
+            data.append(ValueString(value=d[1], name=d[2]))
+        else:
+            data.append(ValueQuantity(d[1], d[2], d[3]))
+    rr = None
+    if decoded["range"] is not None:
+        low, high, text, unit = decoded["range"]
+        rr = ReferenceRange(
+            ValueQuantity(low[0], low[1], "low") if low else None,
+            ValueQuantity(high[0], high[1], "high") if high else None,
+            text,
+            unit,
+        )
+    return Observation(name=name, date=date, data=data, range=rr, filename=filename)
+
+
+def observation_postings(filename: str, observation: dict) -> list[tuple]:
+    """
+    The index entries for one Observation resource, one per category it is in.
+    :param filename: Just for printing error messages
+    :return: list of (category, name, date, payload, value, ref_low, ref_high, ref_op). payload is None if
+        extract_value_helper couldn't parse it. value is only set for a single numeric value, and the ref_ fields are
+        ReferenceRange.bounds, when there are any.
+    """
+    try:
+        name = observation['code']['text']
+        categories = _category_texts(observation['category'])
+    except (AssertionError, KeyError, TypeError) as e:
+        print(F"*** Could not index {filename}: {e!r} ***")
+        return []
+    date = observation.get('effectiveDateTime')
+    postings = []
+    for category in categories:
+        try:
+            ob = extract_value_helper(filename=filename, condition=observation, stat_info=StatInfo(category, name))
+            payload = _observation_to_payload(ob) if ob is not None else None
+        except (AssertionError, KeyError, TypeError, ValueError) as e:
+            print(F"*** Could not index {filename}: {e!r} ***")
+            ob = payload = None
+        value = None
+        bounds = None
+        if payload is not None:
+            if len(ob.data) == 1 and isinstance(ob.data[0], ValueQuantity):
+                value = ob.data[0].value
+            if ob.range is not None:
+                bounds = ob.range.bounds()
+        postings.append((category, name, date, payload, value) + (bounds or (None, None, None)))
+    return postings
+
+
+def yield_ndjson_resources(path: Path) -> Iterable[tuple[int, dict]]:
+    """
+    Read a file with one resource per line (NDJSON), like the ones convert_synthea.py writes, sequentially.
+    :return: (byte offset of the line, resource) for each non-blank line
+    """
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                yield offset, json.loads(line)
+            offset += len(line)
+
+
+def read_resource(path: Path, offset: int = 0) -> dict:
+    """Read one resource, from a .json file, or from the line at offset in a .ndjson file."""
+    with open(path, "rb") as f:
+        if path.suffix == ".ndjson":
+            f.seek(offset)
+            return json.loads(f.readline())
+        return json.load(f)
+
+
+def yield_resources(path: Path) -> Iterable[tuple[int, dict]]:
+    """The resources in a .json or .ndjson file, as (offset, resource), with the offsets read_resource takes."""
+    if path.suffix == ".ndjson":
+        yield from yield_ndjson_resources(path)
+    else:
+        with open(path, "rb") as f:
+            yield 0, json.load(f)
+
+
+@dataclass(frozen=True)
+class FileState:
+    """What we remember about a file in the index manifest."""
+    size: int
+    mtime_ns: int
+    digest: str
+
+
+@dataclass
+class ChangeSet:
+    """
+    The difference between a directory and the index manifest, as file names.
+    touched files have a new size or mtime, but the same content, so only the manifest needs updating.
+    """
+    inserted: list[str] = field(default_factory=list)
+    updated: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+    touched: list[str] = field(default_factory=list)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.inserted or self.updated or self.deleted)
+
+    def __str__(self):
+        return (F"{len(self.inserted)} inserted, {len(self.updated)} updated, {len(self.deleted)} deleted, "
+                F"{len(self.touched)} touched")
+
+
+def file_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def scan_changes(dir_path: Path, manifest: dict[str, FileState], prefix: str = "Observation") -> ChangeSet:
+    """
+    Compare a directory against a manifest, using os.scandir. Only files whose size or mtime differs from the
+    manifest are read, to compare their content hash.
+    :param dir_path: Directory to scan
+    :param manifest: file name -> FileState, as of the last scan
+    :param prefix: Only consider files like prefix*.json or prefix*.ndjson
+    :return: ChangeSet
+    """
+    changes = ChangeSet()
+    seen = set()
+    try:
+        entries = list(os.scandir(dir_path))
+    except FileNotFoundError:
+        entries = []
+    for entry in entries:
+        if not entry.name.startswith(prefix) or not entry.name.endswith((".json", ".ndjson")) or not entry.is_file():
+            continue
+        seen.add(entry.name)
+        old = manifest.get(entry.name)
+        if old is None:
+            changes.inserted.append(entry.name)
+            continue
+        try:
+            st = entry.stat()
+            if old.size == st.st_size and old.mtime_ns == st.st_mtime_ns:
+                continue
+            with open(entry.path, "rb") as f:
+                digest = file_digest(f.read())
+        except OSError:
+            # Deleted since the directory was listed
+            seen.discard(entry.name)
+            continue
+        if digest == old.digest:
+            changes.touched.append(entry.name)
+        else:
+            changes.updated.append(entry.name)
+    changes.deleted = sorted(manifest.keys() - seen)
+    changes.inserted.sort()
+    return changes
+
+
+class ObservationIndex:
+    """
+    An inverted index of Observation files, stored in SQLite: category -> code text -> (file, offset).
+
+    A source is either a single-resource .json file (offset 0), an .ndjson file with one resource per line (offset
+    is the byte offset of the line), or resources ingested directly with add_postings, which have no file at all.
+
+    It is built in one pass over the files, and then kept up to date by adding and removing individual files.
+    Along with each posting we store the values extract_value_helper found for it, so most lookups don't open any
+    files. If a file couldn't be parsed when it was indexed, the payload is NULL, and lookups read the file again,
+    so the assertion shows up where it always did.
+    """
+
+    def __init__(self, db_path: Path, dir_path: Path):
+        """
+        :param db_path: The SQLite file to keep the index in. Created if it doesn't exist.
+        :param dir_path: The clinical-records directory being indexed. Only file names are stored in the index.
+        """
+        self.db_path = db_path
+        self.dir_path = dir_path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._create_schema()
+
+    # Bump this when the tables change. An index with a different version is dropped and rebuilt.
+    SCHEMA_VERSION = 5
+
+    def _create_schema(self) -> None:
+        with self._lock:
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                self.conn.execute("DROP TABLE IF EXISTS fhir_observations")
+                self.conn.execute("DROP TABLE IF EXISTS fhir_files")
+                self.conn.execute(F"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            # size, mtime_ns and digest are the manifest used by scan_changes. They are NULL for ingested sources.
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS fhir_files (
+                    id INTEGER PRIMARY KEY,
+                    filename TEXT NOT NULL UNIQUE,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    digest TEXT
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS fhir_observations (
+                    file_id INTEGER NOT NULL,
+                    offset INTEGER NOT NULL DEFAULT 0,
+                    category TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    date TEXT,
+                    payload TEXT,
+                    value REAL,
+                    ref_low REAL,
+                    ref_high REAL,
+                    ref_op TEXT
+                )
+            """)
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_fhir_obs_category_name ON fhir_observations (category, name)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_fhir_obs_file ON fhir_observations (file_id)")
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+    def _insert_source(self, filename: str, state: Optional[FileState]) -> int:
+        size, mtime_ns, digest = (state.size, state.mtime_ns, state.digest) if state else (None, None, None)
+        cursor = self.conn.execute("INSERT INTO fhir_files (filename, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                                   (filename, size, mtime_ns, digest))
+        return cursor.lastrowid
+
+    def _insert_postings(self, file_id: int, offset: int, postings: list[tuple]) -> None:
+        self.conn.executemany(
+            "INSERT INTO fhir_observations (file_id, offset, category, name, date, payload, value, ref_low, ref_high, "
+            "ref_op) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(file_id, offset) + posting for posting in postings])
+
+    def _remove(self, filenames: Iterable[str]) -> None:
+        for filename in filenames:
+            row = self.conn.execute("SELECT id FROM fhir_files WHERE filename = ?", (filename,)).fetchone()
+            if row is None:
+                continue
+            self.conn.execute("DELETE FROM fhir_observations WHERE file_id = ?", (row[0],))
+            self.conn.execute("DELETE FROM fhir_files WHERE id = ?", (row[0],))
+
+    def _add_file(self, p: Path) -> bool:
+        """
+        Index one file, replacing any earlier entries for it. A file that is gone is dropped. Resources that aren't
+        valid JSON are skipped, and a file with none is still kept in the manifest, so it isn't read again until it
+        changes.
+        :return: False if the file couldn't be read
+        """
+        self._remove([p.name])
+        try:
+            with open(p, "rb") as f:
+                st = os.fstat(f.fileno())
+                data = f.read()
+        except OSError as e:
+            print(F"*** Could not index {p.name}: {e!r} ***")
+            return False
+        file_id = self._insert_source(p.name, FileState(st.st_size, st.st_mtime_ns, file_digest(data)))
+        if p.suffix == ".ndjson":
+            lines = []
+            offset = 0
+            for line in data.splitlines(keepends=True):
+                if line.strip():
+                    lines.append((offset, line))
+                offset += len(line)
+        else:
+            lines = [(0, data)]
+        for offset, line in lines:
+            try:
+                resource = json.loads(line)
+            except ValueError as e:
+                print(F"*** Could not index {p.name} at {offset}: {e!r} ***")
+                continue
+            self._insert_postings(file_id, offset, observation_postings(p.name, resource))
+        return True
+
+    def add_files(self, files: Iterable[Path]) -> int:
+        """
+        Index the given files, replacing any earlier entries for files with the same name, in one transaction.
+        A file that can't be read or parsed doesn't stop the others, see _add_file.
+        :return: The number of files indexed.
+        """
+        with self._lock, self.conn:
+            return sum(self._add_file(Path(p)) for p in files)
+
+    def add_postings(self, source: str, postings: Iterable[tuple[int, list[tuple]]]) -> None:
+        """
+        Index resources that don't live in a file, replacing any earlier entries for the same source.
+        The manifest ignores these, so a directory scan never deletes them.
+        :param source: A name for where the resources came from, like "synthea/bundle.json"
+        :param postings: (ordinal, observation_postings(...)) for each resource
+        """
+        with self._lock:
+            self._remove([source])
+            file_id = self._insert_source(source, None)
+            for ordinal, resource_postings in postings:
+                self._insert_postings(file_id, ordinal, resource_postings)
+            self.conn.commit()
+
+    def remove_files(self, filenames: Iterable[str]) -> None:
+        """Drop the given file names (not paths) from the index."""
+        with self._lock:
+            self._remove(filenames)
+            self.conn.commit()
+
+    def has_ingested_sources(self) -> bool:
+        """Are there resources from add_postings, which the directory's files don't show?"""
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM fhir_files WHERE size IS NULL LIMIT 1").fetchone() is not None
+
+    def indexed_filenames(self) -> set[str]:
+        with self._lock:
+            return {row[0] for row in self.conn.execute("SELECT filename FROM fhir_files")}
+
+    def build(self) -> int:
+        """
+        Throw away the index, including any ingested sources, and rebuild it from every Observation file in the
+        directory.
+        :return: The number of files indexed.
+        """
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM fhir_observations")
+            self.conn.execute("DELETE FROM fhir_files")
+            names = scan_changes(self.dir_path, {}).inserted
+            return sum(self._add_file(self.dir_path / name) for name in names)
+
+    def manifest(self) -> dict[str, FileState]:
+        """The state of every indexed file, as of when it was indexed."""
+        with self._lock:
+            return {row[0]: FileState(row[1], row[2], row[3]) for row in self.conn.execute(
+                "SELECT filename, size, mtime_ns, digest FROM fhir_files WHERE size IS NOT NULL")}
+
+    def generation(self) -> str:
+        """
+        A digest of what is in the index, which changes whenever a source is added, updated or removed.
+        Things derived from the index can keep this to know when they are stale.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        with self._lock:
+            for row in self.conn.execute("SELECT id, filename, digest FROM fhir_files ORDER BY id"):
+                h.update(repr(row).encode("utf-8"))
+            h.update(repr(self.conn.execute("SELECT COUNT(*) FROM fhir_observations").fetchone()).encode("utf-8"))
+        return h.hexdigest()
+
+    def scan(self) -> ChangeSet:
+        """Find what changed in the directory since the last sync, without changing the index."""
+        return scan_changes(self.dir_path, self.manifest())
+
+    def apply_changes(self, changes: ChangeSet) -> None:
+        """
+        Apply only the inserts, updates and deletes in changes to the index, in one transaction. Files that are gone
+        by now are dropped.
+        """
+        with self._lock, self.conn:
+            self._remove(changes.deleted)
+            for name in changes.inserted + changes.updated:
+                self._add_file(self.dir_path / name)
+            for name in changes.touched:
+                try:
+                    st = os.stat(self.dir_path / name)
+                except OSError:
+                    self._remove([name])
+                    continue
+                self.conn.execute("UPDATE fhir_files SET size = ?, mtime_ns = ? WHERE filename = ?",
+                                  (st.st_size, st.st_mtime_ns, name))
+
+    def sync(self) -> ChangeSet:
+        """
+        Bring the index up to date with the directory.
+        :return: The changes that were applied
+        """
+        with self._lock:
+            changes = self.scan()
+            self.apply_changes(changes)
+        return changes
+
+    def list_categories(self) -> (list[str], Counter, int):
+        """
+        Same as list_categories(dir_path, False, one_prefix="Observation"), from the index.
+        :return: c_sorted, counter, count
+        """
+        with self._lock:
+            counter = Counter({row[0]: row[1] for row in self.conn.execute(
+                "SELECT category, COUNT(*) FROM fhir_observations GROUP BY category")})
+            count = self.conn.execute(
+                "SELECT COUNT(*) FROM (SELECT DISTINCT file_id, offset FROM fhir_observations)").fetchone()[0]
+        c_sorted = sorted(counter, key=lambda x: counter[x], reverse=True)
+        return c_sorted, counter, count
+
+    def list_vitals(self, category: str) -> Counter:
+        """
+        Same as list_vitals(yield_observation_files(dir_path), category), from the index.
+        :return: Counter: Vital Sign Name: Number of times seen
+        """
+        with self._lock:
+            return Counter({row[0]: row[1] for row in self.conn.execute(
+                "SELECT name, COUNT(*) FROM fhir_observations WHERE category = ? GROUP BY name", (category,))})
+
+    def files_for(self, stat_info: StatInfo) -> list[Path]:
+        """The files holding observations of one vital sign in one category."""
+        with self._lock:
+            rows = self.conn.execute("""
+                SELECT DISTINCT f.filename FROM fhir_observations o JOIN fhir_files f ON f.id = o.file_id
+                WHERE o.category = ? AND o.name = ?
+            """, (stat_info.category_name, stat_info.name)).fetchall()
+        return [self.dir_path / row[0] for row in rows]
+
+    def extract_all_values(self, stat_info: StatInfo) -> list[Observation]:
+        """
+        Same as extract_all_values(yield_observation_files(dir_path), stat_info=stat_info), from the index.
+        Only resources that could not be parsed when indexing are read again.
+        """
+        with self._lock:
+            rows = self.conn.execute("""
+                SELECT f.filename, f.size, o.offset, o.date, o.payload
+                FROM fhir_observations o JOIN fhir_files f ON f.id = o.file_id
+                WHERE o.category = ? AND o.name = ?
+            """, (stat_info.category_name, stat_info.name)).fetchall()
+        values = []
+        for filename, size, offset, date, payload in rows:
+            path = self.dir_path / filename
+            if payload is not None:
+                values.append(_observation_from_payload(stat_info.name, date, payload, path))
+            elif size is not None:  # Ingested sources have no file to go back to
+                value = extract_value_helper(filename=str(path), condition=read_resource(path, offset),
+                                             stat_info=stat_info)
+                if value is not None:
+                    values.append(value)
+        values = sorted(values, key=lambda x: x.date)
+        return values
+
+
+    def reference_range(self, stat_info: StatInfo) -> Optional[tuple[Optional[float], Optional[float], str]]:
+        """
+        The reference range most observations of a vital sign have, from the precomputed columns.
+        :return: (low, high, op) as from ReferenceRange.bounds, or None if none of them have a numeric range
+        """
+        with self._lock:
+            return self.conn.execute("""
+                SELECT ref_low, ref_high, ref_op FROM fhir_observations
+                WHERE category = ? AND name = ? AND ref_op IS NOT NULL
+                GROUP BY ref_low, ref_high, ref_op ORDER BY COUNT(*) DESC LIMIT 1
+            """, (stat_info.category_name, stat_info.name)).fetchone()
+
+    def list_out_of_range(self, category: Optional[str] = None) -> list[tuple]:
+        """
+        Single-value observations outside their own reference range, newest first.
+        :param category: Only this category, or all of them
+        :return: list of (category, name, date, value, ref_low, ref_high, ref_op, filename)
+        """
+        where = "" if category is None else "AND o.category = ?"
+        with self._lock:
+            return self.conn.execute(f"""
+                SELECT o.category, o.name, o.date, o.value, o.ref_low, o.ref_high, o.ref_op, f.filename
+                FROM fhir_observations o JOIN fhir_files f ON f.id = o.file_id
+                WHERE o.value IS NOT NULL AND ({OUT_OF_RANGE_SQL}) {where}
+                ORDER BY o.date DESC
+            """, () if category is None else (category,)).fetchall()
+
+    def iter_observations(self) -> Iterable[Observation]:
+        """
+        Every observation that was parsed when it was indexed, once each, even if it is in several categories.
+        Rows are read up front, so the lock isn't held while the caller works through them.
+        """
+        with self._lock:
+            rows = self.conn.execute("""
+                SELECT f.filename, o.name, o.date, MIN(o.payload)
+                FROM fhir_observations o JOIN fhir_files f ON f.id = o.file_id
+                WHERE o.payload IS NOT NULL
+                GROUP BY o.file_id, o.offset
+                ORDER BY o.file_id, o.offset
+            """).fetchall()
+        for filename, name, date, payload in rows:
+            yield _observation_from_payload(name, date, payload, self.dir_path / filename)
+
+
+_observation_indexes: dict[Path, tuple[Optional[tuple], ObservationIndex]] = {}
+_observation_indexes_lock = threading.Lock()
+
+
+def _open_observation_index(dir_path: Path, db_path: Path) -> tuple[Optional[tuple], ObservationIndex]:
+    """Must be called holding _observation_indexes_lock"""
+    cached = _observation_indexes.get(db_path)
+    if cached is not None and cached[1].dir_path != dir_path:
+        cached[1].close()
+        cached = None
+    if cached is None:
+        cached = (None, ObservationIndex(db_path, dir_path))
+    return cached
+
+
+def sync_observation_index(dir_path: Path, db_path: Path) -> ChangeSet:
+    """
+    Scan the directory and apply any changes to the shared index, even if the directory itself looks unchanged.
+    .json files edited in place don't change content_signature, so this is what a background poller should call.
+    Cached prefix catalogs for the directory are dropped if anything changed.
+    """
+    with _observation_indexes_lock:
+        _, index = _open_observation_index(dir_path, db_path)
+        signature = content_signature(dir_path)
+        changes = index.sync()
+        _observation_indexes[db_path] = (signature, index)
+    if changes.changed:
+        with _prefix_catalogs_lock:
+            _prefix_catalogs.pop(dir_path, None)
+    return changes
+
+
+def get_observation_index(dir_path: Path, db_path: Path) -> ObservationIndex:
+    """
+    Get the shared index for a directory, syncing it first if the directory has changed since the last sync.
+    Like get_prefix_catalog, this uses content_signature, so it costs a few stat() calls when nothing has changed.
+    """
+    signature = content_signature(dir_path)
+    with _observation_indexes_lock:
+        cached = _observation_indexes.get(db_path)
+        if cached is not None and cached[1].dir_path == dir_path and cached[0] == signature:
+            return cached[1]
+    sync_observation_index(dir_path, db_path)
+    with _observation_indexes_lock:
+        return _observation_indexes[db_path][1]
@@ -4,14 +4,18 @@ Apple Health data access functions for SQLite database.
 
 import sqlite3
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Iterator, Optional, Sequence, Tuple, Union
 from dataclasses import dataclass
 from collections import Counter
 from datetime import datetime, timedelta
 import config
+from health_lib import TimeSeries, DEFAULT_CHUNK_SIZE, iter_cursor, projection, CatalogEntry, fold_catalog, \
+    write_catalog, read_catalog, tile_bounds, fold_tile, CatalogIndex, get_catalog_index
+from db_pool import row_pool, tuple_cursor
+from timing import timed
 
 
-@dataclass
+@dataclass(slots=True)
 class AppleHealthRecord:
     """Data class for Apple Health records from database"""
     id: int
@@ -26,7 +30,7 @@ class AppleHealthRecord:
     end_date: str
 
 
-@dataclass
+@dataclass(slots=True)
 class AppleHealthCategory:
     """Data class for Apple Health record categories"""
     name: str
@@ -37,7 +41,7 @@ class AppleHealthCategory:
     icon_color: str
 
 
-@dataclass
+@dataclass(slots=True)
 class ActivitySummary:
     """Data class for daily activity summary"""
     date: str
@@ -52,177 +56,420 @@ class ActivitySummary:
 
 
 def get_apple_health_connection() -> sqlite3.Connection:
-    """Get connection to Apple Health database"""
+    """Get this thread's read-only connection to the Apple Health database"""
     db_path = config.get_apple_health_database_path()
     if not db_path.exists():
         raise FileNotFoundError(f"Apple Health database not found: {db_path}")
     
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row  # Enable dict-like access to rows
-    return conn
+    # This thread's pooled read-only connection, with dict-like access to rows. Callers don't close it.
+    return row_pool.connection(db_path)
 
 
-def list_apple_health_categories() -> List[AppleHealthCategory]:
-    """List all Apple Health record categories with counts"""
+# The catalog's rows before folding: per record type, source and unit. Activity summaries and workouts are
+# counted as whole tables.
+APPLE_CATALOG_GROUPS = """
+    SELECT 'record', '', type, source_name, unit, COUNT(*), MIN(start_date), MAX(start_date)
+    FROM apple_health_records GROUP BY type, source_name, unit
+    UNION ALL
+    SELECT 'table', '', 'activity_summaries', NULL, NULL, COUNT(*), MIN(date_components), MAX(date_components)
+    FROM activity_summaries
+    UNION ALL
+    SELECT 'table', '', 'workouts', NULL, NULL, COUNT(*), MIN(start_date), MAX(start_date) FROM workouts
+"""
+
+
+def record_type_slug(record_type: str) -> str:
+    """URL-safe name of a record type, like heartrate for HKQuantityTypeIdentifierHeartRate"""
+    return record_type.lower().replace('hkquantitytypeidentifier', '').replace('hkcategorytypeidentifier', '')
+
+
+def build_apple_catalog(conn: sqlite3.Connection) -> List[CatalogEntry]:
+    """Write the catalog table of an Apple Health database, after an import."""
+    entries = fold_catalog(conn.execute(APPLE_CATALOG_GROUPS), record_type_slug)
+    write_catalog(conn, entries)
+    return entries
+
+
+@timed("query")
+def get_apple_catalog() -> List[CatalogEntry]:
+    """Every record type with its count, date range, units and sources, most records first, from the catalog"""
     if not config.has_apple_health_database():
         return []
-    
-    conn = get_apple_health_connection()
-    
-    # Get all record types with counts
-    cursor = conn.execute("""
-        SELECT type, COUNT(*) as count 
-        FROM apple_health_records 
-        GROUP BY type 
-        ORDER BY count DESC
+    return read_catalog(get_apple_health_connection(), APPLE_CATALOG_GROUPS, record_type_slug)
+
+
+def get_apple_catalog_index() -> CatalogIndex:
+    """The catalog keyed by record type and by slug, rebuilt when the database changes"""
+    return get_catalog_index(config.get_apple_health_database_path(), get_apple_catalog)
+
+
+def get_apple_catalog_entry(record_type: str) -> Optional[CatalogEntry]:
+    """The catalog entry of one record type, or None if there are no records of it"""
+    return get_apple_catalog_index().entry('record', record_type)
+
+
+def resolve_record_type(record_type: str) -> Optional[str]:
+    """
+    The record type of a URL slug, like HKQuantityTypeIdentifierHeartRate for heartrate. A record type, in any
+    case, resolves to itself.
+    :return: The record type, or None if there are no records of it
+    """
+    entry = get_apple_catalog_index().entry_by_slug('record', record_type_slug(record_type))
+    return entry.name if entry else None
+
+
+# Chart bucket sizes, as the strftime format of their labels
+ROLLUP_BUCKETS = {
+    'minute': '%Y-%m-%d %H:%M:00',
+    'hour': '%Y-%m-%d %H:00:00',
+    'day': '%Y-%m-%d',
+    'week': '%Y-%W',
+    'month': '%Y-%m',
+}
+
+
+def create_rollup_schema(conn: sqlite3.Connection) -> None:
+    """
+    apple_rollups holds count, sum, min and max of the values of each record type and source, per bucket of every
+    size in ROLLUP_BUCKETS. apple_rollup_state has the last record id rolled up, so new records can be added
+    without rolling up the old ones again. A missing unit is stored as ''.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS apple_rollups (
+            type TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            time_bucket TEXT NOT NULL,
+            source_name TEXT NOT NULL,
+            unit TEXT NOT NULL,
+            value_count INTEGER NOT NULL,
+            value_sum REAL NOT NULL,
+            value_min REAL NOT NULL,
+            value_max REAL NOT NULL,
+            PRIMARY KEY (type, bucket, time_bucket, source_name, unit)
+        ) WITHOUT ROWID
     """)
-    
+    conn.execute("CREATE TABLE IF NOT EXISTS apple_rollup_state (last_record_id INTEGER NOT NULL)")
+
+
+def refresh_apple_rollups(conn: sqlite3.Connection) -> int:
+    """
+    Add the records imported since the last refresh to the rollups, creating them the first time.
+    :return: the number of records added
+    """
+    create_rollup_schema(conn)
+    row = conn.execute("SELECT last_record_id FROM apple_rollup_state").fetchone()
+    last_id = row[0] if row else 0
+    max_id, added = conn.execute("SELECT MAX(id), COUNT(*) FROM apple_health_records WHERE id > ?",
+                                 (last_id,)).fetchone()
+    if not added:
+        return 0
+    with conn:
+        for bucket, bucket_format in ROLLUP_BUCKETS.items():
+            conn.execute(f"""
+                INSERT INTO apple_rollups
+                SELECT type, ?, strftime('{bucket_format}', start_date) AS time_bucket, source_name,
+                       ifnull(unit, '') AS unit_, COUNT(*), SUM(value), MIN(value), MAX(value)
+                FROM apple_health_records
+                WHERE id > ? AND id <= ? AND value IS NOT NULL AND time_bucket IS NOT NULL
+                GROUP BY type, time_bucket, source_name, unit_
+                ON CONFLICT (type, bucket, time_bucket, source_name, unit) DO UPDATE SET
+                    value_count = value_count + excluded.value_count,
+                    value_sum = value_sum + excluded.value_sum,
+                    value_min = min(value_min, excluded.value_min),
+                    value_max = max(value_max, excluded.value_max)
+            """, (bucket, last_id, max_id))
+        conn.execute("DELETE FROM apple_rollup_state")
+        conn.execute("INSERT INTO apple_rollup_state VALUES (?)", (max_id,))
+    return added
+
+
+def has_apple_rollups(conn: sqlite3.Connection) -> bool:
+    """False for a database preprocessed before there were rollups"""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'apple_rollup_state'").fetchone() is not None
+
+
+def _rollup_where(record_type: str, bucket: str, after: Optional[str], before: Optional[str],
+                  source: Optional[str]) -> Tuple[str, list]:
+    # after and before select whole buckets: the ones the times fall in and everything between
+    bucket_format = ROLLUP_BUCKETS[bucket]
+    where = ["type = ? AND bucket = ?"]
+    params = [record_type, bucket]
+    if after:
+        where.append(f"time_bucket >= strftime('{bucket_format}', ?)")
+        params.append(after)
+    if before:
+        where.append(f"time_bucket <= strftime('{bucket_format}', ?)")
+        params.append(before)
+    if source:
+        where.append("source_name = ?")
+        params.append(source)
+    return " AND ".join(where), params
+
+
+@timed("query")
+def count_apple_records(record_type: str, after: Optional[str] = None, before: Optional[str] = None,
+                        source: Optional[str] = None) -> int:
+    """Records of a type with a value, from the daily rollups, so after and before count to the day."""
+    if not config.has_apple_health_database():
+        return 0
+    conn = get_apple_health_connection()
+    if has_apple_rollups(conn):
+        where, params = _rollup_where(record_type, 'day', after, before, source)
+        return conn.execute(f"SELECT ifnull(SUM(value_count), 0) FROM apple_rollups WHERE {where}",
+                            params).fetchone()[0]
+
+    query = "SELECT COUNT(*) FROM apple_health_records WHERE type = ? AND value IS NOT NULL"
+    params = [record_type]
+    if after:
+        query += " AND start_date >= ?"
+        params.append(after)
+    if before:
+        query += " AND start_date <= ?"
+        params.append(before)
+    if source:
+        query += " AND source_name = ?"
+        params.append(source)
+    return conn.execute(query, params).fetchone()[0]
+
+
+@timed("query")
+def get_apple_rollups(record_type: str, bucket: str, after: Optional[str] = None, before: Optional[str] = None,
+                      source: Optional[str] = None, cumulative: bool = False) -> Optional[List[sqlite3.Row]]:
+    """
+    Chart points of a record type, per bucket and unit, from the rollups.
+    :param bucket: one of ROLLUP_BUCKETS
+    :param cumulative: avg_value is the sum of the bucket's values, like for steps, instead of their average
+    :return: rows of time_bucket, avg_value, min_value, max_value, count and unit, in time order. None if the database
+        has no rollups.
+    """
+    if not config.has_apple_health_database():
+        return []
+    conn = get_apple_health_connection()
+    if not has_apple_rollups(conn):
+        return None
+    where, params = _rollup_where(record_type, bucket, after, before, source)
+    value = "SUM(value_sum)" if cumulative else "SUM(value_sum) / SUM(value_count)"
+    return conn.execute(f"""
+        SELECT time_bucket, {value} AS avg_value, MIN(value_min) AS min_value, MAX(value_max) AS max_value,
+               SUM(value_count) AS count, nullif(unit, '') AS unit
+        FROM apple_rollups WHERE {where}
+        GROUP BY time_bucket, unit
+        ORDER BY time_bucket
+    """, params).fetchall()
+
+
+# The rollups tiles are made from, coarsest first, with their bucket length in seconds
+TILE_ROLLUPS = (('day', 86400), ('hour', 3600), ('minute', 60))
+
+
+@timed("query")
+def get_apple_tile(record_type: str, level: int, index: int, source: Optional[str] = None,
+                   by_source: bool = False) -> List[dict]:
+    """
+    Chart points of a record type in one tile (see health_lib.tile_bounds). They come from the coarsest rollups with
+    buckets no longer than the tile's, where a rollup bucket counts in the tile bucket it starts in, or from the
+    records, for buckets under a minute or a database with no rollups.
+    :param by_source: a series per source, instead of one for all of them
+    :return: series, as health_lib.fold_tile makes them
+    """
+    start, end, bucket_seconds = tile_bounds(level, index)
+    if not config.has_apple_health_database():
+        return []
+    conn = get_apple_health_connection()
+    group = "source_name" if by_source else "NULL"
+    rollup = None
+    if has_apple_rollups(conn):
+        rollup = next((bucket for bucket, seconds in TILE_ROLLUPS if seconds <= bucket_seconds), None)
+
+    if rollup:
+        bucket_format = ROLLUP_BUCKETS[rollup]
+        query = f"""
+            SELECT {group} AS source, (CAST(strftime('%s', time_bucket) AS INTEGER) - ?) / ? AS slot,
+                   SUM(value_sum) / SUM(value_count), MIN(value_min), MAX(value_max), SUM(value_count)
+            FROM apple_rollups
+            WHERE type = ? AND bucket = ? AND time_bucket >= strftime('{bucket_format}', ?, 'unixepoch')
+                AND time_bucket < strftime('{bucket_format}', ?, 'unixepoch')
+        """
+        params = [start, bucket_seconds, record_type, rollup, start, end]
+    else:
+        query = f"""
+            SELECT {group} AS source, (CAST(strftime('%s', start_date) AS INTEGER) - ?) / ? AS slot,
+                   AVG(value), MIN(value), MAX(value), COUNT(*)
+            FROM apple_health_records
+            WHERE type = ? AND value IS NOT NULL
+                AND start_date >= strftime('%Y-%m-%dT%H:%M:%S', ?, 'unixepoch')
+                AND start_date < strftime('%Y-%m-%dT%H:%M:%S', ?, 'unixepoch')
+        """
+        params = [start, bucket_seconds, record_type, start, end]
+    if source:
+        query += " AND source_name = ?"
+        params.append(source)
+    query += " GROUP BY slot, source ORDER BY slot"
+    return fold_tile(tuple_cursor(conn).execute(query, params), start, bucket_seconds)
+
+
+def list_apple_health_categories() -> List[AppleHealthCategory]:
+    """List all Apple Health record categories with counts"""
     categories = []
-    type_mapping = get_record_type_mapping()
     
-    for row in cursor.fetchall():
-        record_type = row['type']
-        count = row['count']
-        
-        # Get display info from mapping or create default
-        display_info = type_mapping.get(record_type, {
-            'display_name': record_type.replace('HKQuantityTypeIdentifier', '').replace('HKCategoryTypeIdentifier', ''),
-            'category': 'Other',
-            'icon_class': 'bi-activity',
-            'icon_color': 'text-secondary'
-        })
-        
-        # Create URL-safe name
-        url_name = record_type.lower().replace('hkquantitytypeidentifier', '').replace('hkcategorytypeidentifier', '')
+    for entry in get_apple_catalog():
+        if entry.kind != 'record':
+            continue
+        record_type = entry.name
+        display_info = get_record_type_info(record_type)
         
         categories.append(AppleHealthCategory(
             name=record_type,
             display_name=display_info['display_name'],
-            count=count,
-            url=f"/apple/{url_name}",
+            count=entry.count,
+            url=f"/apple/{entry.slug}",
             icon_class=display_info['icon_class'],
             icon_color=display_info['icon_color']
         ))
     
-    conn.close()
     return categories
 
 
+# Display information of the record types we know. get_record_type_info() makes it up for the others.
+RECORD_TYPES: Dict[str, Dict[str, str]] = {
+    # Activity & Fitness
+    'HKQuantityTypeIdentifierStepCount': {
+        'display_name': 'Step Count',
+        'category': 'Activity',
+        'icon_class': 'bi-person-walking',
+        'icon_color': 'text-primary'
+    },
+    'HKQuantityTypeIdentifierDistanceWalkingRunning': {
+        'display_name': 'Walking + Running Distance',
+        'category': 'Activity',
+        'icon_class': 'bi-speedometer',
+        'icon_color': 'text-primary'
+    },
+    'HKQuantityTypeIdentifierFlightsClimbed': {
+        'display_name': 'Flights Climbed',
+        'category': 'Activity',
+        'icon_class': 'bi-arrow-up',
+        'icon_color': 'text-primary'
+    },
+    'HKQuantityTypeIdentifierActiveEnergyBurned': {
+        'display_name': 'Active Energy Burned',
+        'category': 'Activity',
+        'icon_class': 'bi-fire',
+        'icon_color': 'text-danger'
+    },
+    'HKQuantityTypeIdentifierBasalEnergyBurned': {
+        'display_name': 'Basal Energy Burned',
+        'category': 'Activity',
+        'icon_class': 'bi-battery',
+        'icon_color': 'text-info'
+    },
+    
+    # Vitals
+    'HKQuantityTypeIdentifierHeartRate': {
+        'display_name': 'Heart Rate',
+        'category': 'Vitals',
+        'icon_class': 'bi-heart-pulse',
+        'icon_color': 'text-danger'
+    },
+    'HKQuantityTypeIdentifierBloodPressureSystolic': {
+        'display_name': 'Blood Pressure Systolic',
+        'category': 'Vitals',
+        'icon_class': 'bi-activity',
+        'icon_color': 'text-warning'
+    },
+    'HKQuantityTypeIdentifierBloodPressureDiastolic': {
+        'display_name': 'Blood Pressure Diastolic',
+        'category': 'Vitals',
+        'icon_class': 'bi-activity',
+        'icon_color': 'text-warning'
+    },
+    'HKQuantityTypeIdentifierRespiratoryRate': {
+        'display_name': 'Respiratory Rate',
+        'category': 'Vitals',
+        'icon_class': 'bi-lungs',
+        'icon_color': 'text-info'
+    },
+    'HKQuantityTypeIdentifierOxygenSaturation': {
+        'display_name': 'Oxygen Saturation',
+        'category': 'Vitals',
+        'icon_class': 'bi-droplet',
+        'icon_color': 'text-info'
+    },
+    
+    # Body Measurements  
+    'HKQuantityTypeIdentifierBodyMass': {
+        'display_name': 'Body Weight',
+        'category': 'Body',
+        'icon_class': 'bi-speedometer2',
+        'icon_color': 'text-success'
+    },
+    'HKQuantityTypeIdentifierHeight': {
+        'display_name': 'Height',
+        'category': 'Body',
+        'icon_class': 'bi-rulers',
+        'icon_color': 'text-success'
+    },
+    'HKQuantityTypeIdentifierBodyFatPercentage': {
+        'display_name': 'Body Fat Percentage',
+        'category': 'Body',
+        'icon_class': 'bi-percent',
+        'icon_color': 'text-success'
+    },
+    
+    # Lab Results
+    'HKQuantityTypeIdentifierBloodGlucose': {
+        'display_name': 'Blood Glucose',
+        'category': 'Lab Results',
+        'icon_class': 'bi-droplet',
+        'icon_color': 'text-warning'
+    },
+    
+    # Sleep
+    'HKCategoryTypeIdentifierSleepAnalysis': {
+        'display_name': 'Sleep Analysis',
+        'category': 'Sleep',
+        'icon_class': 'bi-moon',
+        'icon_color': 'text-secondary'
+    },
+}
+
+
 def get_record_type_mapping() -> Dict[str, Dict[str, str]]:
-    """Get mapping of Apple Health record types to display information"""
-    return {
-        # Activity & Fitness
-        'HKQuantityTypeIdentifierStepCount': {
-            'display_name': 'Step Count',
-            'category': 'Activity',
-            'icon_class': 'bi-person-walking',
-            'icon_color': 'text-primary'
-        },
-        'HKQuantityTypeIdentifierDistanceWalkingRunning': {
-            'display_name': 'Walking + Running Distance',
-            'category': 'Activity',
-            'icon_class': 'bi-speedometer',
-            'icon_color': 'text-primary'
-        },
-        'HKQuantityTypeIdentifierFlightsClimbed': {
-            'display_name': 'Flights Climbed',
-            'category': 'Activity',
-            'icon_class': 'bi-arrow-up',
-            'icon_color': 'text-primary'
-        },
-        'HKQuantityTypeIdentifierActiveEnergyBurned': {
-            'display_name': 'Active Energy Burned',
-            'category': 'Activity',
-            'icon_class': 'bi-fire',
-            'icon_color': 'text-danger'
-        },
-        'HKQuantityTypeIdentifierBasalEnergyBurned': {
-            'display_name': 'Basal Energy Burned',
-            'category': 'Activity',
-            'icon_class': 'bi-battery',
-            'icon_color': 'text-info'
-        },
-        
-        # Vitals
-        'HKQuantityTypeIdentifierHeartRate': {
-            'display_name': 'Heart Rate',
-            'category': 'Vitals',
-            'icon_class': 'bi-heart-pulse',
-            'icon_color': 'text-danger'
-        },
-        'HKQuantityTypeIdentifierBloodPressureSystolic': {
-            'display_name': 'Blood Pressure Systolic',
-            'category': 'Vitals',
-            'icon_class': 'bi-activity',
-            'icon_color': 'text-warning'
-        },
-        'HKQuantityTypeIdentifierBloodPressureDiastolic': {
-            'display_name': 'Blood Pressure Diastolic',
-            'category': 'Vitals',
-            'icon_class': 'bi-activity',
-            'icon_color': 'text-warning'
-        },
-        'HKQuantityTypeIdentifierRespiratoryRate': {
-            'display_name': 'Respiratory Rate',
-            'category': 'Vitals',
-            'icon_class': 'bi-lungs',
-            'icon_color': 'text-info'
-        },
-        'HKQuantityTypeIdentifierOxygenSaturation': {
-            'display_name': 'Oxygen Saturation',
-            'category': 'Vitals',
-            'icon_class': 'bi-droplet',
-            'icon_color': 'text-info'
-        },
-        
-        # Body Measurements  
-        'HKQuantityTypeIdentifierBodyMass': {
-            'display_name': 'Body Weight',
-            'category': 'Body',
-            'icon_class': 'bi-speedometer2',
-            'icon_color': 'text-success'
-        },
-        'HKQuantityTypeIdentifierHeight': {
-            'display_name': 'Height',
-            'category': 'Body',
-            'icon_class': 'bi-rulers',
-            'icon_color': 'text-success'
-        },
-        'HKQuantityTypeIdentifierBodyFatPercentage': {
-            'display_name': 'Body Fat Percentage',
-            'category': 'Body',
-            'icon_class': 'bi-percent',
-            'icon_color': 'text-success'
-        },
-        
-        # Lab Results
-        'HKQuantityTypeIdentifierBloodGlucose': {
-            'display_name': 'Blood Glucose',
-            'category': 'Lab Results',
-            'icon_class': 'bi-droplet',
-            'icon_color': 'text-warning'
-        },
-        
-        # Sleep
-        'HKCategoryTypeIdentifierSleepAnalysis': {
-            'display_name': 'Sleep Analysis',
-            'category': 'Sleep',
-            'icon_class': 'bi-moon',
-            'icon_color': 'text-secondary'
-        },
+    """Get mapping of Apple Health record types to display information. Shared, so don't modify it."""
+    return RECORD_TYPES
+
+
+def get_record_type_info(record_type: str) -> Dict[str, str]:
+    """Display information of a record type: display_name, category, icon_class and icon_color"""
+    return RECORD_TYPES.get(record_type) or {
+        'display_name': record_type.replace('HKQuantityTypeIdentifier', '').replace('HKCategoryTypeIdentifier', ''),
+        'category': 'Other',
+        'icon_class': 'bi-activity',
+        'icon_color': 'text-secondary'
     }
 
 
-def get_apple_health_records(record_type: str, limit: Optional[int] = None, 
-                           after: Optional[str] = None, before: Optional[str] = None) -> List[AppleHealthRecord]:
-    """Get Apple Health records of a specific type"""
+RECORD_COLUMNS = ("id", "type", "unit", "value", "source_name", "source_version", "device", "creation_date",
+                  "start_date", "end_date")
+ACTIVITY_COLUMNS = ("date_components", "active_energy_burned", "active_energy_burned_goal", "apple_move_time",
+                    "apple_move_time_goal", "apple_exercise_time", "apple_exercise_time_goal", "apple_stand_hours",
+                    "apple_stand_hours_goal")
+
+
+def iter_apple_health_records(record_type: str, limit: Optional[int] = None,
+                              after: Optional[str] = None, before: Optional[str] = None,
+                              columns: Optional[Sequence[str]] = None,
+                              chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Union[AppleHealthRecord, tuple]]:
+    """
+    Stream Apple Health records of a specific type, newest first, fetching chunk_size rows at a time.
+    :param columns: Only these columns of apple_health_records, yielded as plain tuples instead of AppleHealthRecords
+    """
     if not config.has_apple_health_database():
-        return []
-    
-    conn = get_apple_health_connection()
-    
+        return
+    select = projection(columns, RECORD_COLUMNS)
+
     # Build query with optional filters
-    query = "SELECT * FROM apple_health_records WHERE type = ?"
+    query = f"SELECT {select} FROM apple_health_records WHERE type = ?"
     params = [record_type]
     
     if after:
@@ -239,11 +486,12 @@ def get_apple_health_records(record_type: str, limit: Optional[int] = None,
         query += " LIMIT ?"
         params.append(limit)
     
-    cursor = conn.execute(query, params)
-    
-    records = []
-    for row in cursor.fetchall():
-        records.append(AppleHealthRecord(
+    conn = get_apple_health_connection()
+    if columns is not None:
+        yield from iter_cursor(tuple_cursor(conn).execute(query, params), chunk_size)
+        return
+    for row in iter_cursor(conn.execute(query, params), chunk_size):
+        yield AppleHealthRecord(
             id=row['id'],
             type=row['type'],
             unit=row['unit'],
@@ -254,58 +502,80 @@ def get_apple_health_records(record_type: str, limit: Optional[int] = None,
             creation_date=row['creation_date'],
             start_date=row['start_date'],
             end_date=row['end_date']
-        ))
-    
-    conn.close()
-    return records
+        )
 
 
+@timed("query")
+def get_apple_health_records(record_type: str, limit: Optional[int] = None, 
+                           after: Optional[str] = None, before: Optional[str] = None) -> List[AppleHealthRecord]:
+    """Get Apple Health records of a specific type"""
+    return list(iter_apple_health_records(record_type, limit=limit, after=after, before=before))
+
+
+@timed("query")
+def get_apple_health_series(record_type: str, after: Optional[str] = None,
+                            before: Optional[str] = None, source: Optional[str] = None) -> TimeSeries:
+    """
+    The numeric values of a record type, oldest first, as parallel arrays. For large record types, where
+    get_apple_health_records would build an object per row.
+    """
+    series = TimeSeries(record_type)
+    if not config.has_apple_health_database():
+        return series
+
+    conn = get_apple_health_connection()
+    tuples = tuple_cursor(conn)  # Plain tuples, straight into the arrays
+
+    query = """
+        SELECT CAST(strftime('%s', start_date) AS INTEGER), value FROM apple_health_records
+        WHERE type = ? AND value IS NOT NULL AND strftime('%s', start_date) IS NOT NULL
+    """
+    params = [record_type]
+    if after:
+        query += " AND start_date >= ?"
+        params.append(after)
+    if before:
+        query += " AND start_date <= ?"
+        params.append(before)
+    if source:
+        query += " AND source_name = ?"
+        params.append(source)
+    query += " ORDER BY start_date"
+
+    series.extend(tuples.execute(query, params))
+    row = conn.execute("SELECT unit FROM apple_health_records WHERE type = ? AND unit IS NOT NULL LIMIT 1",
+                       (record_type,)).fetchone()
+    series.unit = row[0] if row else None
+    return series
+
+
+@timed("query")
 def get_apple_health_statistics() -> Dict:
     """Get general statistics about Apple Health database"""
     if not config.has_apple_health_database():
         return {}
     
-    conn = get_apple_health_connection()
-    
-    # Total records
-    cursor = conn.execute("SELECT COUNT(*) as total FROM apple_health_records")
-    total_records = cursor.fetchone()['total']
+    catalog = get_apple_catalog()
+    records = [e for e in catalog if e.kind == 'record']
+    tables = {e.name: e.count for e in catalog if e.kind == 'table'}
     
-    # Total activity summaries
-    cursor = conn.execute("SELECT COUNT(*) as total FROM activity_summaries")
-    total_activities = cursor.fetchone()['total']
-    
-    # Total workouts
-    cursor = conn.execute("SELECT COUNT(*) as total FROM workouts")
-    total_workouts = cursor.fetchone()['total']
+    total_records = sum(e.count for e in records)
+    total_activities = tables.get('activity_summaries', 0)
+    total_workouts = tables.get('workouts', 0)
     
     # Date range
-    cursor = conn.execute("""
-        SELECT MIN(start_date) as min_date, MAX(start_date) as max_date 
-        FROM apple_health_records
-    """)
-    date_range = cursor.fetchone()
+    min_dates = [e.min_date for e in records if e.min_date is not None]
+    max_dates = [e.max_date for e in records if e.max_date is not None]
+    date_range = {'min_date': min(min_dates, default=None), 'max_date': max(max_dates, default=None)}
     
     # Source counts
-    cursor = conn.execute("""
-        SELECT source_name, COUNT(*) as count 
-        FROM apple_health_records 
-        GROUP BY source_name 
-        ORDER BY count DESC
-    """)
-    sources = {row['source_name']: row['count'] for row in cursor.fetchall()}
+    source_counts = Counter()
+    for e in records:
+        source_counts.update(e.sources)
+    sources = dict(source_counts.most_common())
     
     # Record type counts
-    cursor = conn.execute("""
-        SELECT type, COUNT(*) as count 
-        FROM apple_health_records 
-        GROUP BY type 
-        ORDER BY count DESC
-        LIMIT 10
-    """)
-    top_types = {row['type']: row['count'] for row in cursor.fetchall()}
-    
-    conn.close()
+    top_types = {e.name: e.count for e in records[:10]}
     
     return {
         "total_records": total_records,
@@ -320,17 +590,21 @@ def get_apple_health_statistics() -> Dict:
     }
 
 
-def get_activity_summaries(limit: Optional[int] = None, 
-                         after: Optional[str] = None, 
-                         before: Optional[str] = None) -> List[ActivitySummary]:
-    """Get daily activity summaries"""
+def iter_activity_summaries(limit: Optional[int] = None,
+                            after: Optional[str] = None,
+                            before: Optional[str] = None,
+                            columns: Optional[Sequence[str]] = None,
+                            chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Union[ActivitySummary, tuple]]:
+    """
+    Stream daily activity summaries, newest first, fetching chunk_size rows at a time.
+    :param columns: Only these columns of activity_summaries, yielded as plain tuples instead of ActivitySummaries
+    """
     if not config.has_apple_health_database():
-        return []
-    
-    conn = get_apple_health_connection()
-    
+        return
+    select = projection(columns, ACTIVITY_COLUMNS)
+
     # Build query with optional filters
-    query = "SELECT * FROM activity_summaries"
+    query = f"SELECT {select} FROM activity_summaries"
     params = []
     where_clauses = []
     
@@ -351,11 +625,12 @@ def get_activity_summaries(limit: Optional[int] = None,
         query += " LIMIT ?"
         params.append(limit)
     
-    cursor = conn.execute(query, params)
-    
-    summaries = []
-    for row in cursor.fetchall():
-        summaries.append(ActivitySummary(
+    conn = get_apple_health_connection()
+    if columns is not None:
+        yield from iter_cursor(tuple_cursor(conn).execute(query, params), chunk_size)
+        return
+    for row in iter_cursor(conn.execute(query, params), chunk_size):
+        yield ActivitySummary(
             date=row['date_components'],
             active_energy_burned=row['active_energy_burned'],
             active_energy_burned_goal=row['active_energy_burned_goal'],
@@ -365,74 +640,61 @@ def get_activity_summaries(limit: Optional[int] = None,
             apple_exercise_time_goal=row['apple_exercise_time_goal'],
             apple_stand_hours=row['apple_stand_hours'],
             apple_stand_hours_goal=row['apple_stand_hours_goal']
-        ))
-    
-    conn.close()
-    return summaries
+        )
+
+
+@timed("query")
+def get_activity_summaries(limit: Optional[int] = None, 
+                         after: Optional[str] = None, 
+                         before: Optional[str] = None) -> List[ActivitySummary]:
+    """Get daily activity summaries"""
+    return list(iter_activity_summaries(limit=limit, after=after, before=before))
 
 
+@timed("query")
 def get_record_data_for_chart(record_type: str, bucket_size: str = 'hour',
                             after: Optional[str] = None, before: Optional[str] = None) -> List[Dict]:
     """Get aggregated record data for charting with automatic bucketing"""
     if not config.has_apple_health_database():
         return []
     
-    conn = get_apple_health_connection()
-    
-    # Determine bucketing based on data volume and time range
-    # First, get total count and date range for this record type
-    count_query = "SELECT COUNT(*) as count, MIN(start_date) as min_date, MAX(start_date) as max_date FROM apple_health_records WHERE type = ?"
-    params = [record_type]
-    
-    if after:
-        count_query += " AND start_date >= ?"
-        params.append(after)
-    if before:
-        count_query += " AND start_date <= ?"
-        params.append(before)
-    
-    cursor = conn.execute(count_query, params)
-    result = cursor.fetchone()
-    total_count = result['count']
-    
     # Auto-select bucket size based on data volume
+    total_count = count_apple_records(record_type, after=after, before=before)
     if total_count > 10000:
-        bucket_format = '%Y-%m-%d'  # Daily
         bucket_size = 'day'
     elif total_count > 1000:
-        bucket_format = '%Y-%m-%d %H:00:00'  # Hourly
         bucket_size = 'hour'
     else:
-        bucket_format = '%Y-%m-%d %H:%M:00'  # Minute
         bucket_size = 'minute'
     
-    # Build aggregated query
-    query = f"""
-        SELECT 
-            strftime('{bucket_format}', start_date) as time_bucket,
-            AVG(value) as avg_value,
-            MIN(value) as min_value,
-            MAX(value) as max_value,
-            COUNT(*) as count,
-            unit
-        FROM apple_health_records 
-        WHERE type = ? AND value IS NOT NULL
-    """
-    params = [record_type]
-    
-    if after:
-        query += " AND start_date >= ?"
-        params.append(after)
-    if before:
-        query += " AND start_date <= ?"
-        params.append(before)
-    
-    query += " GROUP BY time_bucket, unit ORDER BY time_bucket"
-    
-    cursor = conn.execute(query, params)
+    rows = get_apple_rollups(record_type, bucket_size, after=after, before=before)
+    if rows is None:
+        # No rollups in this database: aggregate the records
+        query = f"""
+            SELECT 
+                strftime('{ROLLUP_BUCKETS[bucket_size]}', start_date) as time_bucket,
+                AVG(value) as avg_value,
+                MIN(value) as min_value,
+                MAX(value) as max_value,
+                COUNT(*) as count,
+                unit
+            FROM apple_health_records 
+            WHERE type = ? AND value IS NOT NULL
+        """
+        params = [record_type]
+        
+        if after:
+            query += " AND start_date >= ?"
+            params.append(after)
+        if before:
+            query += " AND start_date <= ?"
+            params.append(before)
+        
+        query += " GROUP BY time_bucket, unit ORDER BY time_bucket"
+        rows = get_apple_health_connection().execute(query, params).fetchall()
     
     data_points = []
-    for row in cursor.fetchall():
+    for row in rows:
         data_points.append({
             'date': row['time_bucket'],
             'value': row['avg_value'],
@@ -442,5 +704,4 @@ def get_record_data_for_chart(record_type: str, bucket_size: str = 'hour',
             'unit': row['unit']
         })
     
-    conn.close()
-    return data_points
\ No newline at end of file
+    return data_points
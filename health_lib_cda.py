@@ -2,16 +2,21 @@
 CDA (Clinical Document Architecture) specific data access functions for SQLite database.
 """
 
+import re
 import sqlite3
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Iterator, Optional, Sequence, Tuple, Union
 from dataclasses import dataclass
 from collections import Counter
 
 import config
+from health_lib import TimeSeries, DEFAULT_CHUNK_SIZE, iter_cursor, projection, CatalogEntry, fold_catalog, \
+    write_catalog, read_catalog, tile_bounds, fold_tile, CatalogIndex, get_catalog_index
+from db_pool import row_pool, tuple_cursor
+from timing import timed
 
 
-@dataclass
+@dataclass(slots=True)
 class CDAObservation:
     """Data class for CDA observations from database"""
     id: int
@@ -24,7 +29,7 @@ class CDAObservation:
     file_source: str
 
 
-@dataclass
+@dataclass(slots=True)
 class CDACategory:
     """Data class for CDA observation categories"""
     name: str
@@ -33,36 +38,70 @@ class CDACategory:
 
 
 def get_cda_connection() -> sqlite3.Connection:
-    """Get connection to CDA database"""
+    """Get this thread's read-only connection to the CDA database"""
     db_path = config.get_cda_database_path()
     if not db_path.exists():
         raise FileNotFoundError(f"CDA database not found: {db_path}")
     
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row  # Enable dict-like access to rows
-    return conn
+    # This thread's pooled read-only connection, with dict-like access to rows. Callers don't close it.
+    return row_pool.connection(db_path)
 
 
-def list_cda_categories() -> List[CDACategory]:
-    """List all CDA observation categories with counts"""
+# The catalog's rows before folding: per category, observation name, source and unit
+CDA_CATALOG_GROUPS = """
+    SELECT 'observation', category, name, source_name, unit, COUNT(*), MIN(date), MAX(date)
+    FROM cda_observations GROUP BY category, name, source_name, unit
+"""
+
+
+def observation_slug(name: str) -> str:
+    """URL-safe name of an observation, like blood-pressure-systolic for Blood Pressure, Systolic"""
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+
+def build_cda_catalog(conn: sqlite3.Connection) -> List[CatalogEntry]:
+    """Write the catalog table of a CDA database, after an import."""
+    entries = fold_catalog(conn.execute(CDA_CATALOG_GROUPS), observation_slug)
+    write_catalog(conn, entries)
+    return entries
+
+
+@timed("query")
+def get_cda_catalog() -> List[CatalogEntry]:
+    """Every observation type with its count, date range, units and sources, most values first, from the catalog"""
     if not config.has_cda_database():
         return []
-    
-    conn = get_cda_connection()
-    cursor = conn.execute("""
-        SELECT category, COUNT(*) as count 
-        FROM cda_observations 
-        GROUP BY category 
-        ORDER BY count DESC
-    """)
+    return read_catalog(get_cda_connection(), CDA_CATALOG_GROUPS, observation_slug)
+
+
+def get_cda_catalog_index() -> CatalogIndex:
+    """The catalog keyed by category and observation name, and by their slugs, rebuilt when the database changes"""
+    return get_catalog_index(config.get_cda_database_path(), get_cda_catalog, observation_slug)
+
+
+def get_cda_catalog_entry(category: str, observation_name: str) -> Optional[CatalogEntry]:
+    """The catalog entry of one observation type, or None if there are no values of it"""
+    return get_cda_catalog_index().entry('observation', observation_name, category)
+
+
+def resolve_cda_category(category: str) -> Optional[str]:
+    """
+    The category of a URL slug, like Vital Signs for vital-signs. A category, in any case, resolves to itself.
+    :return: The category, or None if there are no observations in it
+    """
+    return get_cda_catalog_index().category(observation_slug(category))
+
+
+def list_cda_categories() -> List[CDACategory]:
+    """List all CDA observation categories with counts"""
+    counts = Counter()
+    for entry in get_cda_catalog():
+        counts[entry.category] += entry.count
     
     categories = []
-    for row in cursor.fetchall():
-        category_name = row['category']
-        count = row['count']
-        # URL-safe category name for routing
-        url_safe_name = category_name.lower().replace(' ', '-')
-        url = f"/cda/{url_safe_name}"
+    for category_name, count in counts.most_common():
+        # URL-safe category name for routing, see resolve_cda_category()
+        url = f"/cda/{observation_slug(category_name)}"
         
         categories.append(CDACategory(
             name=category_name,
@@ -70,75 +109,81 @@ def list_cda_categories() -> List[CDACategory]:
             url=url
         ))
     
-    conn.close()
     return categories
 
 
 def list_cda_observation_types(category: str) -> List[Tuple[str, int]]:
     """List observation types within a category with counts"""
-    if not config.has_cda_database():
-        return []
-    
+    return [(e.name, e.count) for e in get_cda_catalog() if e.category == category]
+
+
+OBSERVATION_COLUMNS = ("id", "name", "category", "value", "unit", "date", "source_name", "file_source", "created_at")
+
+
+def _observation_from_row(row: sqlite3.Row) -> CDAObservation:
+    return CDAObservation(
+        id=row['id'],
+        name=row['name'],
+        category=row['category'],
+        value=row['value'],
+        unit=row['unit'],
+        date=row['date'],
+        source_name=row['source_name'],
+        file_source=row['file_source']
+    )
+
+
+def _iter_observations(query: str, params: tuple, columns: Optional[Sequence[str]],
+                       chunk_size: int) -> Iterator[Union[CDAObservation, tuple]]:
     conn = get_cda_connection()
-    cursor = conn.execute("""
-        SELECT name, COUNT(*) as count 
-        FROM cda_observations 
-        WHERE category = ?
-        GROUP BY name 
-        ORDER BY count DESC
-    """, (category,))
-    
-    types = [(row['name'], row['count']) for row in cursor.fetchall()]
-    conn.close()
-    return types
+    if columns is not None:
+        yield from iter_cursor(tuple_cursor(conn).execute(query, params), chunk_size)
+        return
+    for row in iter_cursor(conn.execute(query, params), chunk_size):
+        yield _observation_from_row(row)
 
 
-def get_cda_observations(category: str, observation_name: Optional[str] = None, 
-                        limit: Optional[int] = None) -> List[CDAObservation]:
-    """Get CDA observations, optionally filtered by category and observation name"""
+def iter_cda_observations(category: str, observation_name: Optional[str] = None,
+                          limit: Optional[int] = None, columns: Optional[Sequence[str]] = None,
+                          chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Union[CDAObservation, tuple]]:
+    """
+    Stream CDA observations, newest first, optionally filtered by observation name, fetching chunk_size rows at a time.
+    :param columns: Only these columns of cda_observations, yielded as plain tuples instead of CDAObservations
+    """
     if not config.has_cda_database():
-        return []
-    
-    conn = get_cda_connection()
+        return
+    select = projection(columns, OBSERVATION_COLUMNS)
     
     if observation_name:
-        query = """
-            SELECT * FROM cda_observations 
+        query = f"""
+            SELECT {select} FROM cda_observations 
             WHERE category = ? AND name = ?
             ORDER BY date DESC
         """
         params = (category, observation_name)
     else:
-        query = """
-            SELECT * FROM cda_observations 
+        query = f"""
+            SELECT {select} FROM cda_observations 
             WHERE category = ?
             ORDER BY date DESC
         """
         params = (category,)
     
     if limit:
-        query += f" LIMIT {limit}"
-    
-    cursor = conn.execute(query, params)
-    
-    observations = []
-    for row in cursor.fetchall():
-        obs = CDAObservation(
-            id=row['id'],
-            name=row['name'],
-            category=row['category'],
-            value=row['value'],
-            unit=row['unit'],
-            date=row['date'],
-            source_name=row['source_name'],
-            file_source=row['file_source']
-        )
-        observations.append(obs)
-    
-    conn.close()
-    return observations
+        query += " LIMIT ?"
+        params += (limit,)
 
+    yield from _iter_observations(query, params, columns, chunk_size)
 
+
+@timed("query")
+def get_cda_observations(category: str, observation_name: Optional[str] = None, 
+                        limit: Optional[int] = None) -> List[CDAObservation]:
+    """Get CDA observations, optionally filtered by category and observation name"""
+    return list(iter_cda_observations(category, observation_name, limit=limit))
+
+
+@timed("query")
 def get_cda_chart_data(category: str, observation_name: str) -> Dict:
     """Get chart data for a specific CDA observation type"""
     if not config.has_cda_database():
@@ -168,8 +213,6 @@ def get_cda_chart_data(category: str, observation_name: str) -> Dict:
         if source not in sources:
             sources[source] = len(sources)
     
-    conn.close()
-    
     return {
         "data": data,
         "labels": labels,
@@ -177,34 +220,153 @@ def get_cda_chart_data(category: str, observation_name: str) -> Dict:
     }
 
 
+@timed("query")
+def get_cda_series(category: str, observation_name: str) -> TimeSeries:
+    """The values of one CDA observation type, oldest first, as parallel arrays instead of CDAObservation objects."""
+    series = TimeSeries(observation_name)
+    if not config.has_cda_database():
+        return series
+
+    conn = get_cda_connection()
+    tuples = tuple_cursor(conn)  # Plain tuples, straight into the arrays
+    series.extend(tuples.execute("""
+        SELECT CAST(strftime('%s', date) AS INTEGER), value FROM cda_observations
+        WHERE category = ? AND name = ? AND strftime('%s', date) IS NOT NULL
+        ORDER BY date ASC
+    """, (category, observation_name)))
+    row = conn.execute("SELECT unit FROM cda_observations WHERE category = ? AND name = ? AND unit IS NOT NULL LIMIT 1",
+                       (category, observation_name)).fetchone()
+    series.unit = row[0] if row else None
+    return series
+
+
+# Start of the bucket holding ts, in seconds since the epoch. Hours, days and weeks (from Monday, and 1970-01-05
+# was one) are whole multiples of their length, also before 1970; months and years start at midnight UTC.
+CDA_BUCKET_STARTS = {
+    'hour': "ts - ((ts % 3600) + 3600) % 3600",
+    'day': "ts - ((ts % 86400) + 86400) % 86400",
+    'week': "ts - (((ts - 345600) % 604800) + 604800) % 604800",
+    'month': "CAST(strftime('%s', ts, 'unixepoch', 'start of month') AS INTEGER)",
+    'year': "CAST(strftime('%s', ts, 'unixepoch', 'start of year') AS INTEGER)",
+}
+
+
+def _chart_where(category: str, observation_name: str, after: Optional[str], before: Optional[str],
+                 source: Optional[str]) -> Tuple[str, list]:
+    where = ["category = ? AND name = ?"]
+    params = [category, observation_name]
+    if after:
+        where.append("date >= ?")
+        params.append(after)
+    if before:
+        where.append("date <= ?")
+        params.append(before)
+    if source:
+        where.append("source_name = ?")
+        params.append(source)
+    return " AND ".join(where), params
+
+
+@timed("query")
+def count_cda_chart_points(category: str, observation_name: str, after: Optional[str] = None,
+                           before: Optional[str] = None, source: Optional[str] = None) -> Tuple[int, Optional[str]]:
+    """
+    How many values a chart of one observation type has, and the unit of the first
+    :return: (count, unit)
+    """
+    if not config.has_cda_database():
+        return 0, None
+    where, params = _chart_where(category, observation_name, after, before, source)
+    conn = get_cda_connection()
+    count = conn.execute(f"SELECT COUNT(*) FROM cda_observations WHERE {where}", params).fetchone()[0]
+    row = conn.execute(f"SELECT unit FROM cda_observations WHERE {where} ORDER BY date LIMIT 1", params).fetchone()
+    return count, row[0] if row else None
+
+
+@timed("query")
+def get_cda_chart_series(category: str, observation_name: str, bucket_size: str = 'raw',
+                         after: Optional[str] = None, before: Optional[str] = None,
+                         source: Optional[str] = None) -> Dict[str, List[list]]:
+    """
+    Chart points of one observation type, per source, bucketed and averaged by SQLite. Only the buckets leave the
+    database: fetching every row into Python, not the averaging, was the cost, so NumPy wouldn't help here.
+    :param bucket_size: 'raw', or one of CDA_BUCKET_STARTS. Any other value averages values at the same time.
+    :return: {source: [[timestamp in ms, value], ...]}, sources in the order of their first value, points in time
+        order. Values with a date SQLite can't read are left out.
+    """
+    if not config.has_cda_database():
+        return {}
+    where, params = _chart_where(category, observation_name, after, before, source)
+    values = f"""
+        SELECT source_name, value, date, CAST(strftime('%s', date) AS INTEGER) AS ts
+        FROM cda_observations WHERE {where}
+    """
+    if bucket_size == 'raw':
+        query = f"SELECT source_name, ts * 1000, value FROM ({values}) WHERE ts IS NOT NULL ORDER BY date"
+    else:
+        bucket_start = CDA_BUCKET_STARTS.get(bucket_size, "ts")
+        # Ordered by bucket and then first date, so each source first shows up where its first value is
+        query = f"""
+            SELECT source_name, ({bucket_start}) * 1000 AS bucket, AVG(value), MIN(date) AS first_date
+            FROM ({values}) WHERE ts IS NOT NULL
+            GROUP BY source_name, bucket
+            ORDER BY bucket, first_date
+        """
+    series: Dict[str, List[list]] = {}
+    for row in tuple_cursor(get_cda_connection()).execute(query, params):
+        series.setdefault(row[0], []).append([row[1], row[2]])
+    return series
+
+
+@timed("query")
+def get_cda_tile(category: str, observation_name: str, level: int, index: int, source: Optional[str] = None,
+                 by_source: bool = False) -> List[dict]:
+    """
+    Chart points of one observation type in one tile (see health_lib.tile_bounds), averaged per tile bucket.
+    :param by_source: a series per source, instead of one for all of them
+    :return: series, as health_lib.fold_tile makes them
+    """
+    start, end, bucket_seconds = tile_bounds(level, index)
+    if not config.has_cda_database():
+        return []
+    where, params = _chart_where(category, observation_name, None, None, source)
+    group = "source_name" if by_source else "NULL"
+    # The date index narrows it down to the tile's days, a day to spare for dates with a time zone offset,
+    # and then the times select the tile exactly
+    query = f"""
+        SELECT {group} AS source, (ts - ?) / ? AS slot, AVG(value), MIN(value), MAX(value), COUNT(*)
+        FROM (
+            SELECT source_name, value, CAST(strftime('%s', date) AS INTEGER) AS ts
+            FROM cda_observations
+            WHERE {where} AND value IS NOT NULL
+                AND date >= strftime('%Y-%m-%d', ?, 'unixepoch') AND date < strftime('%Y-%m-%d', ?, 'unixepoch')
+        )
+        WHERE ts >= ? AND ts < ?
+        GROUP BY slot, source ORDER BY slot
+    """
+    params = [start, bucket_seconds, *params, start - 86400, end + 2 * 86400, start, end]
+    return fold_tile(tuple_cursor(get_cda_connection()).execute(query, params), start, bucket_seconds)
+
+
+@timed("query")
 def get_cda_statistics() -> Dict:
     """Get general statistics about CDA database"""
     if not config.has_cda_database():
         return {}
     
-    conn = get_cda_connection()
-    
-    # Total observations
-    cursor = conn.execute("SELECT COUNT(*) as total FROM cda_observations")
-    total = cursor.fetchone()['total']
+    catalog = get_cda_catalog()
+    total = sum(e.count for e in catalog)
     
     # Date range
-    cursor = conn.execute("""
-        SELECT MIN(date) as min_date, MAX(date) as max_date 
-        FROM cda_observations
-    """)
-    date_range = cursor.fetchone()
+    min_dates = [e.min_date for e in catalog if e.min_date is not None]
+    max_dates = [e.max_date for e in catalog if e.max_date is not None]
+    date_range = {'min_date': min(min_dates, default=None), 'max_date': max(max_dates, default=None)}
     
     # Source counts
-    cursor = conn.execute("""
-        SELECT source_name, COUNT(*) as count 
-        FROM cda_observations 
-        GROUP BY source_name 
-        ORDER BY count DESC
-    """)
-    sources = {row['source_name']: row['count'] for row in cursor.fetchall()}
-    
-    conn.close()
+    source_counts = Counter()
+    for e in catalog:
+        source_counts.update(e.sources)
+    sources = dict(source_counts.most_common())
     
     return {
         "total_observations": total,
@@ -216,32 +378,24 @@ def get_cda_statistics() -> Dict:
     }
 
 
-def search_cda_observations(query: str, limit: int = 100) -> List[CDAObservation]:
-    """Search CDA observations by name or category"""
+def iter_search_cda_observations(query: str, limit: int = 100, columns: Optional[Sequence[str]] = None,
+                                  chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Union[CDAObservation, tuple]]:
+    """
+    Stream CDA observations whose name, category or source contains query, newest first.
+    :param columns: Only these columns of cda_observations, yielded as plain tuples instead of CDAObservations
+    """
     if not config.has_cda_database():
-        return []
-    
-    conn = get_cda_connection()
-    cursor = conn.execute("""
-        SELECT * FROM cda_observations 
+        return
+    select = projection(columns, OBSERVATION_COLUMNS)
+    yield from _iter_observations(f"""
+        SELECT {select} FROM cda_observations 
         WHERE name LIKE ? OR category LIKE ? OR source_name LIKE ?
         ORDER BY date DESC
         LIMIT ?
-    """, (f"%{query}%", f"%{query}%", f"%{query}%", limit))
-    
-    observations = []
-    for row in cursor.fetchall():
-        obs = CDAObservation(
-            id=row['id'],
-            name=row['name'],
-            category=row['category'],
-            value=row['value'],
-            unit=row['unit'],
-            date=row['date'],
-            source_name=row['source_name'],
-            file_source=row['file_source']
-        )
-        observations.append(obs)
-    
-    conn.close()
-    return observations
\ No newline at end of file
+    """, (f"%{query}%", f"%{query}%", f"%{query}%", limit), columns, chunk_size)
+
+
+@timed("query")
+def search_cda_observations(query: str, limit: int = 100) -> List[CDAObservation]:
+    """Search CDA observations by name or category"""
+    return list(iter_search_cda_observations(query, limit))
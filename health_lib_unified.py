@@ -0,0 +1,411 @@
+"""
+One time series table for every source: FHIR (through the observation index), CDA (cda_observations.db) and
+Apple Health (apple_health.db).
+
+Each source names its statistics differently, so every name is mapped to a metric id. Known statistics, like
+weight or heart rate, are listed in METRICS with the names each source uses, and their values are converted to one
+unit. Anything else gets a metric id made from its normalized name, so "Heart Rate" and "heart rate" from two
+sources still land together.
+
+Times are stored as UTC seconds since the epoch. FHIR dates carry their offset, the CDA preprocessor converts its
+dates to UTC, and Apple's are local times, read in the server's time zone.
+
+The store is a derived copy. Each source is reloaded in full when its database, or the FHIR index, changes. The
+store is in WAL mode, so the server reads it while a source reloads, and refreshes take turns: within a process
+with a lock, and between processes, like a preprocessor and the server, by waiting up to BUSY_TIMEOUT.
+"""
+
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, Optional
+
+import config
+from db_pool import ReadOnlyPool, file_signature
+from health_lib import ObservationIndex, TimeSeries, ValueQuantity, unconvert_units
+from obs_matcher import normalize_text
+
+SOURCES = ("fhir", "cda", "apple")
+
+# metric id -> (unit values are converted to, names used by the sources)
+METRICS: dict[str, tuple[str, tuple[str, ...]]] = {
+    "body_weight": ("kg", ("Body Weight", "Weight", "Body Mass", "HKQuantityTypeIdentifierBodyMass")),
+    "body_height": ("cm", ("Body Height", "Height", "HKQuantityTypeIdentifierHeight")),
+    "body_mass_index": ("kg/m2", ("Body Mass Index", "BMI", "Body mass index (BMI) [Ratio]",
+                                  "HKQuantityTypeIdentifierBodyMassIndex")),
+    "body_temperature": ("Cel", ("Body Temperature", "Temperature", "HKQuantityTypeIdentifierBodyTemperature")),
+    "heart_rate": ("/min", ("Heart Rate", "Pulse", "Pulse Rate", "HKQuantityTypeIdentifierHeartRate")),
+    "respiratory_rate": ("/min", ("Respiratory Rate", "Respiration Rate",
+                                  "HKQuantityTypeIdentifierRespiratoryRate")),
+    "oxygen_saturation": ("%", ("Oxygen Saturation", "SpO2", "Pulse Oximetry",
+                                "Oxygen saturation in Arterial blood", "Oxygen saturation in Arterial blood by Pulse oximetry",
+                                "HKQuantityTypeIdentifierOxygenSaturation")),
+    "systolic_blood_pressure": ("mm[Hg]", ("Systolic Blood Pressure", "Systolic",
+                                           "HKQuantityTypeIdentifierBloodPressureSystolic")),
+    "diastolic_blood_pressure": ("mm[Hg]", ("Diastolic Blood Pressure", "Diastolic",
+                                            "HKQuantityTypeIdentifierBloodPressureDiastolic")),
+}
+
+# (from unit, to unit) -> (factor, offset): to = from * factor + offset
+UNIT_CONVERSIONS: dict[tuple[str, str], tuple[float, float]] = {
+    ("lb", "kg"): (0.45359237, 0.0),
+    ("[lb_av]", "kg"): (0.45359237, 0.0),
+    ("g", "kg"): (0.001, 0.0),
+    ("in", "cm"): (2.54, 0.0),
+    ("[in_i]", "cm"): (2.54, 0.0),
+    ("m", "cm"): (100.0, 0.0),
+    ("ft", "cm"): (30.48, 0.0),
+    ("degF", "Cel"): (5 / 9, -160 / 9),
+    ("[degF]", "Cel"): (5 / 9, -160 / 9),
+    ("degC", "Cel"): (1.0, 0.0),
+    ("count/min", "/min"): (1.0, 0.0),
+    ("beats/min", "/min"): (1.0, 0.0),
+    ("{beats}/min", "/min"): (1.0, 0.0),
+    ("breaths/min", "/min"): (1.0, 0.0),
+    ("{breaths}/min", "/min"): (1.0, 0.0),
+    ("mmHg", "mm[Hg]"): (1.0, 0.0),
+    ("count", "kg/m2"): (1.0, 0.0),
+    ("kg/m^2", "kg/m2"): (1.0, 0.0),
+}
+
+# Apple records these as fractions, with a unit of "%".
+APPLE_FRACTION_TYPES = {"HKQuantityTypeIdentifierOxygenSaturation", "HKQuantityTypeIdentifierBodyFatPercentage"}
+
+_APPLE_PREFIX_RE = re.compile(r"^HK(Quantity|Category)TypeIdentifier")
+_CAMEL_RE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+
+_SYNONYMS: dict[str, str] = {normalize_text(name): metric for metric, (_, names) in METRICS.items() for name in names}
+
+
+@dataclass(slots=True)
+class UnifiedPoint:
+    """One value of a metric, from any source"""
+    ts: int  # seconds since the epoch, UTC
+    value: float
+    unit: Optional[str]
+    source: str  # one of SOURCES
+    origin: Optional[str]  # where in the source: the device or provider, or the FHIR file
+    name: str  # the name the source used
+
+
+@lru_cache(maxsize=4096)
+def metric_id(name: str) -> str:
+    """
+    The metric id for a statistic name from any source.
+    :param name: Like "Body Weight", or an Apple type like "HKQuantityTypeIdentifierBodyMass"
+    :return: A METRICS key, or the normalized name with spaces replaced by underscores
+    """
+    normalized = normalize_text(name)
+    if normalized in _SYNONYMS:
+        return _SYNONYMS[normalized]
+    stripped = _APPLE_PREFIX_RE.sub("", name)
+    if stripped != name:
+        normalized = normalize_text(_CAMEL_RE.sub(" ", stripped))
+        if normalized in _SYNONYMS:
+            return _SYNONYMS[normalized]
+    return normalized.replace(" ", "_")
+
+
+def convert_unit(metric: str, unit: Optional[str]) -> tuple[Optional[str], float, float]:
+    """
+    How to convert a value of metric to the metric's unit.
+    :return: (unit to store, factor, offset). Unknown units are left as they are.
+    """
+    target = METRICS.get(metric, (None,))[0]
+    if target is None or unit is None or unit == target:
+        return unit, 1.0, 0.0
+    if (unit, target) in UNIT_CONVERSIONS:
+        factor, offset = UNIT_CONVERSIONS[(unit, target)]
+        return target, factor, offset
+    return unit, 1.0, 0.0
+
+
+def create_unified_schema(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS unified_observations (
+            metric_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            value REAL NOT NULL,
+            unit TEXT,
+            source TEXT NOT NULL,
+            origin TEXT,
+            name TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_unified_metric_ts ON unified_observations (metric_id, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_unified_source ON unified_observations (source)")
+    # The signature of each source as it was when it was loaded, so unchanged sources aren't reloaded.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS unified_sources (
+            source TEXT PRIMARY KEY,
+            signature TEXT NOT NULL,
+            count INTEGER NOT NULL
+        )
+    """)
+    conn.commit()
+
+
+# Seconds a refresh waits for another process's to finish. Loading a large Apple database takes minutes.
+BUSY_TIMEOUT = 600.0
+
+
+def connect_unified(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+    # Without WAL, a reload too big for the page cache locks readers out until it commits
+    conn.execute("PRAGMA journal_mode = WAL")
+    create_unified_schema(conn)
+    return conn
+
+
+# One refresh at a time in this process, like the server's startup load and the FHIR poller
+_refresh_lock = threading.Lock()
+
+
+# Read-only connections for the queries. The server refreshes the store itself, so never immutable.
+_read_pool = ReadOnlyPool(allow_immutable=False)
+
+
+def _signature(path: Path) -> Optional[str]:
+    """The source's file signature as stored in sources, or None when the file is missing."""
+    signature = file_signature(path)
+    return None if signature is None else repr(signature)
+
+
+def _replace_source(conn: sqlite3.Connection, source: str, signature: str, fill) -> int:
+    """Delete a source's rows and load them again with fill(conn), in one transaction."""
+    with conn:
+        conn.execute("DELETE FROM unified_observations WHERE source = ?", (source,))
+        fill(conn)
+        count = conn.execute("SELECT COUNT(*) FROM unified_observations WHERE source = ?", (source,)).fetchone()[0]
+        conn.execute("INSERT OR REPLACE INTO unified_sources (source, signature, count) VALUES (?, ?, ?)",
+                     (source, signature, count))
+    return count
+
+
+def _load_attached(conn: sqlite3.Connection, source: str, db_path: Path, names_sql: str, insert_sql: str,
+                   fraction_names: Iterable[str] = ()) -> int:
+    """
+    Replace a source's rows by copying its database in with one INSERT ... SELECT. The few distinct (name, unit)
+    pairs are resolved to metric ids and conversions in Python, into a temporary table the SELECT joins against.
+    """
+    fractions = set(fraction_names)
+
+    def fill(c):
+        c.execute("DROP TABLE IF EXISTS temp.unified_names")
+        c.execute("CREATE TEMP TABLE unified_names (name TEXT, unit TEXT, metric_id TEXT, out_unit TEXT, "
+                  "factor REAL, offset REAL)")
+        rows = []
+        for name, unit in c.execute(names_sql).fetchall():
+            metric = metric_id(name)
+            out_unit, factor, offset = convert_unit(metric, unit)
+            if name in fractions:
+                factor *= 100
+            rows.append((name, unit, metric, out_unit, factor, offset))
+        c.executemany("INSERT INTO temp.unified_names VALUES (?, ?, ?, ?, ?, ?)", rows)
+        c.execute(insert_sql, (source,))
+        c.execute("DROP TABLE temp.unified_names")
+
+    # ATTACH can't be run inside a transaction, so it goes around _replace_source's.
+    conn.execute("ATTACH DATABASE ? AS src", (str(db_path),))
+    try:
+        return _replace_source(conn, source, _signature(db_path), fill)
+    finally:
+        conn.execute("DETACH DATABASE src")
+
+
+def load_cda(conn: sqlite3.Connection, cda_db: Path) -> int:
+    """Replace the CDA rows with the contents of cda_observations.db."""
+    return _load_attached(conn, "cda", cda_db, "SELECT DISTINCT name, unit FROM src.cda_observations", """
+        INSERT INTO unified_observations (metric_id, ts, value, unit, source, origin, name)
+        SELECT n.metric_id, CAST(strftime('%s', o.date) AS INTEGER), o.value * n.factor + n.offset,
+               n.out_unit, ?, o.source_name, o.name
+        FROM src.cda_observations o JOIN temp.unified_names n ON n.name = o.name AND n.unit IS o.unit
+        WHERE strftime('%s', o.date) IS NOT NULL
+    """)
+
+
+def load_apple(conn: sqlite3.Connection, apple_db: Path) -> int:
+    """
+    Replace the Apple rows with the numeric records in apple_health.db. The preprocessor keeps Apple's dates as local
+    wall-clock times, without their offset, so they are taken to be in the server's time zone and moved to UTC.
+    """
+    return _load_attached(conn, "apple", apple_db,
+                          "SELECT DISTINCT type, unit FROM src.apple_health_records WHERE value IS NOT NULL", """
+        INSERT INTO unified_observations (metric_id, ts, value, unit, source, origin, name)
+        SELECT n.metric_id, CAST(strftime('%s', r.start_date, 'utc') AS INTEGER), r.value * n.factor + n.offset,
+               n.out_unit, ?, r.source_name, r.type
+        FROM src.apple_health_records r JOIN temp.unified_names n ON n.name = r.type AND n.unit IS r.unit
+        WHERE r.value IS NOT NULL AND strftime('%s', r.start_date, 'utc') IS NOT NULL
+    """, APPLE_FRACTION_TYPES)
+
+
+def fhir_rows(index: ObservationIndex) -> Iterable[tuple]:
+    """The unified rows for the numeric values in the FHIR index. Each component of a panel is its own metric."""
+    for ob in index.iter_observations():
+        for data in ob.data:
+            if not isinstance(data, ValueQuantity) or data.value is None:
+                continue
+            name = data.name if len(ob.data) > 1 and data.name else ob.name
+            metric = metric_id(name)
+            # The index holds the values as convert_units left them, in lb and Fah, so go back to the file's units
+            value, unit = unconvert_units(float(data.value), data.unit)
+            unit, factor, offset = convert_unit(metric, unit)
+            yield {"metric": metric, "date": ob.date, "value": value * factor + offset, "unit": unit,
+                   "origin": ob.filename.name, "name": name}
+
+
+def load_fhir(conn: sqlite3.Connection, index: ObservationIndex) -> int:
+    """Replace the FHIR rows with the values in the observation index."""
+    def fill(c):
+        c.executemany("""
+            INSERT INTO unified_observations (metric_id, ts, value, unit, source, origin, name)
+            SELECT :metric, CAST(strftime('%s', :date) AS INTEGER), :value, :unit, 'fhir', :origin, :name
+            WHERE strftime('%s', :date) IS NOT NULL
+        """, fhir_rows(index))
+    return _replace_source(conn, "fhir", index.generation(), fill)
+
+
+def refresh_unified_store(db_path: Path, *, cda_db: Optional[Path] = None, apple_db: Optional[Path] = None,
+                          fhir_index: Optional[ObservationIndex] = None, force: bool = False) -> dict[str, int]:
+    """
+    Reload the sources that changed since they were last loaded. Sources that are not given are left alone.
+    A source database that no longer exists has its rows removed.
+    :return: source -> rows loaded, only for the sources that were reloaded
+    """
+    with _refresh_lock:
+        return _refresh(db_path, cda_db, apple_db, fhir_index, force)
+
+
+def _refresh(db_path: Path, cda_db: Optional[Path], apple_db: Optional[Path], fhir_index: Optional[ObservationIndex],
+             force: bool) -> dict[str, int]:
+    conn = connect_unified(db_path)
+    try:
+        loaded = dict(conn.execute("SELECT source, signature FROM unified_sources"))
+        reloaded = {}
+        for source, path, load in (("cda", cda_db, load_cda), ("apple", apple_db, load_apple)):
+            if path is None:
+                continue
+            signature = _signature(path)
+            if signature is None:
+                if source in loaded:
+                    with conn:
+                        conn.execute("DELETE FROM unified_observations WHERE source = ?", (source,))
+                        conn.execute("DELETE FROM unified_sources WHERE source = ?", (source,))
+                    reloaded[source] = 0
+            elif force or loaded.get(source) != signature:
+                reloaded[source] = load(conn, path)
+        if fhir_index is not None and (force or loaded.get("fhir") != fhir_index.generation()):
+            reloaded["fhir"] = load_fhir(conn, fhir_index)
+        if reloaded:
+            # The readers' ETags and pooled connections go by the database file, which only changes when the WAL is
+            # copied back into it
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return reloaded
+    finally:
+        conn.close()
+
+
+def list_metrics(db_path: Path) -> list[dict]:
+    """
+    Every metric in the store.
+    :return: list of {"metric_id", "count", "sources": {source: count}, "units": [...]}, most values first
+    """
+    if not db_path.exists():
+        return []
+    conn = _read_pool.connection(db_path)
+    metrics: dict[str, dict] = {}
+    for metric, source, unit, count in conn.execute("""
+        SELECT metric_id, source, unit, COUNT(*) FROM unified_observations GROUP BY metric_id, source, unit
+    """):
+        m = metrics.setdefault(metric, {"metric_id": metric, "count": 0, "sources": {}, "units": []})
+        m["count"] += count
+        m["sources"][source] = m["sources"].get(source, 0) + count
+        if unit not in m["units"]:
+            m["units"].append(unit)
+    return sorted(metrics.values(), key=lambda m: m["count"], reverse=True)
+
+
+def _metric_where(metric: str, start: Optional[int], end: Optional[int],
+                  sources: Optional[Iterable[str]]) -> tuple[str, list]:
+    where = ["metric_id = ?"]
+    params: list = [metric]
+    if start is not None:
+        where.append("ts >= ?")
+        params.append(start)
+    if end is not None:
+        where.append("ts <= ?")
+        params.append(end)
+    if sources:
+        sources = list(sources)
+        where.append(f"source IN ({','.join('?' * len(sources))})")
+        params.extend(sources)
+    return " AND ".join(where), params
+
+
+def query_metric(db_path: Path, metric: str, *, start: Optional[int] = None, end: Optional[int] = None,
+                 sources: Optional[Iterable[str]] = None) -> list[UnifiedPoint]:
+    """
+    All values of one metric from every source, in time order, with one query on (metric_id, ts).
+    :param start: Only values at or after this time, in seconds since the epoch
+    :param end: Only values at or before this time
+    :param sources: Only these sources
+    """
+    if not db_path.exists():
+        return []
+    where, params = _metric_where(metric, start, end, sources)
+    conn = _read_pool.connection(db_path)
+    rows = conn.execute(f"""
+        SELECT ts, value, unit, source, origin, name FROM unified_observations
+        WHERE {where} ORDER BY ts
+    """, params).fetchall()
+    return [UnifiedPoint(*row) for row in rows]
+
+
+def query_metric_series(db_path: Path, metric: str, *, start: Optional[int] = None, end: Optional[int] = None,
+                        sources: Optional[Iterable[str]] = None) -> dict[str, TimeSeries]:
+    """
+    Same as query_metric, as one TimeSeries per source and unit, for charting metrics with many values.
+    :return: {source: series}, or {"source (unit)": series} when one source has values in several units
+    """
+    if not db_path.exists():
+        return {}
+    where, params = _metric_where(metric, start, end, sources)
+    conn = _read_pool.connection(db_path)
+    series: dict[tuple[str, Optional[str]], TimeSeries] = {}
+    for source, unit in conn.execute(f"SELECT DISTINCT source, unit FROM unified_observations WHERE {where}",
+                                     params).fetchall():
+        s = TimeSeries(source, unit)
+        s.extend(conn.execute(f"SELECT ts, value FROM unified_observations WHERE {where} "
+                              f"AND source = ? AND unit IS ? ORDER BY ts", params + [source, unit]))
+        series[(source, unit)] = s
+    per_source: dict[str, int] = {}
+    for source, _ in series:
+        per_source[source] = per_source.get(source, 0) + 1
+    result = {}
+    for (source, unit), s in sorted(series.items(), key=lambda x: (SOURCES.index(x[0][0]), x[0][1] or "")):
+        s.name = source if per_source[source] == 1 else f"{source} ({unit})"
+        result[s.name] = s
+    return result
+
+
+def metric_origins(db_path: Path, metric: str) -> dict[str, dict[str, int]]:
+    """{source: {origin: count}} for one metric, like which devices or providers recorded it"""
+    if not db_path.exists():
+        return {}
+    conn = _read_pool.connection(db_path)
+    origins: dict[str, dict[str, int]] = {}
+    for source, origin, count in conn.execute("""
+        SELECT source, origin, COUNT(*) FROM unified_observations WHERE metric_id = ? GROUP BY source, origin
+    """, (metric,)):
+        origins.setdefault(source, {})[origin] = count
+    return origins
+
+
+def refresh_configured_store(fhir_index: Optional[ObservationIndex] = None, force: bool = False) -> dict[str, int]:
+    """refresh_unified_store with the database paths from config.py"""
+    return refresh_unified_store(config.get_unified_database_path(), cda_db=config.get_cda_database_path(),
+                                 apple_db=config.get_apple_health_database_path(), fhir_index=fhir_index,
+                                 force=force)
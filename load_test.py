@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Load test: latency of cheap endpoints, first on an idle server, then while clients hammer a heavy chart endpoint.
+
+With blocking queries on the event loop, one slow chart stalls every other request, and the cheap endpoints' p99
+grows to the chart's run time. With the work in worker threads, it should stay about the same.
+
+Start the server first, like:
+    uvicorn main:app --port 8000
+
+Usage:
+    python load_test.py [--url http://127.0.0.1:8000] [--heavy /api/apple/heartrate/chart?bucket=raw]
+                        [--cheap /api/cda/categories] [--heavy-clients 8] [--seconds 10]
+"""
+
+import argparse
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def fetch(url: str) -> float:
+    """Seconds to GET url and read the whole response. Errors count, since they are responses too."""
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=60) as response:
+            response.read()
+    except urllib.error.HTTPError as e:
+        e.read()
+    return time.perf_counter() - started
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def measure_cheap(base: str, paths: list[str], seconds: float, clients: int) -> list[float]:
+    """Latencies of the cheap paths, requested round robin by a few clients for the given time."""
+    deadline = time.monotonic() + seconds
+    latencies: list[float] = []
+    lock = threading.Lock()
+
+    def client(offset: int):
+        i = offset
+        while time.monotonic() < deadline:
+            elapsed = fetch(base + paths[i % len(paths)])
+            with lock:
+                latencies.append(elapsed)
+            i += 1
+
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(client, range(clients)))
+    return latencies
+
+
+def report(label: str, latencies: list[float]) -> None:
+    ms = [x * 1000 for x in latencies]
+    print(f"{label:<14}{len(ms):>9}{statistics.median(ms):>10.1f}{percentile(ms, 95):>10.1f}"
+          f"{percentile(ms, 99):>10.1f}{max(ms):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cheap endpoint latency while heavy chart queries run.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="base URL of a running server")
+    parser.add_argument("--cheap", action="append", help="cheap path, repeat for several (default: a few API lists)")
+    parser.add_argument("--heavy", action="append", help="heavy path, repeat for several")
+    parser.add_argument("--heavy-clients", type=int, default=8, help="clients requesting the heavy paths")
+    parser.add_argument("--cheap-clients", type=int, default=2, help="clients requesting the cheap paths")
+    parser.add_argument("--seconds", type=float, default=10, help="length of each phase")
+    args = parser.parse_args()
+
+    base = args.url.rstrip("/")
+    cheap = args.cheap or ["/api/cda/categories", "/api/prefixes", "/api/debug/config"]
+    heavy = args.heavy or ["/api/apple/heartrate/chart?bucket=raw"]
+
+    print(f"Cheap: {', '.join(cheap)}")
+    print(f"Heavy: {', '.join(heavy)} x {args.heavy_clients} clients")
+    idle = measure_cheap(base, cheap, args.seconds, args.cheap_clients)
+
+    stop = threading.Event()
+    heavy_latencies: list[float] = []
+
+    def heavy_client(offset: int):
+        i = offset
+        while not stop.is_set():
+            heavy_latencies.append(fetch(base + heavy[i % len(heavy)]))
+            i += 1
+
+    threads = [threading.Thread(target=heavy_client, args=(i,), daemon=True) for i in range(args.heavy_clients)]
+    for t in threads:
+        t.start()
+    time.sleep(min(1.0, args.seconds / 10))  # let the heavy queries get going
+    loaded = measure_cheap(base, cheap, args.seconds, args.cheap_clients)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    print(f"{'':<14}{'requests':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    report("cheap, idle", idle)
+    report("cheap, loaded", loaded)
+    if heavy_latencies:
+        report("heavy", heavy_latencies)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,29 +5,49 @@ A web interface for exploring health data from Apple Health exports.
 Provides the same functionality as the text-based menu system with a modern web UI.
 """
 
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, Request, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.datastructures import QueryParams
+from contextlib import asynccontextmanager, suppress
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+import asyncio
+import base64
+import functools
+import os
+import threading
+import time
+import inspect
+import anyio
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Sequence
+from pydantic import BaseModel
+import hashlib
 import json
-import glob
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
 from io import StringIO
 import csv
 
 import config
 from health_lib import (
-    list_prefixes, list_categories, list_vitals, 
-    yield_observation_files, extract_all_values, StatInfo,
-    ValueString
+    get_prefix_catalog, get_observation_index, sync_observation_index, StatInfo,
+    ValueString, out_of_range, iter_cursor, yield_resources, read_resource, ndjson_files
 )
+from health_lib_unified import list_metrics, query_metric_series, metric_origins, refresh_configured_store
+from downsample import METHODS as DOWNSAMPLE_METHODS, downsample_indices, downsample_pairs
+from chart_payload import BINARY_MEDIA_TYPE, make_scaffold, columnar, pack_binary
+from db_pool import file_signature, tuple_cursor
+from response_cache import ResponseCache, CachedResponse
+from timing import Metrics, TimingMiddleware, span, record
 from health_lib_cda import (
     list_cda_categories, get_cda_observations, get_cda_chart_data,
-    list_cda_observation_types, CDAObservation, CDACategory
+    list_cda_observation_types, CDAObservation, CDACategory, get_cda_connection, get_cda_catalog_entry,
+    count_cda_chart_points, get_cda_chart_series, get_cda_tile, get_cda_catalog_index, observation_slug,
+    resolve_cda_category
 )
-import sqlite3
 from datetime import datetime, timedelta
 from io import StringIO
 import csv
@@ -40,40 +60,293 @@ from models import (
     ReferenceRange
 )
 
+async def poll_fhir_changes(interval: float):
+    """
+    Apply new, changed and deleted clinical-records files to the FHIR index every interval seconds, and bring the
+    unified store up to date. That also retries a refresh that failed, like the first one.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            _, clinical_path = get_health_paths()
+            changes = await run_in_threadpool(sync_observation_index, clinical_path, config.get_fhir_index_path())
+            if changes.changed:
+                print(f"🔄 FHIR index updated: {changes}")
+            # Only compares signatures when nothing changed
+            await run_in_threadpool(refresh_unified_store)
+        except Exception as e:
+            print(f"FHIR change scan failed: {e}")
+
+
+def refresh_unified_store():
+    """Reload the sources of the unified store that changed. The first load of a large Apple database takes a while."""
+    try:
+        reloaded = refresh_configured_store(fhir_index=get_fhir_index())
+        if reloaded:
+            print(f"🔄 Unified store reloaded: {reloaded}")
+    except Exception as e:
+        print(f"Unified store refresh failed: {e}")
+
+
+# Blocking work (SQLite queries, reading FHIR JSON) must stay off the event loop, so endpoints that do any are
+# plain `def` and run in the worker thread pool. Chart queries can take seconds on large databases, so they also
+# share a smaller limit, and cheap requests always find a free thread.
+_heavy_limiter: Optional[anyio.CapacityLimiter] = None
+
+
+def heavy_query(func):
+    """Run a blocking endpoint in a worker thread, at most config.get_heavy_query_limit() at a time."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        global _heavy_limiter
+        if _heavy_limiter is None:
+            _heavy_limiter = anyio.CapacityLimiter(config.get_heavy_query_limit())
+        queued = time.perf_counter()
+
+        def run():
+            record("queue", time.perf_counter() - queued)
+            return func(*args, **kwargs)
+        return await anyio.to_thread.run_sync(run, limiter=_heavy_limiter)
+    return wrapper
+
+
+# Every data endpoint's response has an ETag made from the endpoint, its parameters and the signatures of the files
+# its data comes from, so browsers can revalidate, and get a 304 before any query runs. Chart and data responses are
+# also kept, see response_cache.py, under the same key. Rebuilding a database or adding a clinical record changes it.
+_response_cache: Optional[ResponseCache] = None
+
+# Also part of every ETag, so a response from before the server was started, maybe with other code, isn't reused
+_SERVER_START = time.time()
+
+
+def get_response_cache() -> ResponseCache:
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(int(config.get_response_cache_mb() * 1024 * 1024))
+    return _response_cache
+
+
+def fhir_sources() -> list[Path]:
+    """
+    What the FHIR endpoints depend on: the index, the directory it is synced from, and the directory's .ndjson
+    files, which can be rewritten in place
+    """
+    clinical_path = get_health_paths()[1]
+    return [config.get_fhir_index_path(), clinical_path, *ndjson_files(clinical_path)]
+
+
+def _cache_key_value(value: Any) -> Any:
+    if isinstance(value, Request):
+        # The only thing about the request the endpoints use, see chart_payload()
+        return BINARY_MEDIA_TYPE in value.headers.get("accept", "")
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def _cached_body(result: Any, model: Any) -> Optional[CachedResponse]:
+    """A result as the bytes FastAPI would send, or None for a streaming response"""
+    if isinstance(result, Response):
+        if not hasattr(result, "body"):
+            return None
+        headers = tuple((k, v) for k, v in result.headers.items() if k not in ("content-length", "content-type"))
+        return CachedResponse(bytes(result.body), result.media_type, headers)
+    with span("serialize"):
+        if model is not None and not isinstance(result, model):
+            result = model.model_validate(result)
+        return CachedResponse(JSONResponse(jsonable_encoder(result)).body, "application/json")
+
+
+def _not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """Whether the client's copy, going by If-None-Match, or If-Modified-Since without it, is still current"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def conditional_response(*sources, cache: bool = False):
+    """
+    Give an endpoint's responses an ETag and Last-Modified, from its parameters and the files its data comes from,
+    and answer a request for what the client already has with a 304, without calling the endpoint. Clients are told
+    to revalidate every time. Errors get neither.
+    :param sources: Functions returning the path, or list of paths, of the files the endpoint's data comes from
+    :param cache: Also answer repeated requests from the response cache, and let concurrent identical requests
+        share one computation
+    """
+    def decorate(func):
+        signature = inspect.signature(func)
+        model = signature.return_annotation
+        model = model if isinstance(model, type) and issubclass(model, BaseModel) else None
+        call = func if inspect.iscoroutinefunction(func) else functools.partial(run_in_threadpool, func)
+        request_param = next((name for name, p in signature.parameters.items() if p.annotation is Request), None)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request = kwargs[request_param] if request_param else kwargs.pop("conditional_request")
+            paths = []
+            for source in sources:
+                path = source()
+                paths.extend(path if isinstance(path, list) else [path])
+            signatures = tuple(file_signature(p) for p in paths)
+            key = (func.__name__, tuple(sorted((k, _cache_key_value(v)) for k, v in kwargs.items())), signatures)
+
+            last_modified = max([s[3] / 1e9 for s in signatures if s] + [_SERVER_START])
+            etag = '"' + hashlib.blake2b(repr((key, _SERVER_START)).encode(), digest_size=12).hexdigest() + '"'
+            validators = {"ETag": etag, "Last-Modified": formatdate(last_modified, usegmt=True),
+                          "Cache-Control": "no-cache"}
+            if request_param:
+                validators["Vary"] = "Accept"
+            if _not_modified(request, etag, last_modified):
+                return Response(status_code=304, headers=validators)
+
+            uncached = []
+
+            async def compute():
+                result = await call(*args, **kwargs)
+                entry = _cached_body(result, model)
+                if entry is None:
+                    uncached.append(result)
+                return entry
+
+            entry = await (get_response_cache().get_or_compute(key, compute, func.__name__) if cache else compute())
+            if entry is None:
+                uncached[0].headers.update(validators)
+                return uncached[0]
+            return Response(entry.body, media_type=entry.media_type, headers=dict(entry.headers) | validators)
+
+        if not request_param:
+            # FastAPI passes the request for the conditional headers, without the endpoint having to take it
+            wrapper.__signature__ = signature.replace(parameters=[*signature.parameters.values(), inspect.Parameter(
+                "conditional_request", inspect.Parameter.KEYWORD_ONLY, annotation=Request)])
+        return wrapper
+    return decorate
+
+
+def cached_response(*sources):
+    """conditional_response() with the response cache, for chart and data endpoints"""
+    return conditional_response(*sources, cache=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = config.get_worker_threads()
+    interval = config.get_fhir_scan_interval()
+    poller = asyncio.create_task(poll_fhir_changes(interval)) if interval > 0 else None
+    # In the background, so the server is up while a large source loads. The store is in WAL mode, so it can be
+    # read meanwhile.
+    unified = asyncio.create_task(run_in_threadpool(refresh_unified_store))
+    yield
+    for task in (poller, unified):
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+
 app = FastAPI(
     title="Health Data Explorer",
     description="Web interface for exploring Apple Health data exports",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Every response has a Server-Timing header with the spans of its request, see timing.py, and /api/debug/metrics
+# has the latencies of each route
+request_metrics = Metrics()
+app.add_middleware(TimingMiddleware, metrics=request_metrics)
+
+# Static files. Pages link them with static_url(), whose URLs change with the file's content, so they can be cached
+# for good.
+_static_hashes: dict[str, tuple[tuple[int, int, int], str]] = {}
+
+
+def _content_hash(path, st: os.stat_result) -> str:
+    """A hash of a file's content, read again only when the file changes"""
+    signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+    cached = _static_hashes.get(str(path))
+    if cached is None or cached[0] != signature:
+        cached = (signature, hashlib.sha1(Path(path).read_bytes()).hexdigest()[:12])
+        _static_hashes[str(path)] = cached
+    return cached[1]
+
+
+def static_url(path: str) -> str:
+    """The URL of a file in static/, with a hash of its content, like /static/js/app.js?v=3f2a..."""
+    full_path = os.path.realpath(os.path.join("static", path))
+    try:
+        return f"/static/{path}?v={_content_hash(full_path, os.stat(full_path))}"
+    except OSError:
+        return f"/static/{path}"
+
+
+class HashedStaticFiles(StaticFiles):
+    """StaticFiles that lets browsers keep a file for a year when the URL has its current hash, see static_url()"""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        version = QueryParams(scope.get("query_string", b"")).get("v")
+        if version and version == _content_hash(os.path.realpath(full_path), stat_result):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
+app.mount("/static", HashedStaticFiles(directory="static"), name="static")
 
 # Templates
-templates = Jinja2Templates(directory="templates")
+class TimedTemplates(Jinja2Templates):
+    """Jinja2Templates that times rendering as the render span"""
+
+    def TemplateResponse(self, *args, **kwargs):
+        with span("render"):
+            return super().TemplateResponse(*args, **kwargs)
+
+
+templates = TimedTemplates(directory="templates")
+templates.env.globals["static_url"] = static_url
 
 # Health data paths
+_reported_health_paths = set()
+
 def get_health_paths():
     """Get the base path and clinical records path for health data"""
     base_path = config.get_source_dir()
     clinical_path = base_path / "clinical-records"
-    try:
-        # Helpful diagnostics in server logs
+    if base_path not in _reported_health_paths:
+        # Helpful diagnostics in server logs, once per configured path. /api/debug/config has the details.
+        _reported_health_paths.add(base_path)
         print(f"🔧 Configured HEALTH_DATA_DIR: {base_path}")
         print(f"   Exists: {base_path.exists()} | clinical-records: {clinical_path.exists()}")
-    except Exception:
-        # Avoid breaking on any unexpected errors in printing
-        pass
     return base_path, clinical_path
 
+def get_fhir_catalog():
+    """Get the shared prefix catalog for the clinical records directory. Rescanned only when the directory changes."""
+    _, clinical_path = get_health_paths()
+    return get_prefix_catalog(clinical_path)
+
+def get_fhir_index():
+    """Get the shared observation index for the clinical records directory, synced if the directory changed."""
+    _, clinical_path = get_health_paths()
+    return get_observation_index(clinical_path, config.get_fhir_index_path())
+
 def get_navigation_context():
     """Get navigation context for all templates"""
-    _, clinical_path = get_health_paths()
-    prefixes = list_prefixes(clinical_path)
+    prefixes = get_fhir_catalog().prefixes
+    # convert_synthea.py --output-format index puts observations only in the index, without any files
+    has_fhir_data = len(prefixes) > 0 or (config.get_fhir_index_path().exists()
+                                          and get_fhir_index().has_ingested_sources())
     return {
-        "has_fhir_data": len(prefixes) > 0,
+        "has_fhir_data": has_fhir_data,
         "has_cda_data": config.has_cda_database(),
-        "has_apple_health_data": config.has_apple_health_database()
+        "has_apple_health_data": config.has_apple_health_database(),
+        "has_unified_data": config.get_unified_database_path().exists()
     }
 
 @app.get("/api/debug/config", response_class=JSONResponse)
@@ -94,41 +367,46 @@ def debug_config():
         "has_apple_health_db": config.has_apple_health_database(),
         "apple_health_db_path": str(config.get_apple_health_database_path()),
         "cda_db_path": str(config.get_cda_database_path()),
+        "unified_db_path": str(config.get_unified_database_path()),
     }
 
+@app.get("/api/debug/cache", response_class=JSONResponse)
+def debug_cache(clear: bool = False):
+    """Hit rates and size of the response cache, per endpoint. clear=true empties it."""
+    cache = get_response_cache()
+    if clear:
+        cache.clear()
+    return cache.stats()
+
+@app.get("/api/debug/metrics", response_class=JSONResponse)
+def debug_metrics(reset: bool = False):
+    """Latency percentiles, errors and mean span times per route. reset=true clears them."""
+    stats = request_metrics.stats()
+    if reset:
+        request_metrics.reset()
+    return stats
+
 @app.get("/", response_class=HTMLResponse)
-async def homepage(request: Request):
-    """Homepage with main navigation menu"""
-    import time
-    start_time = time.time()
-    
+def homepage(request: Request):
+    """Homepage with main navigation menu. Its Server-Timing header has the time of each data source."""
     try:
         # FHIR data loading
-        fhir_start = time.time()
-        _, clinical_path = get_health_paths()
-        prefixes = list_prefixes(clinical_path)
-        
-        # Convert to list of dicts for template
-        menu_items = [
-            {"name": prefix, "count": count, "url": get_menu_url(prefix)}
-            for prefix, count in prefixes.items()
-        ]
-        fhir_time = time.time() - fhir_start
-        print(f"🕐 FHIR data loading took: {fhir_time:.2f}s")
+        with span("fhir"):
+            prefixes = get_fhir_catalog().prefixes
+            
+            # Convert to list of dicts for template
+            menu_items = [
+                {"name": prefix, "count": count, "url": get_menu_url(prefix)}
+                for prefix, count in prefixes.items()
+            ]
         
         # Add CDA data if available
-        cda_start = time.time()
         cda_items = []
         cda_total_records = 0
         if config.has_cda_database():
             try:
-                from health_lib_cda import get_cda_statistics
-                
-                categories_start = time.time()
-                # Log CDA categories query
-                print("🔍 CDA categories query:")
-                print("   SELECT category, COUNT(*) as count FROM cda_observations GROUP BY category ORDER BY count DESC")
-                cda_categories = list_cda_categories()
+                with span("cda"):
+                    cda_categories = list_cda_categories()
                 cda_items = [
                     {
                         "name": f"CDA - {cat.name}",
@@ -137,51 +415,24 @@ async def homepage(request: Request):
                     }
                     for cat in cda_categories
                 ]
-                categories_time = time.time() - categories_start
-                print(f"🕐   CDA categories query took: {categories_time:.2f}s")
-                
-                # Get total CDA record count - log what this function actually does
-                stats_start = time.time()
-                print("🔍 CDA stats queries (get_cda_statistics function):")
-                print("   1. SELECT COUNT(*) as total FROM cda_observations")
-                print("   2. SELECT MIN(date) as min_date, MAX(date) as max_date FROM cda_observations")
-                print("   3. SELECT source_name, COUNT(*) as count FROM cda_observations GROUP BY source_name ORDER BY count DESC")
-                print("   4. SELECT category, COUNT(*) as count FROM cda_observations GROUP BY category ORDER BY count DESC")
-                cda_stats = get_cda_statistics()
-                cda_total_records = cda_stats.get("total_observations", 0)
-                stats_time = time.time() - stats_start
-                print(f"🕐   CDA stats query took: {stats_time:.2f}s")
+                # Total CDA record count, from the same catalog
+                cda_total_records = sum(cat.count for cat in cda_categories)
                 
             except Exception as e:
                 # If there's any issue getting CDA stats, fall back to 0
                 cda_total_records = 0
-        cda_time = time.time() - cda_start
-        print(f"🕐 CDA data loading took: {cda_time:.2f}s")
         
         # Add Apple Health data if available
-        apple_start = time.time()
         apple_health_items = []
         apple_health_total_records = 0
         if config.has_apple_health_database():
             try:
                 from health_lib_apple import list_apple_health_categories
-                import sqlite3
-                
-                stats_start = time.time()
-                # Use sqlite_sequence for instant count - much faster than COUNT(*)
-                conn = sqlite3.connect(config.get_apple_health_database_path())
-                cursor = conn.execute("SELECT seq FROM sqlite_sequence WHERE name='apple_health_records'")
-                result = cursor.fetchone()
-                apple_health_total_records = result[0] if result else 0
-                conn.close()
-                stats_time = time.time() - stats_start
-                print(f"🕐   Apple Health count query (sqlite_sequence) took: {stats_time:.2f}s")
                 
-                categories_start = time.time()
-                # Get Apple Health categories for cards
-                apple_categories = list_apple_health_categories()
-                categories_time = time.time() - categories_start
-                print(f"🕐   Apple Health categories query took: {categories_time:.2f}s")
+                # Get Apple Health categories for cards, and the total count, from the catalog
+                with span("apple"):
+                    apple_categories = list_apple_health_categories()
+                apple_health_total_records = sum(cat.count for cat in apple_categories)
                 
                 # Show top 6 categories on homepage
                 apple_health_items = [
@@ -197,11 +448,8 @@ async def homepage(request: Request):
             except Exception as e:
                 # If there's any issue getting Apple Health stats, fall back to 0
                 apple_health_total_records = 0
-        apple_time = time.time() - apple_start
-        print(f"🕐 Apple Health data loading took: {apple_time:.2f}s")
         
         # Build template context with navigation
-        context_start = time.time()
         context = {
             "request": request, 
             "menu_items": menu_items,
@@ -215,23 +463,16 @@ async def homepage(request: Request):
             "apple_health_total_records": apple_health_total_records
         }
         context.update(get_navigation_context())
-        context_time = time.time() - context_start
-        print(f"🕐 Context building took: {context_time:.2f}s")
-        
-        total_time = time.time() - start_time
-        print(f"🕐 TOTAL HOMEPAGE LOAD TIME: {total_time:.2f}s")
-        print(f"🔍 Breakdown: FHIR={fhir_time:.2f}s, CDA={cda_time:.2f}s, Apple={apple_time:.2f}s, Context={context_time:.2f}s")
         
         return templates.TemplateResponse("index.html", context)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading homepage: {str(e)}")
 
 @app.get("/fhir", response_class=HTMLResponse)
-async def fhir_page(request: Request):
+def fhir_page(request: Request):
     """FHIR data overview page showing all FHIR resource types"""
     try:
-        _, clinical_path = get_health_paths()
-        prefixes = list_prefixes(clinical_path)
+        prefixes = get_fhir_catalog().prefixes
         
         # Convert to list of dicts for template
         menu_items = [
@@ -266,21 +507,20 @@ def get_menu_url(prefix: str) -> str:
 
 
 @app.get("/api/prefixes")
-async def get_prefixes() -> PrefixResponse:
+@conditional_response(fhir_sources)
+def get_prefixes() -> PrefixResponse:
     """Get available data file prefixes"""
     try:
-        _, clinical_path = get_health_paths()
-        prefixes = list_prefixes(clinical_path)
+        prefixes = get_fhir_catalog().prefixes
         return PrefixResponse(prefixes=prefixes)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting prefixes: {str(e)}")
 
 @app.get("/observations", response_class=HTMLResponse)
-async def observations_page(request: Request):
+def observations_page(request: Request):
     """Observations main page showing categories"""
     try:
-        _, clinical_path = get_health_paths()
-        categories, counter, file_count = list_categories(clinical_path, False, one_prefix="Observation")
+        categories, counter, file_count = get_fhir_index().list_categories()
         
         # Convert to list of dicts for template with counts
         category_items = [
@@ -302,24 +542,23 @@ async def observations_page(request: Request):
         raise HTTPException(status_code=500, detail=f"Error loading observations: {str(e)}")
 
 @app.get("/api/observations/categories")
-async def get_observation_categories() -> CategoryResponse:
+@conditional_response(fhir_sources)
+def get_observation_categories() -> CategoryResponse:
     """Get available observation categories"""
     try:
-        _, clinical_path = get_health_paths()
-        categories, counter, file_count = list_categories(clinical_path, False, one_prefix="Observation")
+        categories, counter, file_count = get_fhir_index().list_categories()
         return CategoryResponse(categories=categories, counts=counter, total_files=file_count)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting categories: {str(e)}")
 
 @app.get("/observations/{category}", response_class=HTMLResponse)
-async def observation_category_page(request: Request, category: str):
+def observation_category_page(request: Request, category: str):
     """Show vitals within a specific category"""
     try:
-        _, clinical_path = get_health_paths()
         # Convert URL-safe category back to display format
         display_category = category.replace('-', ' ').title()
         
-        vitals = list_vitals(yield_observation_files(clinical_path), display_category)
+        vitals = get_fhir_index().list_vitals(display_category)
         
         # Convert to list of dicts for template  
         # Use URL-safe encoding that preserves original vital names
@@ -351,18 +590,36 @@ async def observation_category_page(request: Request, category: str):
         raise HTTPException(status_code=500, detail=f"Error loading category {category}: {str(e)}")
 
 @app.get("/api/observations/{category}/vitals")
-async def get_category_vitals(category: str) -> VitalResponse:
+@conditional_response(fhir_sources)
+def get_category_vitals(category: str) -> VitalResponse:
     """Get vitals for a specific category"""
     try:
-        _, clinical_path = get_health_paths()
         display_category = category.replace('-', ' ').title()
-        vitals = list_vitals(yield_observation_files(clinical_path), display_category)
+        vitals = get_fhir_index().list_vitals(display_category)
         return VitalResponse(category=display_category, vitals=vitals)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting vitals for {category}: {str(e)}")
 
+@app.get("/api/observations/{category}/out-of-range")
+@conditional_response(fhir_sources)
+def get_out_of_range(category: str):
+    """Observations in a category whose value is outside their reference range, newest first"""
+    try:
+        display_category = category.replace('-', ' ').title()
+        rows = get_fhir_index().list_out_of_range(display_category)
+        return {
+            "category": display_category,
+            "count": len(rows),
+            "data": [
+                {"name": name, "date": date, "value": value, "low": low, "high": high, "op": op, "filename": filename}
+                for _, name, date, value, low, high, op, filename in rows
+            ]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting out of range values: {str(e)}")
+
 @app.get("/observations/{category}/{vital}", response_class=HTMLResponse)
-async def vital_detail_page(request: Request, category: str, vital: str):
+def vital_detail_page(request: Request, category: str, vital: str):
     """Show detailed view of a specific vital with chart and data"""
     try:
         import urllib.parse
@@ -388,7 +645,8 @@ async def vital_detail_page(request: Request, category: str, vital: str):
         raise HTTPException(status_code=500, detail=f"Error loading vital {vital}: {str(e)}")
 
 @app.get("/api/observations/{category}/{vital}/data")
-async def get_vital_data(
+@cached_response(fhir_sources)
+def get_vital_data(
     category: str, 
     vital: str, 
     after: Optional[str] = None,
@@ -398,15 +656,11 @@ async def get_vital_data(
     """Get data for a specific vital"""
     try:
         import urllib.parse
-        _, clinical_path = get_health_paths()
         display_category = category.replace('-', ' ').title()
         display_vital = urllib.parse.unquote(vital)
         
-        # Extract the data using existing health_lib functions
-        ws = extract_all_values(
-            yield_observation_files(clinical_path), 
-            stat_info=StatInfo(display_category, display_vital)
-        )
+        # Extract the data from the observation index
+        ws = get_fhir_index().extract_all_values(StatInfo(display_category, display_vital))
         
         # Apply date filters if provided
         if after:
@@ -425,10 +679,13 @@ async def get_vital_data(
         for observation in ws:
             # Convert reference range if available
             ref_range = None
+            bounds = None
             if observation.range:
+                # bounds() also covers ranges that are only text, like "<36" or "6.0 - 7.7 g/dL"
+                bounds = observation.range.bounds()
                 ref_range = ReferenceRange(
-                    low=observation.range.low.value if observation.range.low else None,
-                    high=observation.range.high.value if observation.range.high else None,
+                    low=bounds[0] if bounds else None,
+                    high=bounds[1] if bounds else None,
                     text=observation.range.text,
                     unit=observation.range.low.unit if observation.range.low else None
                 )
@@ -443,6 +700,7 @@ async def get_vital_data(
                         "unit": value.unit,
                         "name": value.name,
                         "reference_range": ref_range,
+                        "out_of_range": out_of_range(value.value, *bounds) if bounds and len(observation.data) == 1 else None,
                         "is_text": False
                     })
                 else:  # ValueString
@@ -465,20 +723,117 @@ async def get_vital_data(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting data for {vital}: {str(e)}")
 
+# ============================================================================
+# Chart payloads
+# ============================================================================
+
+APPLE_DATA_ZOOM = [
+    {
+        "type": "inside",
+        "start": 0,
+        "end": 100,
+        "filterMode": "filter"
+    },
+    {
+        "start": 0,
+        "end": 100,
+        "handleIcon": "M10.7,11.9H9.3c-4.9,0.3-8.8,4.4-8.8,9.4c0,5,3.9,9.1,8.8,9.4h1.3c4.9-0.3,8.8-4.4,8.8-9.4C19.5,16.3,15.6,12.2,10.7,11.9z M13.3,24.4H6.7V23h6.6V24.4z M13.3,19.6H6.7v-1.4h6.6V19.6z",
+        "handleSize": "80%",
+        "handleStyle": {
+            "color": "#fff",
+            "shadowBlur": 3,
+            "shadowColor": "rgba(0, 0, 0, 0.6)",
+            "shadowOffsetX": 2,
+            "shadowOffsetY": 2
+        }
+    }
+]
+
+# The static parts of each kind of chart's option, see chart_payload.py. A chart that differs from its scaffold
+# still comes out right, only with a bigger option.
+CHART_SCAFFOLDS = {
+    "vital": make_scaffold(option={
+        "title": {"left": "center"},
+        "tooltip": {"trigger": "axis"},
+        "legend": {"top": "30"},
+        "xAxis": {"type": "time", "axisLabel": {"formatter": "{yyyy}-{MM}-{dd}", "rotate": 45},
+                  "splitLine": {"show": True}},
+        "yAxis": {"type": "value"},
+    }, series={"type": "line"}),
+    "cda": make_scaffold(option={
+        "title": {"left": "center"},
+        "tooltip": {"trigger": "axis", "axisPointer": {"type": "cross"}},
+        "legend": {"top": "50px"},
+        "grid": {"left": "50px", "right": "50px", "top": "100px", "bottom": "80px", "containLabel": True},
+        "xAxis": {"type": "time", "name": "Date/Time", "nameLocation": "middle", "nameGap": 30},
+        "yAxis": {"type": "value", "nameLocation": "middle", "nameGap": 40},
+        "dataZoom": [{"type": "inside"}, {"type": "slider", "bottom": "10px"}],
+    }, series={"type": "line", "smooth": True, "symbol": "circle", "symbolSize": 4}),
+    "apple": make_scaffold(option={
+        "tooltip": {"trigger": "axis", "axisPointer": {"type": "cross"}},
+        "xAxis": {"type": "time", "boundaryGap": False},
+        "yAxis": {"type": "value", "nameLocation": "middle", "nameGap": 50},
+        "dataZoom": APPLE_DATA_ZOOM,
+        "grid": {"left": "3%", "right": "4%", "bottom": "15%", "containLabel": True},
+    }, series={"type": "line", "smooth": True, "emphasis": {"focus": "series"}, "lineStyle": {"width": 2},
+               "itemStyle": {"borderWidth": 2}}),
+}
+# Part of the scaffolds' URLs, so they can be cached for good
+SCAFFOLD_VERSIONS = {kind: hashlib.sha1(json.dumps(scaffold, sort_keys=True).encode()).hexdigest()[:12]
+                     for kind, scaffold in CHART_SCAFFOLDS.items()}
+
+
+@app.get("/api/chart-scaffold/{kind}")
+def get_chart_scaffold(kind: str):
+    """The static part of a kind of chart's ECharts option, for chart responses in the columnar form"""
+    if kind not in CHART_SCAFFOLDS:
+        raise HTTPException(status_code=404, detail=f"Unknown chart kind: {kind}")
+    return JSONResponse(CHART_SCAFFOLDS[kind], headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
+def chart_payload(request: Request, result: dict, kind: str, format: Optional[str], precision: Optional[int]):
+    """
+    A chart endpoint's result, in the form the request asks for. With format=columnar, the chart_config is split
+    into the scaffold's URL, the differences from it, and data columns, and sent as binary if the client accepts
+    it (see chart_payload.py). Otherwise, or when the chart has no series, the result as it is.
+    """
+    chart_config = result.get("chart_config")
+    if format != "columnar" or not chart_config or "series" not in chart_config:
+        return result
+    payload = {key: value for key, value in result.items() if key != "chart_config"}
+    payload.update(columnar(chart_config, CHART_SCAFFOLDS[kind],
+                            f"/api/chart-scaffold/{kind}?v={SCAFFOLD_VERSIONS[kind]}", precision))
+    if BINARY_MEDIA_TYPE in request.headers.get("accept", ""):
+        return Response(pack_binary(payload), media_type=BINARY_MEDIA_TYPE)
+    return JSONResponse(payload)
+
+
+def check_payload_params(format: Optional[str], precision: Optional[int]) -> None:
+    """Raise a 400 for a format or precision chart_payload() can't do"""
+    if format not in (None, "echarts", "columnar"):
+        raise HTTPException(status_code=400, detail=f"Invalid format: {format}")
+    if precision is not None and not 0 <= precision <= 15:
+        raise HTTPException(status_code=400, detail=f"Invalid precision: {precision}")
+
+
 @app.get("/api/observations/{category}/{vital}/chart")
-async def get_chart_data(category: str, vital: str, after: Optional[str] = None, before: Optional[str] = None) -> ChartDataResponse:
-    """Get chart configuration data for ECharts"""
+@cached_response(fhir_sources)
+@heavy_query
+def get_chart_data(request: Request, category: str, vital: str, after: Optional[str] = None,
+                   before: Optional[str] = None, format: Optional[str] = None,
+                   precision: Optional[int] = None) -> ChartDataResponse:
+    """
+    Get chart configuration data for ECharts. With format=columnar, the compact form of chart_payload(), without
+    the dates, and without the series outside chart_config.
+    """
+    check_payload_params(format, precision)
     try:
         import urllib.parse
-        _, clinical_path = get_health_paths()
         display_category = category.replace('-', ' ').title()
         display_vital = urllib.parse.unquote(vital)
         
         # Extract the data
-        ws = extract_all_values(
-            yield_observation_files(clinical_path), 
-            stat_info=StatInfo(display_category, display_vital)
-        )
+        ws = get_fhir_index().extract_all_values(StatInfo(display_category, display_vital))
         
         # Apply date filters if provided
         if after:
@@ -573,12 +928,15 @@ async def get_chart_data(category: str, vital: str, after: Optional[str] = None,
             })
         
         # Check for reference range to add to chart
+        # The most common range for this vital, precomputed in the index. Open ends are filled in below.
         reference_range = None
-        if ws and ws[0].range and ws[0].range.low and ws[0].range.high:
+        bounds = get_fhir_index().reference_range(StatInfo(display_category, display_vital)) if ws else None
+        if bounds:
+            text = next((w.range.text for w in ws if w.range and w.range.bounds() == bounds and w.range.text), None)
             reference_range = {
-                "low": ws[0].range.low.value,
-                "high": ws[0].range.high.value,
-                "text": ws[0].range.text
+                "low": bounds[0],
+                "high": bounds[1],
+                "text": text or f"{bounds[0] if bounds[0] is not None else ''} - {bounds[1] if bounds[1] is not None else ''}"
             }
         
         # Generate ECharts configuration
@@ -619,6 +977,11 @@ async def get_chart_data(category: str, vital: str, after: Optional[str] = None,
             if all_values:
                 data_min = min(all_values)
                 data_max = max(all_values)
+                # Ranges like "<36" are open at one end. Health values don't go below 0, and the band can stop at the data.
+                if reference_range["low"] is None:
+                    reference_range["low"] = 0
+                if reference_range["high"] is None:
+                    reference_range["high"] = max(data_max, reference_range["low"])
                 ref_min = reference_range["low"]
                 ref_max = reference_range["high"]
                 
@@ -648,6 +1011,9 @@ async def get_chart_data(category: str, vital: str, after: Optional[str] = None,
                     ]
                 }
         
+        if format == "columnar":
+            return chart_payload(request, {"title": display_vital, "chart_config": chart_config}, "vital",
+                                 format, precision)
         return ChartDataResponse(
             title=display_vital,
             dates=dates,
@@ -657,9 +1023,235 @@ async def get_chart_data(category: str, vital: str, after: Optional[str] = None,
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating chart for {vital}: {str(e)}")
 
+# ============================================================================
+# Tables
+# ============================================================================
+# Tables are fetched a page at a time, with keyset pagination: a page's next_cursor is the sort key and id of its
+# last row, and the next page is the rows after that in the sort order. The database seeks straight to it through
+# an index, however deep the page, where OFFSET would read and skip every row before it.
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(sort: str, key: list) -> str:
+    """An opaque cursor for [sort value, id], in the order of sort, like -date"""
+    return base64.urlsafe_b64encode(json.dumps([sort, *key], separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], sort: str) -> Optional[list]:
+    """
+    The [sort value, id] of a cursor from encode_cursor(), or None for the first page. A cursor made for another
+    sort would skip or repeat rows, so it is an error, like one that isn't a cursor at all.
+    """
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        key = None
+    if not isinstance(key, list) or len(key) != 3:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+    if key[0] != sort:
+        raise HTTPException(status_code=400, detail=f"Cursor is for sort {key[0]}, not {sort}")
+    return key[1:]
+
+
+def parse_sort(sort: Optional[str], allowed: Sequence[str], default: str = "-date") -> tuple[str, bool]:
+    """(field, descending) from a sort parameter, a field name with a - in front for descending"""
+    sort = sort or default
+    field = sort[1:] if sort.startswith("-") else sort
+    if field not in allowed:
+        raise HTTPException(status_code=400, detail=f"Invalid sort: {sort}, expected one of {', '.join(allowed)}")
+    return field, sort.startswith("-")
+
+
+def sort_name(field: str, descending: bool) -> str:
+    """The sort parameter for (field, descending), the inverse of parse_sort()"""
+    return "-" + field if descending else field
+
+
+def check_page_size(page_size: Optional[int]) -> None:
+    if page_size is not None and not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"Invalid page size: {page_size}, expected 1 to {MAX_PAGE_SIZE}")
+
+
+def order_by(sort_column: str, descending: bool) -> str:
+    """The order of keyset_page_query(), for exports of the same rows"""
+    direction = "DESC" if descending else "ASC"
+    return f"ORDER BY {sort_column} {direction}, id {direction}"
+
+
+def keyset_page_query(select: str, table: str, where: str, params: list, sort_column: str, descending: bool,
+                      cursor: Optional[list], page_size: Optional[int]) -> tuple[str, list]:
+    """
+    SQL for one page of a table in (sort_column, id) order. It asks for one row more than page_size, for
+    page_of() to know whether there is a next page.
+    :param page_size: None for every row after the cursor
+    """
+    params = list(params)
+    if cursor is not None:
+        where += f" AND ({sort_column}, id) {'<' if descending else '>'} (?, ?)"
+        params += cursor
+    query = f"SELECT {select} FROM {table} WHERE {where} {order_by(sort_column, descending)}"
+    if page_size is not None:
+        query += " LIMIT ?"
+        params.append(page_size + 1)
+    return query, params
+
+
+def page_of(rows: list, page_size: Optional[int], sort: str, key) -> tuple[list, Optional[str]]:
+    """
+    The rows of a page, and the cursor of the next page if there is one.
+    :param sort: The sort parameter the rows are in, see sort_name()
+    :param key: key(row) is [sort value, id]
+    """
+    if page_size is None or len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(sort, key(rows[-1]))
+
+
+# FHIR resources are files, so their tables are built in memory: a slim row per resource, without the resource
+# itself, which /api/data/{resource_type}/{id} returns. They are rebuilt when the index or the directory changes.
+FHIR_TABLE_SORTS = ("date", "text", "status")
+_fhir_tables: dict[tuple[str, str], tuple[tuple, list[dict], dict[str, str]]] = {}
+_fhir_tables_lock = threading.Lock()
+
+
+def fhir_table(fhir_type: str, make_row) -> tuple[list[dict], dict[str, tuple[Path, int]]]:
+    """
+    The rows of every resource of a type, newest first, and the file and offset of each id, for read_resource.
+    :param make_row: Makes the row of a resource: resource_type, id, date, status and text
+    """
+    signature = tuple(file_signature(p) for p in fhir_sources())
+    key = (fhir_type, make_row.__name__)
+    with _fhir_tables_lock:
+        cached = _fhir_tables.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1], cached[2]
+    rows = []
+    paths = {}
+    with span("read_files"):
+        for file_path in get_fhir_catalog().files.get(fhir_type, []):
+            for offset, resource in yield_resources(file_path):
+                row = make_row(resource)
+                row["resource_type"] = row["resource_type"] or fhir_type
+                # Ids must be unique for the cursors and the detail URLs
+                if row["id"] in paths or not row["id"] or row["id"] == "Unknown":
+                    row["id"] = file_path.stem + (f"-{offset}" if offset else "")
+                paths[row["id"]] = (file_path, offset)
+                rows.append(row)
+    rows.sort(key=lambda r: (r["date"], r["id"]), reverse=True)
+    with _fhir_tables_lock:
+        _fhir_tables[key] = (signature, rows, paths)
+    return rows, paths
+
+
+def fhir_table_response(fhir_type: str, make_row, q: Optional[str], status: Optional[str], year: Optional[str],
+                        sort: Optional[str], cursor: Optional[str], page_size: Optional[int], format: Optional[str]):
+    """
+    One page of a FHIR table, filtered and sorted, or with format=csv, all the rows that match.
+    :param q: Only rows whose text, status or id contain this, ignoring case
+    :param status: Only rows with this status, ignoring case
+    :param year: Only rows from this year
+    """
+    field, descending = parse_sort(sort, FHIR_TABLE_SORTS)
+    check_page_size(page_size)
+    after = decode_cursor(cursor, sort_name(field, descending))
+    rows, _ = fhir_table(fhir_type, make_row)
+
+    facets = {"status": {}, "year": {}}
+    for row in rows:
+        facets["status"][row["status"]] = facets["status"].get(row["status"], 0) + 1
+        if row["date"][:4].isdigit():
+            facets["year"][row["date"][:4]] = facets["year"].get(row["date"][:4], 0) + 1
+
+    q, status = (q or "").lower(), (status or "").lower()
+    matching = [row for row in rows
+                if (not q or q in row["text"].lower() or q in row["status"].lower() or q in row["id"].lower())
+                and (not status or status == row["status"].lower())
+                and (not year or row["date"].startswith(year))]
+    matching.sort(key=lambda r: (str(r[field]), r["id"]), reverse=descending)
+
+    if format == "csv":
+        fields = ["description", "date", "status", "resource_type", "id"]
+        return StreamingResponse(
+            _csv_chunks(((r["text"], r["date"], r["status"], r["resource_type"], r["id"]) for r in matching), fields),
+            media_type=EXPORT_MEDIA_TYPES["csv"],
+            headers={"Content-Disposition": f'attachment; filename="{fhir_type.lower()}.csv"'})
+
+    if after is not None:
+        after = tuple(after)
+        matching_after = [r for r in matching if ((str(r[field]), r["id"]) < after if descending
+                                                  else (str(r[field]), r["id"]) > after)]
+    else:
+        matching_after = matching
+    page, next_cursor = page_of(matching_after, page_size or DEFAULT_PAGE_SIZE, sort_name(field, descending),
+                                lambda r: [str(r[field]), r["id"]])
+    return {"records": page, "count": len(matching), "total": len(rows), "facets": facets, "next_cursor": next_cursor}
+
+
+def _fhir_record_row(record: dict) -> dict:
+    """The table row of any FHIR resource, from the fields most of them have"""
+    # Extract date from various possible fields
+    date = (record.get('recordedDate') or 
+           record.get('authoredOn') or 
+           record.get('effectiveDateTime') or 
+           record.get('performedDateTime') or 
+           'Unknown')
+    
+    # Extract status from various possible fields
+    status = record.get('status')
+    if not status and record.get('clinicalStatus'):
+        clinical_status = record.get('clinicalStatus', {})
+        coding = clinical_status.get('coding', [])
+        if coding:
+            status = coding[0].get('code')
+    if not status:
+        status = 'Unknown'
+    
+    # Extract text description from various possible fields
+    text = record.get('code', {}).get('text')
+    if not text:
+        text = record.get('medicationCodeableConcept', {}).get('text')
+    if not text and record.get('category'):
+        text = record.get('category', [{}])[0].get('text')
+    if not text:
+        text = 'Unknown'
+    
+    return {
+        "resource_type": record.get('resourceType'),
+        "id": record.get('id', 'Unknown'),
+        "date": date,
+        "status": status,
+        "text": text
+    }
+
+
+def _diagnostic_report_row(report: dict) -> dict:
+    return {
+        "resource_type": report.get('resourceType', 'DiagnosticReport'),
+        "id": report.get('id', 'Unknown'),
+        "date": report.get('effectiveDateTime', 'Unknown'),
+        "status": report.get('status', 'Unknown'),
+        "text": report.get('code', {}).get('text', 'Unknown Report Type')
+    }
+
+
+def _document_row(record: dict) -> dict:
+    return {
+        "resource_type": record.get('resourceType', 'DocumentReference'),
+        "id": record.get('id', 'Unknown'),
+        "date": record.get('date', 'Unknown'),
+        "status": record.get('docStatus', 'Unknown'),
+        "text": record.get('description') or record.get('type', {}).get('text', 'Document')
+    }
+
+
 # Medical Records Endpoints
 @app.get("/conditions", response_class=HTMLResponse)
-async def conditions_page(request: Request):
+def conditions_page(request: Request):
     """Conditions page"""
     return templates.TemplateResponse(
         "conditions.html",
@@ -673,16 +1265,14 @@ async def conditions_page(request: Request):
     )
 
 @app.get("/api/conditions")
-async def get_conditions() -> ConditionsResponse:
+@conditional_response(fhir_sources)
+def get_conditions() -> ConditionsResponse:
     """Get all conditions data"""
     try:
-        _, clinical_path = get_health_paths()
-        path = clinical_path / "Condition*.json"
         conditions = []
         
-        for p in glob.glob(str(path)):
-            with open(p) as f:
-                condition = json.load(f)
+        for p in get_fhir_catalog().files.get("Condition", []):
+            for _, condition in yield_resources(p):
                 conditions.append(ConditionRecord(
                     resource_type=condition['resourceType'],
                     recorded_date=condition['recordedDate'],
@@ -699,7 +1289,7 @@ async def get_conditions() -> ConditionsResponse:
         raise HTTPException(status_code=500, detail=f"Error loading conditions: {str(e)}")
 
 @app.get("/medications", response_class=HTMLResponse)
-async def medications_page(request: Request):
+def medications_page(request: Request):
     """Medications page"""
     return templates.TemplateResponse(
         "medications.html",
@@ -711,16 +1301,14 @@ async def medications_page(request: Request):
     )
 
 @app.get("/api/medications")
-async def get_medications(include_inactive: bool = False) -> MedicationsResponse:
+@conditional_response(fhir_sources)
+def get_medications(include_inactive: bool = False) -> MedicationsResponse:
     """Get all medications data"""
     try:
-        _, clinical_path = get_health_paths()
-        path = clinical_path / "MedicationRequest*.json"
         medications = []
         
-        for p in glob.glob(str(path)):
-            with open(p) as f:
-                medication = json.load(f)
+        for p in get_fhir_catalog().files.get("MedicationRequest", []):
+            for _, medication in yield_resources(p):
                 is_active = not medication['status'] in ['completed', 'stopped']
                 
                 if is_active or include_inactive:
@@ -743,7 +1331,7 @@ async def get_medications(include_inactive: bool = False) -> MedicationsResponse
         raise HTTPException(status_code=500, detail=f"Error loading medications: {str(e)}")
 
 @app.get("/procedures", response_class=HTMLResponse)
-async def procedures_page(request: Request):
+def procedures_page(request: Request):
     """Procedures page"""
     return templates.TemplateResponse(
         "procedures.html",
@@ -755,16 +1343,14 @@ async def procedures_page(request: Request):
     )
 
 @app.get("/api/procedures")
-async def get_procedures() -> ProceduresResponse:
+@conditional_response(fhir_sources)
+def get_procedures() -> ProceduresResponse:
     """Get all procedures data"""
     try:
-        _, clinical_path = get_health_paths()
-        path = clinical_path / "Procedure*.json"
         procedures = []
         
-        for p in glob.glob(str(path)):
-            with open(p) as f:
-                procedure = json.load(f)
+        for p in get_fhir_catalog().files.get("Procedure", []):
+            for _, procedure in yield_resources(p):
                 
                 # Handle different date formats (performedDateTime vs performedPeriod)
                 performed_date = procedure.get('performedDateTime')
@@ -789,7 +1375,7 @@ async def get_procedures() -> ProceduresResponse:
 
 # Additional API endpoint for allergies (AllergyIntolerance)
 @app.get("/allergies", response_class=HTMLResponse)
-async def allergies_page(request: Request):
+def allergies_page(request: Request):
     """Allergies page"""
     return templates.TemplateResponse(
         "conditions.html",  # Reuse conditions template since structure is similar
@@ -803,16 +1389,14 @@ async def allergies_page(request: Request):
     )
 
 @app.get("/api/allergies")
-async def get_allergies() -> ConditionsResponse:
+@conditional_response(fhir_sources)
+def get_allergies() -> ConditionsResponse:
     """Get all allergies data"""
     try:
-        _, clinical_path = get_health_paths()
-        path = clinical_path / "AllergyIntolerance*.json"
         allergies = []
         
-        for p in glob.glob(str(path)):
-            with open(p) as f:
-                allergy = json.load(f)
+        for p in get_fhir_catalog().files.get("AllergyIntolerance", []):
+            for _, allergy in yield_resources(p):
                 allergies.append(ConditionRecord(
                     resource_type=allergy['resourceType'],
                     recorded_date=allergy['recordedDate'],
@@ -829,7 +1413,7 @@ async def get_allergies() -> ConditionsResponse:
         raise HTTPException(status_code=500, detail=f"Error loading allergies: {str(e)}")
 
 @app.get("/diagnosticreports", response_class=HTMLResponse)
-async def diagnosticreports_page(request: Request):
+def diagnosticreports_page(request: Request):
     """Diagnostic reports page"""
     return templates.TemplateResponse(
         "generic_data.html",  # Use generic template for better compatibility
@@ -843,36 +1427,22 @@ async def diagnosticreports_page(request: Request):
     )
 
 @app.get("/api/diagnosticreports")
-async def get_diagnosticreports():
-    """Get all diagnostic reports data - basic implementation"""
+@conditional_response(fhir_sources)
+def get_diagnosticreports(q: Optional[str] = None, status: Optional[str] = None, year: Optional[str] = None,
+                          sort: Optional[str] = None, cursor: Optional[str] = None, page_size: Optional[int] = None,
+                          format: Optional[str] = None):
+    """A page of diagnostic reports, newest first, see fhir_table_response()"""
     try:
-        _, clinical_path = get_health_paths()
-        path = clinical_path / "DiagnosticReport*.json"
-        records = []
-        
-        for p in glob.glob(str(path)):
-            with open(p) as f:
-                report = json.load(f)
-                # Format to match generic template expectations
-                records.append({
-                    "resource_type": report.get('resourceType', 'DiagnosticReport'),
-                    "id": report.get('id', 'Unknown'),
-                    "date": report.get('effectiveDateTime', 'Unknown'),
-                    "status": report.get('status', 'Unknown'),
-                    "text": report.get('code', {}).get('text', 'Unknown Report Type'),
-                    "raw_data": report
-                })
-        
-        # Sort by effective date (most recent first)
-        records.sort(key=lambda x: x.get('date', ''), reverse=True)
-        
-        return {"records": records, "count": len(records)}
+        return fhir_table_response("DiagnosticReport", _diagnostic_report_row, q, status, year, sort, cursor,
+                                   page_size, format)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading diagnostic reports: {str(e)}")
 
 # Document Reference handler (was mapped but missing)
 @app.get("/documents", response_class=HTMLResponse)
-async def documents_page(request: Request):
+def documents_page(request: Request):
     """Document references page"""
     return templates.TemplateResponse(
         "generic_data.html", 
@@ -886,55 +1456,31 @@ async def documents_page(request: Request):
     )
 
 @app.get("/api/documents")
-async def get_documents():
-    """Get all document references data"""
+@conditional_response(fhir_sources)
+def get_documents(q: Optional[str] = None, status: Optional[str] = None, year: Optional[str] = None,
+                  sort: Optional[str] = None, cursor: Optional[str] = None, page_size: Optional[int] = None,
+                  format: Optional[str] = None):
+    """A page of document references, newest first, see fhir_table_response()"""
     try:
-        _, clinical_path = get_health_paths()
-        pattern = clinical_path / "DocumentReference*.json"
-        records = []
-        
-        for file_path in glob.glob(str(pattern)):
-            with open(file_path) as f:
-                record = json.load(f)
-                
-                records.append({
-                    "resource_type": record.get('resourceType', 'DocumentReference'),
-                    "id": record.get('id', 'Unknown'),
-                    "date": record.get('date', 'Unknown'),
-                    "status": record.get('docStatus', 'Unknown'),
-                    "text": record.get('description') or record.get('type', {}).get('text', 'Document'),
-                    "raw_data": record
-                })
-        
-        # Sort by date (most recent first)
-        records.sort(key=lambda x: x.get('date', ''), reverse=True)
-        
-        return {"records": records, "count": len(records)}
+        return fhir_table_response("DocumentReference", _document_row, q, status, year, sort, cursor, page_size,
+                                   format)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading documents: {str(e)}")
 
 # Generic route handler for unmapped resource types
 @app.get("/data/{resource_type}", response_class=HTMLResponse)
-async def generic_data_page(request: Request, resource_type: str):
+def generic_data_page(request: Request, resource_type: str):
     """Generic data page for any FHIR resource type"""
     try:
-        # Find the exact resource type name from discovered prefixes
-        _, clinical_path = get_health_paths()
-        prefixes = list_prefixes(clinical_path)
-        
-        # Look for a matching resource type (case-insensitive)
-        fhir_type = None
-        for prefix in prefixes.keys():
-            if prefix.lower() == resource_type.lower():
-                fhir_type = prefix
-                break
+        # Find the exact resource type name from discovered prefixes (case-insensitive)
+        catalog = get_fhir_catalog()
+        fhir_type = catalog.resolve(resource_type)
         
         if not fhir_type:
             raise HTTPException(status_code=404, detail=f"No {resource_type} data found")
         
-        # Check if files exist (they should, since we found the prefix)
-        pattern = clinical_path / f"{fhir_type}*.json"
-        files = list(glob.glob(str(pattern)))
         
         return templates.TemplateResponse(
             "generic_data.html",
@@ -943,7 +1489,7 @@ async def generic_data_page(request: Request, resource_type: str):
                 "title": f"{fhir_type} Records",
                 "resource_type": fhir_type,
                 "api_endpoint": f"/api/data/{resource_type}",
-                "count": len(files),
+                "count": catalog.prefixes[fhir_type],
                 "breadcrumb": [{"name": "Home", "url": "/"}, {"name": f"{fhir_type} Records", "url": f"/data/{resource_type}"}]
             }
         )
@@ -953,81 +1499,55 @@ async def generic_data_page(request: Request, resource_type: str):
         raise HTTPException(status_code=500, detail=f"Error loading {resource_type}: {str(e)}")
 
 @app.get("/api/data/{resource_type}")
-async def get_generic_data(resource_type: str):
-    """Generic API endpoint for any FHIR resource type"""
+@conditional_response(fhir_sources)
+def get_generic_data(resource_type: str, q: Optional[str] = None, status: Optional[str] = None,
+                     year: Optional[str] = None, sort: Optional[str] = None, cursor: Optional[str] = None,
+                     page_size: Optional[int] = None, format: Optional[str] = None):
+    """
+    A page of the records of any FHIR resource type, newest first, see fhir_table_response(). The records are
+    slim rows; /api/data/{resource_type}/{id} has the whole resource.
+    """
     try:
-        # Find the exact resource type name from discovered prefixes
-        _, clinical_path = get_health_paths()
-        prefixes = list_prefixes(clinical_path)
-        
-        # Look for a matching resource type (case-insensitive)
-        fhir_type = None
-        for prefix in prefixes.keys():
-            if prefix.lower() == resource_type.lower():
-                fhir_type = prefix
-                break
+        # Find the exact resource type name from discovered prefixes (case-insensitive)
+        fhir_type = get_fhir_catalog().resolve(resource_type)
         
         if not fhir_type:
             raise HTTPException(status_code=404, detail=f"No {resource_type} data found")
         
-        pattern = clinical_path / f"{fhir_type}*.json"
-        records = []
-        
-        for file_path in glob.glob(str(pattern)):
-            with open(file_path) as f:
-                record = json.load(f)
-                
-                # Extract common fields that most FHIR resources have
-                
-                # Extract date from various possible fields
-                date = (record.get('recordedDate') or 
-                       record.get('authoredOn') or 
-                       record.get('effectiveDateTime') or 
-                       record.get('performedDateTime') or 
-                       'Unknown')
-                
-                # Extract status from various possible fields
-                status = record.get('status')
-                if not status and record.get('clinicalStatus'):
-                    clinical_status = record.get('clinicalStatus', {})
-                    coding = clinical_status.get('coding', [])
-                    if coding:
-                        status = coding[0].get('code')
-                if not status:
-                    status = 'Unknown'
-                
-                # Extract text description from various possible fields
-                text = record.get('code', {}).get('text')
-                if not text:
-                    text = record.get('medicationCodeableConcept', {}).get('text')
-                if not text and record.get('category'):
-                    text = record.get('category', [{}])[0].get('text')
-                if not text:
-                    text = 'Unknown'
-                
-                records.append({
-                    "resource_type": record.get('resourceType', fhir_type),
-                    "id": record.get('id', 'Unknown'),
-                    "date": date,
-                    "status": status,
-                    "text": text,
-                    "raw_data": record  # Include full record for detailed view
-                })
-        
-        # Sort by date (most recent first) 
-        records.sort(key=lambda x: x.get('date', ''), reverse=True)
-        
-        return {"records": records, "count": len(records)}
+        return fhir_table_response(fhir_type, _fhir_record_row, q, status, year, sort, cursor, page_size, format)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading {resource_type}: {str(e)}")
 
 
+@app.get("/api/data/{resource_type}/{record_id}")
+@conditional_response(fhir_sources)
+def get_generic_record(resource_type: str, record_id: str):
+    """One FHIR resource, as it is in its file"""
+    try:
+        fhir_type = get_fhir_catalog().resolve(resource_type)
+        location = fhir_table(fhir_type, _fhir_record_row)[1].get(record_id) if fhir_type else None
+        if not location:
+            raise HTTPException(status_code=404, detail=f"No {resource_type} record {record_id}")
+        return read_resource(*location)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error loading {resource_type} record {record_id}: {str(e)}")
+
+
 # ============================================================================
 # CDA (Clinical Document Architecture) API Endpoints
 # ============================================================================
 
+def cda_category_name(category: str) -> str:
+    """The CDA category of a URL slug. One with no observations is guessed from the slug, for the empty page."""
+    return resolve_cda_category(category) or category.replace('-', ' ').title()
+
+
 @app.get("/cda", response_class=HTMLResponse)
-async def cda_overview(request: Request):
+def cda_overview(request: Request):
     """CDA overview page showing all categories"""
     if not config.has_cda_database():
         return templates.TemplateResponse("error.html", {
@@ -1047,7 +1567,8 @@ async def cda_overview(request: Request):
 
 
 @app.get("/api/cda/categories")
-async def get_cda_categories():
+@conditional_response(config.get_cda_database_path)
+def get_cda_categories():
     """Get all CDA observation categories"""
     if not config.has_cda_database():
         return {"categories": []}
@@ -1065,7 +1586,7 @@ async def get_cda_categories():
 
 
 @app.get("/cda/{category}", response_class=HTMLResponse)
-async def cda_category_page(request: Request, category: str):
+def cda_category_page(request: Request, category: str):
     """CDA category page showing observation types"""
     if not config.has_cda_database():
         return templates.TemplateResponse("error.html", {
@@ -1075,11 +1596,7 @@ async def cda_category_page(request: Request, category: str):
         })
     
     # Convert URL-safe category back to original
-    category_name = category.replace('-', ' ').title()
-    if category_name.lower() == 'vital-signs':
-        category_name = 'Vital Signs'
-    elif category_name.lower() == 'laboratory':
-        category_name = 'Laboratory'
+    category_name = cda_category_name(category)
     
     observation_types = list_cda_observation_types(category_name)
     
@@ -1094,17 +1611,14 @@ async def cda_category_page(request: Request, category: str):
 
 
 @app.get("/api/cda/{category}")
-async def get_cda_category_data(category: str, limit: Optional[int] = 100):
+@conditional_response(config.get_cda_database_path)
+def get_cda_category_data(category: str, limit: Optional[int] = 100):
     """Get CDA observations for a category"""
     if not config.has_cda_database():
         return {"observations": []}
     
     # Convert URL-safe category back to original
-    category_name = category.replace('-', ' ').title()
-    if category_name.lower() == 'vital-signs':
-        category_name = 'Vital Signs'
-    elif category_name.lower() == 'laboratory':
-        category_name = 'Laboratory'
+    category_name = cda_category_name(category)
     
     observations = get_cda_observations(category_name, limit=limit)
     
@@ -1124,7 +1638,7 @@ async def get_cda_category_data(category: str, limit: Optional[int] = 100):
 
 
 @app.get("/cda/{category}/{observation_name}", response_class=HTMLResponse)
-async def cda_observation_page(request: Request, category: str, observation_name: str):
+def cda_observation_page(request: Request, category: str, observation_name: str):
     """CDA specific observation page with chart"""
     if not config.has_cda_database():
         return templates.TemplateResponse("error.html", {
@@ -1134,11 +1648,7 @@ async def cda_observation_page(request: Request, category: str, observation_name
         })
     
     # Convert URL-safe category back to original
-    category_name = category.replace('-', ' ').title()
-    if category_name.lower() == 'vital-signs':
-        category_name = 'Vital Signs'
-    elif category_name.lower() == 'laboratory':
-        category_name = 'Laboratory'
+    category_name = cda_category_name(category)
     
     # URL decode observation name
     observation_name = observation_name.replace('%20', ' ')
@@ -1153,130 +1663,190 @@ async def cda_observation_page(request: Request, category: str, observation_name
     return templates.TemplateResponse("cda_observation.html", context)
 
 
+# ============================================================================
+# Exports
+# ============================================================================
+
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "json": "application/json", "ndjson": "application/x-ndjson"}
+
+# Rows written before a chunk is sent, so an export of any size only ever holds this many
+EXPORT_CHUNK_ROWS = 1000
+
+
+def _csv_chunks(rows: Iterable[tuple], fields: Sequence[str]) -> Iterator[str]:
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(fields)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue()
+
+
+def _json_chunks(rows: Iterable[tuple], fields: Sequence[str], key: Optional[str],
+                 indent: Optional[int]) -> Iterator[str]:
+    """A JSON array of objects, or {key: array}, the same as json.dumps() would make it, written as it goes"""
+    if indent:
+        # Rows are flat, so their lines are written here: json.dumps() with indent is several times slower
+        start, separator, end = "[\n", ",\n", "\n]"
+        keys = [" " * 2 * indent + json.dumps(field) + ": " for field in fields]
+        opening, closing = " " * indent + "{\n", "\n" + " " * indent + "}"
+        encode = lambda row: opening + ",\n".join(key + json.dumps(v) for key, v in zip(keys, row)) + closing
+    else:
+        start, separator, end = "[", ",", "]"
+        encode = lambda row: json.dumps(dict(zip(fields, row)), ensure_ascii=False, separators=(",", ":"))
+    prefix = "{" + json.dumps(key) + ":" if key is not None else ""
+    suffix = "}" if key is not None else ""
+    parts = []
+    empty = True
+    for row in rows:
+        parts.append((prefix + start if empty else separator) + encode(row))
+        empty = False
+        if len(parts) == EXPORT_CHUNK_ROWS:
+            yield "".join(parts)
+            parts = []
+    parts.append(prefix + "[]" + suffix if empty else end + suffix)
+    yield "".join(parts)
+
+
+def _ndjson_chunks(rows: Iterable[tuple], fields: Sequence[str]) -> Iterator[str]:
+    parts = []
+    for row in rows:
+        parts.append(json.dumps(dict(zip(fields, row)), ensure_ascii=False, separators=(",", ":")) + "\n")
+        if len(parts) == EXPORT_CHUNK_ROWS:
+            yield "".join(parts)
+            parts = []
+    yield "".join(parts)
+
+
+def stream_export(cursor, format: str, filename: str, json_key: Optional[str] = None,
+                  json_indent: Optional[int] = None) -> StreamingResponse:
+    """
+    A query's rows as a CSV, JSON or NDJSON download, written while the rows are fetched, so memory stays the same
+    however many there are. The column names of the query are the CSV header and the JSON keys.
+    :param cursor: An executed query returning plain tuples, see tuple_cursor()
+    :param json_key: For format=json, the object key to put the array under, instead of the array alone
+    :param json_indent: For format=json, indent like json.dumps(indent=json_indent)
+    """
+    fields = [column[0] for column in cursor.description]
+    rows = iter_cursor(cursor, EXPORT_CHUNK_ROWS)
+    if format == "csv":
+        chunks = _csv_chunks(rows, fields)
+    elif format == "json":
+        chunks = _json_chunks(rows, fields, json_key, json_indent)
+    else:
+        chunks = _ndjson_chunks(rows, fields)
+    return StreamingResponse(chunks, media_type=EXPORT_MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'})
+
+
 @app.get("/api/cda/{category}/{observation_name}/data")
-async def get_cda_observation_data(
+@cached_response(config.get_cda_database_path)
+def get_cda_observation_data(
     category: str, 
     observation_name: str,
     after: Optional[str] = None,
     before: Optional[str] = None, 
     source: Optional[str] = None,
-    format: Optional[str] = None
+    format: Optional[str] = None,
+    q: Optional[str] = None,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = None
 ):
-    """Get detailed data for a specific CDA observation with filtering and export"""
+    """
+    Get detailed data for a specific CDA observation with filtering and export. The observations are sorted by date
+    or value (see parse_sort()), and with a page_size come a page at a time, after the cursor, which is the
+    next_cursor of the page before. format=csv, json or ndjson downloads every matching observation instead, in the
+    same order, streamed as it is read.
+    :param q: Only observations from sources whose name contains this
+    """
     if not config.has_cda_database():
         raise HTTPException(status_code=404, detail="CDA database not found")
+    sort_field, descending = parse_sort(sort, ("date", "value"))
+    check_page_size(page_size)
+    after_key = decode_cursor(cursor, sort_name(sort_field, descending))
     
     # Convert URL-safe category back to original
-    category_name = category.replace('-', ' ').title()
-    if category_name.lower() == 'vital-signs':
-        category_name = 'Vital Signs'
-    elif category_name.lower() == 'laboratory':
-        category_name = 'Laboratory'
+    category_name = cda_category_name(category)
     
     # URL decode observation name
     observation_name = observation_name.replace('%20', ' ')
     
     try:
-        conn = sqlite3.connect(config.get_cda_database_path())
-        conn.row_factory = sqlite3.Row
+        conn = get_cda_connection()
         
         # Build query with filters
-        query = """
-            SELECT * FROM cda_observations 
-            WHERE category = ? AND name = ?
-        """
+        where = "category = ? AND name = ?"
         params = [category_name, observation_name]
         
         if after:
-            query += " AND date >= ?"
+            where += " AND date >= ?"
             params.append(after)
         if before:
-            query += " AND date <= ?"
+            where += " AND date <= ?"
             params.append(before)
         if source:
-            query += " AND source_name = ?"
+            where += " AND source_name = ?"
             params.append(source)
-        
-        query += " ORDER BY date DESC"
-        
-        cursor = conn.execute(query, params)
+        if q:
+            where += " AND source_name LIKE ?"
+            params.append(f"%{q}%")
+        
+        # Exports are streamed, so their size doesn't matter
+        if format in EXPORT_MEDIA_TYPES:
+            columns = "date, value, unit, source_name" if format == 'csv' else \
+                "id, name, category, value, unit, date, source_name"
+            rows = tuple_cursor(conn).execute(
+                f"SELECT {columns} FROM cda_observations WHERE {where} {order_by(sort_field, descending)}", params)
+            return stream_export(rows, format, f"{observation_name.replace(' ', '_')}_data", json_key="observations")
+        
+        query, params = keyset_page_query("id, name, category, value, unit, date, source_name", "cda_observations",
+                                          where, params, sort_field, descending, after_key, page_size)
+        with span("query"):
+            rows, next_cursor = page_of(conn.execute(query, params).fetchall(), page_size,
+                                        sort_name(sort_field, descending), lambda row: [row[sort_field], row['id']])
         observations = []
         
-        for row in cursor.fetchall():
-            obs_data = {
-                "id": row['id'],
-                "name": row['name'],
-                "category": row['category'],
-                "value": row['value'],
-                "unit": row['unit'],
-                "date": row['date'],
-                "source_name": row['source_name']
-            }
-            observations.append(obs_data)
-        
-        conn.close()
-        
-        # Handle export formats
-        if format == 'csv':
-            output = StringIO()
-            writer = csv.DictWriter(output, fieldnames=['date', 'value', 'unit', 'source_name'])
-            writer.writeheader()
-            for obs in observations:
-                writer.writerow({
-                    'date': obs['date'],
-                    'value': obs['value'], 
-                    'unit': obs['unit'],
-                    'source_name': obs['source_name']
-                })
-            
-            from fastapi.responses import Response
-            return Response(
-                content=output.getvalue(),
-                media_type="text/csv",
-                headers={"Content-Disposition": f"attachment; filename={observation_name.replace(' ', '_')}_data.csv"}
-            )
-        
-        elif format == 'json':
-            from fastapi.responses import JSONResponse
-            return JSONResponse(
-                content={"observations": observations},
-                headers={"Content-Disposition": f"attachment; filename={observation_name.replace(' ', '_')}_data.json"}
-            )
+        with span("rows"):
+            for row in rows:
+                obs_data = {
+                    "id": row['id'],
+                    "name": row['name'],
+                    "category": row['category'],
+                    "value": row['value'],
+                    "unit": row['unit'],
+                    "date": row['date'],
+                    "source_name": row['source_name']
+                }
+                observations.append(obs_data)
         
         # Regular JSON response for web interface
-        return {"data": observations}
+        return {"data": observations, "next_cursor": next_cursor}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading observation data: {str(e)}")
 
 
 @app.get("/api/cda/{category}/{observation_name}/sources")
-async def get_cda_observation_sources(category: str, observation_name: str):
+@conditional_response(config.get_cda_database_path)
+def get_cda_observation_sources(category: str, observation_name: str):
     """Get available data sources for a CDA observation"""
     if not config.has_cda_database():
         raise HTTPException(status_code=404, detail="CDA database not found")
     
     # Convert URL-safe category back to original
-    category_name = category.replace('-', ' ').title()
-    if category_name.lower() == 'vital-signs':
-        category_name = 'Vital Signs'
-    elif category_name.lower() == 'laboratory':
-        category_name = 'Laboratory'
+    category_name = cda_category_name(category)
     
     # URL decode observation name
     observation_name = observation_name.replace('%20', ' ')
     
     try:
-        conn = sqlite3.connect(config.get_cda_database_path())
-        cursor = conn.execute("""
-            SELECT DISTINCT source_name 
-            FROM cda_observations 
-            WHERE category = ? AND name = ?
-            ORDER BY source_name
-        """, (category_name, observation_name))
-        
-        sources = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        entry = get_cda_catalog_entry(category_name, observation_name)
+        sources = entry.source_names() if entry else []
         
         return {"sources": sources}
         
@@ -1324,7 +1894,7 @@ def get_bucket_info(bucket_size: str) -> dict:
 def get_available_buckets(total_points: int) -> list:
     """Get list of available bucket options for the user"""
     buckets = [
-        {'value': 'raw', 'label': 'Raw Data', 'enabled': total_points <= 20000},
+        {'value': 'raw', 'label': 'Raw Data', 'enabled': True},  # downsampled to the chart's width
         {'value': 'hour', 'label': 'Hourly', 'enabled': True},
         {'value': 'day', 'label': 'Daily', 'enabled': True}, 
         {'value': 'week', 'label': 'Weekly', 'enabled': True},
@@ -1334,130 +1904,41 @@ def get_available_buckets(total_points: int) -> list:
     return buckets
 
 
-def process_raw_data(rows) -> dict:
-    """Process raw data points without bucketing"""
-    series_data = {}
-    
-    for row in rows:
-        source = row['source_name']
-        if source not in series_data:
-            series_data[source] = []
-        
-        # Convert date to timestamp
-        try:
-            dt = datetime.fromisoformat(row['date'].replace('Z', '+00:00'))
-            timestamp = int(dt.timestamp() * 1000)  # ECharts expects milliseconds
-            series_data[source].append([timestamp, row['value']])
-        except Exception as e:
-            print(f"Date parsing error: {e}")
-            continue
-    
-    return series_data
-
-
-def process_bucketed_data(rows, bucket_size: str) -> dict:
-    """Process data points with bucketing/grouping"""
-    from collections import defaultdict
-    import statistics
-    
-    # Group data by source and time bucket
-    bucketed_data = defaultdict(lambda: defaultdict(list))
-    
-    for row in rows:
-        source = row['source_name']
-        
-        try:
-            dt = datetime.fromisoformat(row['date'].replace('Z', '+00:00'))
-            
-            # Create bucket key based on bucket size
-            if bucket_size == 'hour':
-                bucket_key = dt.replace(minute=0, second=0, microsecond=0)
-            elif bucket_size == 'day':
-                bucket_key = dt.replace(hour=0, minute=0, second=0, microsecond=0)
-            elif bucket_size == 'week':
-                # Start of week (Monday)
-                days_since_monday = dt.weekday()
-                bucket_key = dt.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days_since_monday)
-            elif bucket_size == 'month':
-                bucket_key = dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            elif bucket_size == 'year':
-                bucket_key = dt.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-            else:
-                bucket_key = dt  # Fallback to raw
-            
-            bucketed_data[source][bucket_key].append(row['value'])
-            
-        except Exception as e:
-            print(f"Date parsing error in bucketing: {e}")
-            continue
-    
-    # Convert to final format with aggregated values
-    series_data = {}
-    
-    for source, time_buckets in bucketed_data.items():
-        series_data[source] = []
-        
-        for bucket_time, values in sorted(time_buckets.items()):
-            # Use mean for aggregation (much faster than median)
-            aggregated_value = sum(values) / len(values) if values else 0
-            timestamp = int(bucket_time.timestamp() * 1000)
-            series_data[source].append([timestamp, aggregated_value])
-    
-    return series_data
-
-
 @app.get("/api/cda/{category}/{observation_name}/chart")
-async def get_cda_chart_data_endpoint(
+@cached_response(config.get_cda_database_path)
+@heavy_query
+def get_cda_chart_data_endpoint(
+    request: Request,
     category: str, 
     observation_name: str,
     after: Optional[str] = None,
     before: Optional[str] = None,
     source: Optional[str] = None,
-    bucket: Optional[str] = None
+    bucket: Optional[str] = None,
+    width: Optional[int] = None,
+    downsample: Optional[str] = None,
+    format: Optional[str] = None,
+    precision: Optional[int] = None
 ):
-    """Get ECharts-compatible chart data for CDA observation"""
+    """
+    Get ECharts-compatible chart data for CDA observation. Raw data is downsampled to about what a chart width
+    pixels wide can show. format=columnar is the compact form, see chart_payload().
+    """
     if not config.has_cda_database():
         raise HTTPException(status_code=404, detail="CDA database not found")
+    width, downsample = parse_downsample_params(width, downsample)
+    check_payload_params(format, precision)
     
     # Convert URL-safe category back to original
-    category_name = category.replace('-', ' ').title()
-    if category_name.lower() == 'vital-signs':
-        category_name = 'Vital Signs'
-    elif category_name.lower() == 'laboratory':
-        category_name = 'Laboratory'
+    category_name = cda_category_name(category)
     
     # URL decode observation name
     observation_name = observation_name.replace('%20', ' ')
     
     try:
-        conn = sqlite3.connect(config.get_cda_database_path())
-        conn.row_factory = sqlite3.Row
+        total_points, unit = count_cda_chart_points(category_name, observation_name, after, before, source)
         
-        # Build query with filters
-        query = """
-            SELECT date, value, source_name, unit 
-            FROM cda_observations 
-            WHERE category = ? AND name = ?
-        """
-        params = [category_name, observation_name]
-        
-        if after:
-            query += " AND date >= ?"
-            params.append(after)
-        if before:
-            query += " AND date <= ?"
-            params.append(before)
-        if source:
-            query += " AND source_name = ?"
-            params.append(source)
-        
-        query += " ORDER BY date ASC"
-        
-        cursor = conn.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
-        
-        if not rows:
+        if not total_points:
             return {"chart_config": {
                 "title": {"text": f"No data available for {observation_name}"},
                 "xAxis": {"type": "time"},
@@ -1465,21 +1946,21 @@ async def get_cda_chart_data_endpoint(
                 "series": []
             }}
         
-        total_points = len(rows)
-        unit = rows[0]['unit'] if rows else ''
-        
         # Determine bucketing strategy
         bucket_size = determine_bucket_size(total_points, bucket)
         bucket_info = get_bucket_info(bucket_size)
         
-        # Apply bucketing if needed
+        # Bucketing and averaging happen in SQLite
+        series_data = get_cda_chart_series(category_name, observation_name, bucket_size, after, before, source)
         if bucket_size == 'raw':
-            # No bucketing - use raw data points
-            series_data = process_raw_data(rows)
-            subtitle = f"Raw data ({total_points:,} points)"
+            raw_points = sum(len(data) for data in series_data.values())
+            series_data = {name: downsample_pairs(data, width, downsample) for name, data in series_data.items()}
+            shown = sum(len(data) for data in series_data.values())
+            if shown < raw_points:
+                subtitle = f"Raw data ({shown:,} of {total_points:,} points, {downsample.upper()} downsampled)"
+            else:
+                subtitle = f"Raw data ({total_points:,} points)"
         else:
-            # Bucket the data
-            series_data = process_bucketed_data(rows, bucket_size)
             # Count unique time buckets (not sum of points across sources)
             unique_timestamps = set()
             for source_data in series_data.values():
@@ -1528,7 +2009,7 @@ async def get_cda_chart_data_endpoint(
                 "left": "50px",
                 "right": "50px", 
                 "top": "100px",
-                "bottom": "50px",
+                "bottom": "80px",
                 "containLabel": True
             },
             "xAxis": {
@@ -1537,6 +2018,11 @@ async def get_cda_chart_data_endpoint(
                 "nameLocation": "middle",
                 "nameGap": 30
             },
+            # Zooming in loads finer data, see static/js/tiles.js
+            "dataZoom": [
+                {"type": "inside"},
+                {"type": "slider", "bottom": "10px"}
+            ],
             "yAxis": {
                 "type": "value",
                 "name": f"Value ({unit})" if unit else "Value",
@@ -1546,15 +2032,22 @@ async def get_cda_chart_data_endpoint(
             "series": series
         }
         
-        return {
+        return chart_payload(request, {
             "chart_config": chart_config,
             "bucket_info": {
                 "total_raw_points": total_points,
                 "bucket_size": bucket_size,
                 "available_buckets": get_available_buckets(total_points),
                 "bucket_label": bucket_info['label']
+            },
+            # Finer data for a zoomed-in window, see static/js/tiles.js
+            "tiles": {
+                "url": f"/api/series/cda.{observation_slug(category_name)}.{observation_slug(observation_name)}/tiles",
+                "by_source": True,
+                "local_time": False,
+                "source": source
             }
-        }
+        }, "cda", format, precision)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading chart data: {str(e)}")
@@ -1562,7 +2055,7 @@ async def get_cda_chart_data_endpoint(
 
 # Apple Health endpoints
 @app.get("/apple", response_class=HTMLResponse)
-async def apple_health_overview(request: Request):
+def apple_health_overview(request: Request):
     """Apple Health overview page showing all record types"""
     if not config.has_apple_health_database():
         return templates.TemplateResponse("error.html", {
@@ -1584,7 +2077,7 @@ async def apple_health_overview(request: Request):
 
 
 @app.get("/apple/{record_type}", response_class=HTMLResponse) 
-async def apple_health_record_page(request: Request, record_type: str):
+def apple_health_record_page(request: Request, record_type: str):
     """Apple Health specific record type page with chart"""
     if not config.has_apple_health_database():
         return templates.TemplateResponse("error.html", {
@@ -1594,32 +2087,15 @@ async def apple_health_record_page(request: Request, record_type: str):
         })
     
     # Convert URL-safe record type back to original
-    from health_lib_apple import get_record_type_mapping
-    type_mapping = get_record_type_mapping()
-    
-    # Find the actual record type
-    actual_record_type = None
-    for key, info in type_mapping.items():
-        if key.lower().replace('hkquantitytypeidentifier', '').replace('hkcategorytypeidentifier', '') == record_type:
-            actual_record_type = key
-            break
-    
-    if not actual_record_type:
-        # Try direct match
-        for key in type_mapping.keys():
-            if key.lower() == record_type.lower():
-                actual_record_type = key
-                break
-    
+    from health_lib_apple import resolve_record_type, get_record_type_info, record_type_slug
+    actual_record_type = resolve_record_type(record_type)
     if not actual_record_type:
         raise HTTPException(status_code=404, detail=f"Record type not found: {record_type}")
     
-    display_info = type_mapping.get(actual_record_type, {
-        'display_name': actual_record_type.replace('HKQuantityTypeIdentifier', '').replace('HKCategoryTypeIdentifier', '')
-    })
+    display_info = get_record_type_info(actual_record_type)
     
     # Create URL-safe version for API calls
-    url_safe_record_type = actual_record_type.lower().replace('hkquantitytypeidentifier', '').replace('hkcategorytypeidentifier', '')
+    url_safe_record_type = record_type_slug(actual_record_type)
     
     context = {
         "request": request,
@@ -1633,34 +2109,32 @@ async def apple_health_record_page(request: Request, record_type: str):
 
 
 @app.get("/api/apple/{record_type}/data")
-async def get_apple_health_data(record_type: str, after: Optional[str] = None, before: Optional[str] = None, 
-                               source: Optional[str] = None, limit: Optional[int] = 1000, format: Optional[str] = None):
-    """Get Apple Health data for a specific record type"""
+@cached_response(config.get_apple_health_database_path)
+def get_apple_health_data(record_type: str, after: Optional[str] = None, before: Optional[str] = None, 
+                          source: Optional[str] = None, limit: Optional[int] = None, format: Optional[str] = None,
+                          q: Optional[str] = None, sort: Optional[str] = None, cursor: Optional[str] = None,
+                          page_size: Optional[int] = None):
+    """
+    Get Apple Health data for a specific record type, a page at a time: page_size records, 1000 unless page_size or
+    limit says otherwise, sorted by date or value (see parse_sort()), after the cursor, which is the next_cursor of
+    the page before. format=csv, json or ndjson downloads the records instead, in the same order, all of them
+    without a limit, streamed as they are read.
+    :param q: Only records from sources whose name contains this
+    """
     if not config.has_apple_health_database():
         raise HTTPException(status_code=404, detail="Apple Health database not found")
+    sort_field, descending = parse_sort(sort, ("date", "value"))
+    sort_column = "start_date" if sort_field == "date" else "value"
+    check_page_size(page_size)
+    after_key = decode_cursor(cursor, sort_name(sort_field, descending))
     
     try:
-        from health_lib_apple import get_record_type_mapping
-        import sqlite3
-        from fastapi.responses import Response
-        import csv
-        import json
-        import io
+        from health_lib_apple import resolve_record_type, get_apple_health_connection
         
         # Convert URL-safe record type back to original if needed
-        type_mapping = get_record_type_mapping()
-        
-        actual_record_type = None
-        for key, info in type_mapping.items():
-            if key.lower().replace('hkquantitytypeidentifier', '').replace('hkcategorytypeidentifier', '') == record_type:
-                actual_record_type = key
-                break
-        
-        if not actual_record_type:
-            actual_record_type = record_type
+        actual_record_type = resolve_record_type(record_type) or record_type
             
-        conn = sqlite3.connect(config.get_apple_health_database_path())
-        conn.row_factory = sqlite3.Row
+        conn = get_apple_health_connection()
         
         # Build WHERE clause for filtering
         where_conditions = ["type = ? AND value IS NOT NULL"]
@@ -1675,56 +2149,50 @@ async def get_apple_health_data(record_type: str, after: Optional[str] = None, b
         if source:
             where_conditions.append("source_name = ?")
             params.append(source)
+        if q:
+            where_conditions.append("source_name LIKE ?")
+            params.append(f"%{q}%")
             
         where_clause = " AND ".join(where_conditions)
         
-        query = f"""
-            SELECT start_date as date, value, unit, source_name, creation_date
-            FROM apple_health_records 
-            WHERE {where_clause}
-            ORDER BY start_date DESC
-            LIMIT ?
-        """
-        params.append(limit)
-        
-        cursor = conn.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
+        if format in EXPORT_MEDIA_TYPES:
+            query = f"""
+                SELECT start_date as date, value, unit, source_name, creation_date
+                FROM apple_health_records 
+                WHERE {where_clause}
+                {order_by(sort_column, descending)}
+            """
+            if limit:
+                query += " LIMIT ?"
+                params.append(limit)
+            rows = tuple_cursor(conn).execute(query, params)
+            return stream_export(rows, format, f"{record_type}_data", json_indent=2)
+
+        page_size = page_size or limit or 1000
+        query, params = keyset_page_query(
+            "id, start_date as date, value, unit, source_name, creation_date", "apple_health_records", where_clause,
+            params, sort_column, descending, after_key, page_size)
+        with span("query"):
+            rows, next_cursor = page_of(conn.execute(query, params).fetchall(), page_size,
+                                        sort_name(sort_field, descending), lambda row: [row[sort_field], row['id']])
         
         # Convert to list of dicts
-        data_points = []
-        for row in rows:
-            data_points.append({
-                "date": row['date'],
-                "value": row['value'],
-                "unit": row['unit'],
-                "source_name": row['source_name'],
-                "creation_date": row['creation_date']
-            })
-        
-        # Handle export formats
-        if format == 'csv':
-            output = io.StringIO()
-            writer = csv.DictWriter(output, fieldnames=['date', 'value', 'unit', 'source_name', 'creation_date'])
-            writer.writeheader()
-            writer.writerows(data_points)
-            
-            return Response(
-                content=output.getvalue(),
-                media_type='text/csv',
-                headers={'Content-Disposition': f'attachment; filename="{record_type}_data.csv"'}
-            )
-        elif format == 'json':
-            return Response(
-                content=json.dumps(data_points, indent=2),
-                media_type='application/json',
-                headers={'Content-Disposition': f'attachment; filename="{record_type}_data.json"'}
-            )
+        with span("rows"):
+            data_points = []
+            for row in rows:
+                data_points.append({
+                    "date": row['date'],
+                    "value": row['value'],
+                    "unit": row['unit'],
+                    "source_name": row['source_name'],
+                    "creation_date": row['creation_date']
+                })
         
         return {
             "record_type": actual_record_type,
             "count": len(data_points),
-            "data": data_points
+            "data": data_points,
+            "next_cursor": next_cursor
         }
         
     except Exception as e:
@@ -1732,35 +2200,20 @@ async def get_apple_health_data(record_type: str, after: Optional[str] = None, b
 
 
 @app.get("/api/apple/{record_type}/sources")
-async def get_apple_health_sources(record_type: str):
+@conditional_response(config.get_apple_health_database_path)
+def get_apple_health_sources(record_type: str):
     """Get available data sources for a specific Apple Health record type"""
     if not config.has_apple_health_database():
         raise HTTPException(status_code=404, detail="Apple Health database not found")
     
     try:
-        from health_lib_apple import get_record_type_mapping
-        import sqlite3
+        from health_lib_apple import resolve_record_type, get_apple_catalog_entry
         
         # Convert URL-safe record type back to original if needed  
-        type_mapping = get_record_type_mapping()
+        actual_record_type = resolve_record_type(record_type) or record_type
         
-        actual_record_type = None
-        for key, info in type_mapping.items():
-            if key.lower().replace('hkquantitytypeidentifier', '').replace('hkcategorytypeidentifier', '') == record_type:
-                actual_record_type = key
-                break
-        
-        if not actual_record_type:
-            actual_record_type = record_type
-        
-        conn = sqlite3.connect(config.get_apple_health_database_path())
-        cursor = conn.execute(
-            "SELECT DISTINCT source_name FROM apple_health_records WHERE type = ? ORDER BY source_name",
-            [actual_record_type]
-        )
-        
-        sources = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        entry = get_apple_catalog_entry(actual_record_type)
+        sources = entry.source_names() if entry else []
         
         return {"sources": sources}
         
@@ -1769,35 +2222,31 @@ async def get_apple_health_sources(record_type: str):
 
 
 @app.get("/api/apple/{record_type}/chart") 
-async def get_apple_health_chart(record_type: str, after: Optional[str] = None, before: Optional[str] = None, 
-                                source: Optional[str] = None, bucket: Optional[str] = None):
-    """Get ECharts configuration for Apple Health data with CDA-style bucketing and filtering"""
+@cached_response(config.get_apple_health_database_path)
+@heavy_query
+def get_apple_health_chart(request: Request, record_type: str, after: Optional[str] = None,
+                           before: Optional[str] = None, source: Optional[str] = None, bucket: Optional[str] = None,
+                           width: Optional[int] = None, downsample: Optional[str] = None,
+                           format: Optional[str] = None, precision: Optional[int] = None):
+    """
+    Get ECharts configuration for Apple Health data with CDA-style bucketing and filtering. Raw data is
+    downsampled to about what a chart width pixels wide can show, instead of being cut off. format=columnar is the
+    compact form, see chart_payload().
+    """
     if not config.has_apple_health_database():
         raise HTTPException(status_code=404, detail="Apple Health database not found")
+    width, downsample = parse_downsample_params(width, downsample)
+    check_payload_params(format, precision)
     
     try:
-        from health_lib_apple import get_record_type_mapping
-        import sqlite3
+        from health_lib_apple import resolve_record_type, get_record_type_info, get_apple_health_connection, \
+            count_apple_records, get_apple_rollups, get_apple_health_series, record_type_slug
         from datetime import datetime
+        import time
         
         # Convert URL-safe record type back to original if needed  
-        type_mapping = get_record_type_mapping()
-        
-        actual_record_type = None
-        for key, info in type_mapping.items():
-            if key.lower().replace('hkquantitytypeidentifier', '').replace('hkcategorytypeidentifier', '') == record_type:
-                actual_record_type = key
-                break
-        
-        if not actual_record_type:
-            actual_record_type = record_type
-        
-        display_info = type_mapping.get(actual_record_type, {
-            'display_name': actual_record_type.replace('HKQuantityTypeIdentifier', '').replace('HKCategoryTypeIdentifier', '')
-        })
-        
-        conn = sqlite3.connect(config.get_apple_health_database_path())
-        conn.row_factory = sqlite3.Row
+        actual_record_type = resolve_record_type(record_type) or record_type
+        display_info = get_record_type_info(actual_record_type)
         
         # Build WHERE clause for filtering
         where_conditions = ["type = ? AND value IS NOT NULL"]
@@ -1815,14 +2264,12 @@ async def get_apple_health_chart(record_type: str, after: Optional[str] = None,
             
         where_clause = " AND ".join(where_conditions)
         
-        # Get total count for bucket determination
-        count_query = f"SELECT COUNT(*) as count FROM apple_health_records WHERE {where_clause}"
-        cursor = conn.execute(count_query, params)
-        total_count = cursor.fetchone()['count']
+        # Get total count for bucket determination, from the rollups
+        total_count = count_apple_records(actual_record_type, after=after, before=before, source=source)
         
         # Determine bucket based on data volume - same logic as CDA
         available_buckets = [
-            {"value": "raw", "label": "Individual Points", "enabled": total_count <= 5000},
+            {"value": "raw", "label": "Individual Points", "enabled": True},  # downsampled to the chart's width
             {"value": "minute", "label": "Per Minute", "enabled": total_count <= 20000}, 
             {"value": "hour", "label": "Hourly", "enabled": total_count <= 50000},
             {"value": "day", "label": "Daily", "enabled": True},
@@ -1833,7 +2280,7 @@ async def get_apple_health_chart(record_type: str, after: Optional[str] = None,
         # Use provided bucket or auto-select
         if not bucket:
             for b in available_buckets:
-                if b["enabled"]:
+                if b["enabled"] and (b["value"] != "raw" or total_count <= 5000):
                     bucket = b["value"]
                     break
         
@@ -1859,15 +2306,10 @@ async def get_apple_health_chart(record_type: str, after: Optional[str] = None,
         bucket_format = bucket_formats.get(bucket, '%Y-%m-%d')
         bucket_label = bucket_labels.get(bucket, "Daily")
         
+        raw_series = None
         if bucket == "raw":
-            # Raw data query
-            query = f"""
-                SELECT start_date as time_bucket, value as avg_value, unit
-                FROM apple_health_records 
-                WHERE {where_clause}
-                ORDER BY start_date
-                LIMIT 5000
-            """
+            # Every point in the range, as arrays, downsampled below
+            raw_series = get_apple_health_series(actual_record_type, after=after, before=before, source=source)
         else:
             # Determine aggregation method based on measurement type
             # Step count, distance, energy should be summed
@@ -1912,9 +2354,18 @@ async def get_apple_health_chart(record_type: str, after: Optional[str] = None,
                     ORDER BY time_bucket
                 """
         
-        cursor = conn.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
+        # Buckets come from the rollups, precomputed at import, unless the database has none
+        rows = None
+        if raw_series is not None:
+            # Back to the dates as stored, which are local times, so the chart shows them the same way
+            rows = [{"time_bucket": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(raw_series.ts[i])),
+                     "avg_value": raw_series.values[i], "unit": raw_series.unit}
+                    for i in downsample_indices(raw_series.ts, raw_series.values, width, downsample)]
+        elif bucket in bucket_formats:
+            rows = get_apple_rollups(actual_record_type, bucket, after=after, before=before, source=source,
+                                     cumulative=is_cumulative)
+        if rows is None:
+            rows = get_apple_health_connection().execute(query, params).fetchall()
         
         if not rows:
             return {
@@ -1976,27 +2427,7 @@ async def get_apple_health_chart(record_type: str, after: Optional[str] = None,
                 "lineStyle": {"width": 2},
                 "itemStyle": {"borderWidth": 2}
             }],
-            "dataZoom": [
-                {
-                    "type": "inside",
-                    "start": 0,
-                    "end": 100,
-                    "filterMode": "filter"
-                },
-                {
-                    "start": 0,
-                    "end": 100,
-                    "handleIcon": "M10.7,11.9H9.3c-4.9,0.3-8.8,4.4-8.8,9.4c0,5,3.9,9.1,8.8,9.4h1.3c4.9-0.3,8.8-4.4,8.8-9.4C19.5,16.3,15.6,12.2,10.7,11.9z M13.3,24.4H6.7V23h6.6V24.4z M13.3,19.6H6.7v-1.4h6.6V19.6z",
-                    "handleSize": "80%",
-                    "handleStyle": {
-                        "color": "#fff",
-                        "shadowBlur": 3,
-                        "shadowColor": "rgba(0, 0, 0, 0.6)",
-                        "shadowOffsetX": 2,
-                        "shadowOffsetY": 2
-                    }
-                }
-            ],
+            "dataZoom": APPLE_DATA_ZOOM,
             "grid": {
                 "left": "3%",
                 "right": "4%",
@@ -2005,7 +2436,7 @@ async def get_apple_health_chart(record_type: str, after: Optional[str] = None,
             }
         }
         
-        return {
+        result = {
             "chart_config": chart_config,
             "bucket_info": {
                 "available_buckets": available_buckets,
@@ -2014,11 +2445,159 @@ async def get_apple_health_chart(record_type: str, after: Optional[str] = None,
                 "total_raw_points": total_count
             }
         }
+        if bucket in ["raw", "minute", "hour", "day"] and not is_cumulative:
+            # Finer data for a zoomed-in window, see static/js/tiles.js. Sums of different bucket sizes don't
+            # belong on one line, so only averages get tiles. Apple dates are local times.
+            result["tiles"] = {
+                "url": f"/api/series/apple.{record_type_slug(actual_record_type)}/tiles",
+                "by_source": False,
+                "local_time": True,
+                "source": source
+            }
+        return chart_payload(request, result, "apple", format, precision)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating chart: {str(e)}")
 
 
+@app.get("/api/series/{series_id}/tiles/{level}/{index}")
+@cached_response(config.get_apple_health_database_path, config.get_cda_database_path)
+def get_series_tile(series_id: str, level: int, index: int, source: Optional[str] = None, by_source: bool = False):
+    """
+    One tile of a chart series: 256 buckets of 2**level seconds, the index-th such stretch since 1970 (see
+    health_lib.tile_bounds). Charts fetch the tiles of the window they are zoomed in on.
+    :param series_id: apple.<record type slug>, like apple.heartrate, or cda.<category slug>.<observation slug>,
+        like cda.vital-signs.heart-rate
+    :param by_source: a series per source, instead of one for all of them
+    """
+    from health_lib import tile_bounds
+    from health_lib_apple import get_apple_catalog_index, get_apple_tile
+
+    kind, _, slug = series_id.partition('.')
+    try:
+        start, end, bucket_seconds = tile_bounds(level, index)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        if kind == 'apple' and config.has_apple_health_database():
+            entry = get_apple_catalog_index().entry_by_slug('record', slug)
+            series = get_apple_tile(entry.name, level, index, source, by_source) if entry else None
+        elif kind == 'cda' and config.has_cda_database():
+            category_slug, _, observation = slug.partition('.')
+            entry = get_cda_catalog_index().entry_by_slug('observation', observation, category_slug)
+            series = get_cda_tile(entry.category, entry.name, level, index, source, by_source) if entry else None
+        else:
+            series = None
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error loading tile: {str(e)}")
+    if series is None:
+        raise HTTPException(status_code=404, detail=f"Series not found: {series_id}")
+
+    return {
+        "series_id": series_id,
+        "level": level,
+        "index": index,
+        "start": start * 1000,
+        "end": end * 1000,
+        "bucket_ms": bucket_seconds * 1000,
+        "fields": ["ts", "mean", "min", "max", "count"],
+        "series": series
+    }
+
+
+def parse_downsample_params(width: Optional[int], method: Optional[str]) -> tuple[int, str]:
+    """The pixel width and method to downsample a raw chart series with, from query parameters or the config"""
+    width = width or config.get_chart_width()
+    method = method or config.get_downsample_method()
+    if width < 1 or width > 10000:
+        raise HTTPException(status_code=400, detail=f"Invalid width: {width}")
+    if method not in DOWNSAMPLE_METHODS:
+        raise HTTPException(status_code=400, detail=f"Invalid downsample method: {method}")
+    return width, method
+
+
+def parse_time_param(value: Optional[str]) -> Optional[int]:
+    """An ISO date or date time from a query parameter, as seconds since the epoch. Naive times are UTC."""
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+@app.get("/metrics", response_class=HTMLResponse)
+def metrics_overview(request: Request):
+    """Every metric in the unified store, from all sources"""
+    metrics = list_metrics(config.get_unified_database_path())
+    context = {
+        "request": request,
+        "metrics": metrics,
+        "title": "All Sources",
+        "breadcrumb": [{"name": "Home", "url": "/"}, {"name": "All Sources", "url": "/metrics"}]
+    }
+    context.update(get_navigation_context())
+    return templates.TemplateResponse("metrics_overview.html", context)
+
+
+@app.get("/metrics/{metric_id}", response_class=HTMLResponse)
+def metric_detail_page(request: Request, metric_id: str):
+    """One metric, charted with a series for each source"""
+    context = {
+        "request": request,
+        "metric_id": metric_id,
+        "display_name": metric_id.replace("_", " ").title(),
+        "title": metric_id.replace("_", " ").title(),
+        "breadcrumb": [{"name": "Home", "url": "/"}, {"name": "All Sources", "url": "/metrics"},
+                       {"name": metric_id.replace("_", " ").title(), "url": f"/metrics/{metric_id}"}]
+    }
+    context.update(get_navigation_context())
+    return templates.TemplateResponse("metric_detail.html", context)
+
+
+@app.get("/api/metrics")
+@conditional_response(config.get_unified_database_path)
+def get_metrics():
+    """Every metric in the unified store, with counts per source"""
+    try:
+        return {"metrics": list_metrics(config.get_unified_database_path())}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing metrics: {str(e)}")
+
+
+@app.get("/api/metrics/{metric_id}/data")
+@cached_response(config.get_unified_database_path)
+@heavy_query
+def get_metric_data(metric_id: str, after: Optional[str] = None, before: Optional[str] = None,
+                    source: Optional[List[str]] = Query(None)):
+    """
+    One metric from every source, as one series per source of [timestamp in ms, value] pairs, ready for ECharts.
+    :param source: Repeat to select several sources. All of them by default.
+    """
+    start, end = parse_time_param(after), parse_time_param(before)
+    db_path = config.get_unified_database_path()
+    try:
+        series = query_metric_series(db_path, metric_id, start=start, end=end, sources=source)
+        origins = metric_origins(db_path, metric_id) if series else {}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting metric data: {str(e)}")
+    if not series:
+        raise HTTPException(status_code=404, detail=f"No data for metric: {metric_id}")
+
+    return {
+        "metric_id": metric_id,
+        "count": sum(len(s) for s in series.values()),
+        "units": sorted({s.unit or "" for s in series.values()}),
+        "series": [
+            {"name": s.name, "unit": s.unit, "data": s.pairs_ms(), "origins": origins.get(s.name.split(" ")[0], {})}
+            for s in series.values()
+        ]
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
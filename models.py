@@ -41,6 +41,7 @@ class DataPoint(BaseModel):
     unit: Optional[str] = Field(None, description="Unit of measurement")
     name: str = Field(..., description="Name of the measurement")
     reference_range: Optional[ReferenceRange] = Field(None, description="Reference range if available")
+    out_of_range: Optional[bool] = Field(None, description="Whether the value is outside the reference range, if it has a numeric one")
     is_text: bool = Field(default=False, description="Whether this is a text-based result")
 
 
@@ -1,8 +1,16 @@
+import hashlib
+import random
 import re
+import sqlite3
+from functools import lru_cache
+from pathlib import Path
 from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 STANDARD_LOINC = "http://loinc.org"
 
+_DIVIDERS_RE = re.compile(r"[\[\]\(\)\.,:/\-_]+")
+_WHITESPACE_RE = re.compile(r"\s+")
+
 
 # --- Exceptions --------------------------------------------------------------
 
@@ -15,14 +23,16 @@ class NameMismatchError(Exception):
 def _norm_system(s: Optional[str]) -> Optional[str]:
     return s.lower() if s else None
 
-def _normalize_text(t: Optional[str]) -> str:
+@lru_cache(maxsize=65536)
+def normalize_text(t: Optional[str]) -> str:
+    # Memoized: there are far fewer distinct test names than observations.
     if not t:
         return ""
     t = t.strip()
     # collapse whitespace, lowercase, strip punctuation-ish dividers
     t = t.lower()
-    t = re.sub(r"[\[\]\(\)\.,:/\-_]+", " ", t)
-    t = re.sub(r"\s+", " ", t).strip()
+    t = _DIVIDERS_RE.sub(" ", t)
+    t = _WHITESPACE_RE.sub(" ", t).strip()
     return t
 
 def _extract_codings(codeable: Dict) -> List[Dict]:
@@ -70,7 +80,7 @@ class ObservationCodeMapper:
         loinc = sorted(loincs)[0]
 
         # Learn name/synonym
-        disp = _normalize_text(_display_text_from_codeable(codeable))
+        disp = normalize_text(_display_text_from_codeable(codeable))
         if disp:
             self.loinc_names.setdefault(loinc, set()).add(disp)
 
@@ -108,9 +118,65 @@ class ObservationCodeMapper:
     def names_for_observation(self, obs: Dict) -> Set[str]:
         """Return normalized names found in the observation (code.text or first coding.display)."""
         codeable = (obs or {}).get("code") or {}
-        disp = _normalize_text(_display_text_from_codeable(codeable))
+        disp = normalize_text(_display_text_from_codeable(codeable))
         return {disp} if disp else set()
 
+    def save(self, db_path: Path) -> None:
+        """Persist the learned tables to SQLite, replacing whatever was saved there before."""
+        conn = sqlite3.connect(db_path)
+        try:
+            _create_mapper_tables(conn)
+            conn.execute("DELETE FROM obs_local_to_loinc")
+            conn.execute("DELETE FROM obs_loinc_names")
+            conn.executemany("INSERT INTO obs_local_to_loinc (system, code, loinc) VALUES (?, ?, ?)",
+                             [(sys, code, loinc) for (sys, code), loinc in self.local_to_loinc.items()])
+            conn.executemany("INSERT INTO obs_loinc_names (loinc, name) VALUES (?, ?)",
+                             [(loinc, name) for loinc, names in self.loinc_names.items() for name in names])
+            conn.commit()
+        finally:
+            conn.close()
+
+    @classmethod
+    def load(cls, db_path: Path) -> "ObservationCodeMapper":
+        """Load tables saved with save(). A missing database gives an empty mapper."""
+        mapper = cls()
+        if not Path(db_path).exists():
+            return mapper
+        conn = sqlite3.connect(db_path)
+        try:
+            _create_mapper_tables(conn)
+            for sys, code, loinc in conn.execute("SELECT system, code, loinc FROM obs_local_to_loinc"):
+                mapper.local_to_loinc[(sys, code)] = loinc
+            for loinc, name in conn.execute("SELECT loinc, name FROM obs_loinc_names"):
+                mapper.loinc_names.setdefault(loinc, set()).add(name)
+        finally:
+            conn.close()
+        return mapper
+
+
+def _create_mapper_tables(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS obs_local_to_loinc (
+            system TEXT NOT NULL,
+            code TEXT NOT NULL,
+            loinc TEXT NOT NULL,
+            PRIMARY KEY (system, code)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS obs_loinc_names (
+            loinc TEXT NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (loinc, name)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS obs_concepts (
+            key TEXT PRIMARY KEY,
+            concept_id TEXT NOT NULL
+        )
+    """)
+
 
 # --- Main matcher ------------------------------------------------------------
 
@@ -162,9 +228,282 @@ def observations_equivalent(
         lt = next(iter(mapper.names_for_observation(left)), "")
         rt = next(iter(mapper.names_for_observation(right)), "")
         if lt and rt:
-            # Token Jaccard
-            A, B = set(lt.split()), set(rt.split())
-            sim = (len(A & B) / len(A | B)) if A and B else 0.0
-            return sim >= text_similarity_threshold
+            return token_jaccard(lt, rt) >= text_similarity_threshold
+
+    return False
+
+
+def token_jaccard(left: str, right: str) -> float:
+    """Jaccard similarity of the whitespace separated tokens of two normalized names."""
+    A, B = set(left.split()), set(right.split())
+    return (len(A & B) / len(A | B)) if A and B else 0.0
+
+
+# --- Bulk name matching ------------------------------------------------------
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+@lru_cache(maxsize=8)
+def _minhash_coefficients(num_perm: int) -> Tuple[Tuple[int, int], ...]:
+    # Fixed seed, so signatures are the same from run to run.
+    rng = random.Random(1_000_003)
+    return tuple((rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm))
+
+
+@lru_cache(maxsize=65536)
+def _token_hash(token: str) -> int:
+    # hash() is salted per process, blake2b is not.
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def minhash_signature(name: str, num_perm: int = 64) -> Tuple[int, ...]:
+    """
+    MinHash signature of the tokens of a normalized name. The fraction of positions where two signatures
+    agree estimates the token_jaccard of the names.
+    """
+    hashes = [_token_hash(t) for t in set(name.split())]
+    if not hashes:
+        return ()
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _minhash_coefficients(num_perm))
+
+
+def similar_name_pairs(
+    names: Iterable[str],
+    threshold: float = 0.85,
+    num_perm: int = 64,
+    bands: int = 16,
+) -> Set[Tuple[str, str]]:
+    """
+    Find pairs of names whose token_jaccard is at least threshold, without comparing every pair.
+
+    Signatures are cut into bands; names that agree on all rows of any band become candidates, and only
+    candidates are verified with token_jaccard. With 16 bands of 4 rows, a pair with a similarity of 0.7
+    becomes a candidate 99% of the time, and 0.85 practically always.
+    :param names: normalized names
+    :return: (a, b) pairs with a < b
+    """
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+    rows = num_perm // bands
+    buckets: Dict[Tuple[int, Tuple[int, ...]], List[str]] = {}
+    for name in sorted(set(names)):
+        sig = minhash_signature(name, num_perm)
+        if not sig:
+            continue
+        for band in range(bands):
+            buckets.setdefault((band, sig[band * rows:(band + 1) * rows]), []).append(name)
+
+    checked: Set[Tuple[str, str]] = set()
+    pairs: Set[Tuple[str, str]] = set()
+    for bucket in buckets.values():
+        for i, left in enumerate(bucket):
+            for right in bucket[i + 1:]:
+                if (left, right) in checked:
+                    continue
+                checked.add((left, right))
+                if token_jaccard(left, right) >= threshold:
+                    pairs.add((left, right))
+    return pairs
+
+
+def cluster_similar_names(names: Iterable[str], threshold: float = 0.85, **kwargs) -> List[Set[str]]:
+    """
+    Group names connected by similar_name_pairs. Only clusters of two or more names are returned,
+    largest first.
+    """
+    parent: Dict[str, str] = {}
+
+    def find(n: str) -> str:
+        while parent.setdefault(n, n) != n:
+            parent[n] = parent[parent[n]]
+            n = parent[n]
+        return n
+
+    for left, right in similar_name_pairs(names, threshold, **kwargs):
+        a, b = find(left), find(right)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+
+    clusters: Dict[str, Set[str]] = {}
+    for n in parent:
+        clusters.setdefault(find(n), set()).add(n)
+    return sorted(clusters.values(), key=lambda c: (-len(c), min(c)))
+
+
+# --- Concept index -----------------------------------------------------------
+
+class ConceptIndex:
+    """
+    Assigns every Observation a concept id in one pass, instead of comparing them pairwise with
+    observations_equivalent.
+
+    Every observation is fed through ObservationCodeMapper.learn_from_observation first, so an observation that
+    only has a local code still finds its LOINC, even if the observation that taught the mapping came later.
+    Concept ids are derived from content, not order, so they are stable between runs:
+        "loinc:<code>"   A LOINC is present, or mapped from a local code, or the name is a known LOINC synonym.
+                         If there are several, the lowest one, same as learn_from_observation.
+        "name:<name>"    No LOINC, but a normalized name. After merge_similar_names, the smallest name of its cluster,
+                         or the LOINC of any name in the cluster that is a known LOINC synonym.
+        "code:<system>|<code>"  Neither, so the first coding.
+    """
+
+    def __init__(self, mapper: Optional[ObservationCodeMapper] = None) -> None:
+        self.mapper = mapper or ObservationCodeMapper()
+        # key -> (direct LOINCs, local codings, normalized name), enough to reassign without the observation
+        self._facts: Dict[str, Tuple[Tuple[str, ...], Tuple[Tuple[str, str], ...], str]] = {}
+        self._concepts: Dict[str, str] = {}
+        # concept id -> keys, the inverse of _concepts
+        self._groups: Dict[str, List[str]] = {}
+        # name -> the cluster of similar names it belongs to, from merge_similar_names
+        self._clusters: Dict[str, Tuple[str, ...]] = {}
+        self._dirty = False
+
+    def add(self, key: str, obs: Dict) -> None:
+        """Learn from one observation and remember it under key, like a file name."""
+        self.mapper.learn_from_observation(obs)
+        codings = _extract_codings((obs or {}).get("code") or {})
+        loincs = tuple(sorted(c["code"] for c in codings
+                              if _norm_system(c.get("system")) == STANDARD_LOINC and c.get("code")))
+        local = tuple((_norm_system(c.get("system")), c["code"]) for c in codings
+                      if c.get("system") and c.get("code") and _norm_system(c.get("system")) != STANDARD_LOINC)
+        name = next(iter(self.mapper.names_for_observation(obs)), "")
+        self._facts[key] = (loincs, local, name)
+        self._dirty = True
+
+    def __len__(self) -> int:
+        """The number of observations added"""
+        return len(self._facts)
+
+    def build(self, observations: Iterable[Tuple[str, Dict]]) -> "ConceptIndex":
+        """Add (key, observation) pairs, then assign concepts to all of them."""
+        for key, obs in observations:
+            self.add(key, obs)
+        self._assign()
+        return self
+
+    def _assign(self) -> None:
+        name_to_loinc: Dict[str, str] = {}
+        for loinc in sorted(self.mapper.loinc_names):
+            for name in self.mapper.loinc_names[loinc]:
+                name_to_loinc.setdefault(name, loinc)
+        concepts = {}
+        groups: Dict[str, List[str]] = {}
+        for key, (loincs, local, name) in self._facts.items():
+            found = set(loincs)
+            found.update(self.mapper.local_to_loinc[c] for c in local if c in self.mapper.local_to_loinc)
+            members = self._clusters.get(name, (name,))
+            anchored = sorted(name_to_loinc[m] for m in members if m in name_to_loinc)
+            if found:
+                concepts[key] = "loinc:" + sorted(found)[0]
+            elif anchored:
+                concepts[key] = "loinc:" + anchored[0]
+            elif name:
+                concepts[key] = "name:" + members[0]
+            elif local:
+                concepts[key] = "code:%s|%s" % local[0]
+            else:
+                concepts[key] = "unknown:" + key
+            groups.setdefault(concepts[key], []).append(key)
+        self._concepts = concepts
+        self._groups = groups
+        self._dirty = False
+
+    def merge_similar_names(self, threshold: float = 0.85, **kwargs) -> List[Set[str]]:
+        """
+        Cluster the names of all observations with cluster_similar_names, so observations without a LOINC
+        join the concept of a near-identical name. Replaces any earlier clustering.
+        :return: the clusters
+        """
+        clusters = cluster_similar_names((facts[2] for facts in self._facts.values() if facts[2]),
+                                         threshold, **kwargs)
+        self._clusters = {}
+        for cluster in clusters:
+            members = tuple(sorted(cluster))
+            for name in members:
+                self._clusters[name] = members
+        self._dirty = True
+        return clusters
+
+    def concept_id(self, key: str) -> str:
+        """The concept of the observation added under key. O(1) once assigned."""
+        if self._dirty:
+            self._assign()
+        return self._concepts[key]
+
+    def groups(self) -> Dict[str, List[str]]:
+        """concept id -> keys of every observation of that concept. Shared, so don't modify it."""
+        if self._dirty:
+            self._assign()
+        return self._groups
+
+    def names(self, concept: str) -> Set[str]:
+        """The normalized names seen for a concept, across all providers."""
+        return {self._facts[key][2] for key in self.groups().get(concept, []) if self._facts[key][2]}
+
+    def save(self, db_path: Path) -> None:
+        """Persist the mapper tables and the concept assignments to SQLite."""
+        if self._dirty:
+            self._assign()
+        self.mapper.save(db_path)
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute("DELETE FROM obs_concepts")
+            conn.executemany("INSERT INTO obs_concepts (key, concept_id) VALUES (?, ?)", self._concepts.items())
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def load_concepts(db_path: Path) -> Dict[str, str]:
+    """The key -> concept id assignments saved by ConceptIndex.save"""
+    conn = sqlite3.connect(db_path)
+    try:
+        _create_mapper_tables(conn)
+        return dict(conn.execute("SELECT key, concept_id FROM obs_concepts"))
+    finally:
+        conn.close()
+
+
+def yield_observations(dir_path: Path) -> Iterable[Tuple[str, Dict]]:
+    """
+    The (key, observation) pairs for ConceptIndex.build, from a clinical-records directory. Observations come one
+    per .json file, keyed by file name, or one per line of an .ndjson file, keyed by "<file name>#<byte offset>".
+    """
+    from health_lib import yield_resources
+
+    for p in sorted([*dir_path.glob("Observation*.json"), *dir_path.glob("Observation*.ndjson")]):
+        for offset, resource in yield_resources(p):
+            yield (p.name if p.suffix == ".json" else f"{p.name}#{offset}"), resource
+
+
+def main():
+    import argparse
+    import config
+
+    parser = argparse.ArgumentParser(description="Group FHIR Observations by LOINC concept.")
+    parser.add_argument("--dir", help="clinical-records directory (default: from config.py)")
+    parser.add_argument("--db", default="obs_concepts.db", help="SQLite file for the mapper tables and concepts")
+    parser.add_argument("--text-threshold", type=float,
+                        help="also merge observations whose names have at least this token similarity, like 0.85")
+    args = parser.parse_args()
+
+    dir_path = Path(args.dir) if args.dir else config.get_source_dir() / "clinical-records"
+
+    index = ConceptIndex(ObservationCodeMapper.load(args.db)).build(yield_observations(dir_path))
+    if not len(index):
+        print(f"No Observations found in {dir_path}")
+    if args.text_threshold is not None:
+        clusters = index.merge_similar_names(args.text_threshold)
+        print(f"{len(clusters):,} clusters of similar names")
+    index.save(args.db)
+    groups = index.groups()
+    print(f"{len(index):,} observations, {len(groups):,} concepts. Saved to {args.db}")
+    for concept, keys in sorted(groups.items(), key=lambda x: len(x[1]), reverse=True):
+        names = index.names(concept)
+        if len(names) > 1:
+            print(f"  {concept}: {len(keys)} observations, names: {sorted(names)}")
+
 
-    return False
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,8 @@ from typing import Dict, Optional
 import re
 
 import config
+from health_lib_unified import refresh_unified_store
+from health_lib_apple import build_apple_catalog, refresh_apple_rollups
 
 
 def create_database_schema(conn: sqlite3.Connection):
@@ -111,6 +113,8 @@ def create_database_schema(conn: sqlite3.Connection):
     conn.execute("CREATE INDEX IF NOT EXISTS idx_records_source ON apple_health_records(source_name)")
     # Covering index for categories query - optimizes GROUP BY type with COUNT(*)
     conn.execute("CREATE INDEX IF NOT EXISTS idx_records_type_covering ON apple_health_records(type, id)")
+    # A type's records in date order, for the data table's pages; id is the rowid, so it is in the index too
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_records_type_date ON apple_health_records(type, start_date)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_activity_date ON activity_summaries(date_components)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_workouts_date ON workouts(start_date)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_metadata_record ON metadata_entries(record_type, record_id)")
@@ -342,6 +346,11 @@ def process_xml_file(xml_path: Path, db_path: Path):
         
         conn.commit()
         
+        catalog = build_apple_catalog(conn)
+        print(f"Catalog written: {sum(e.kind == 'record' for e in catalog):,} record types")
+        rolled_up = refresh_apple_rollups(conn)
+        print(f"Rollups updated with {rolled_up:,} new records")
+        
     except ET.ParseError as e:
         print(f"XML parsing error: {e}")
         return False
@@ -393,6 +402,10 @@ def main():
     if not success:
         sys.exit(1)
 
+    unified_path = config.get_unified_database_path()
+    loaded = refresh_unified_store(unified_path, apple_db=Path(apple_data_db_path), force=True)
+    print(f"Unified store updated: {loaded.get('apple', 0):,} Apple Health values in {unified_path}")
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -18,7 +18,9 @@ from xml_reader import trim, find
 import xml.etree.ElementTree as ET
 import unicodedata
 from health_lib import Observation, ValueQuantity
-from datetime import datetime
+from health_lib_unified import refresh_unified_store
+from health_lib_cda import build_cda_catalog
+from datetime import datetime, timezone
 
 
 def create_database(db_path: Path) -> sqlite3.Connection:
@@ -44,6 +46,7 @@ def create_database(db_path: Path) -> sqlite3.Connection:
     
     # Create indexes for efficient querying
     conn.execute("CREATE INDEX IF NOT EXISTS idx_category_name ON cda_observations (category, name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_category_name_date ON cda_observations (category, name, date)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_date ON cda_observations (date)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_source ON cda_observations (source_name)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_name ON cda_observations (name)")
@@ -95,7 +98,7 @@ def get_all_observations(file_name: str) -> Generator[Observation, None, None]:
                 if timestamp:
                     try:
                         dt_obj = datetime.strptime(timestamp, '%Y%m%d%H%M%S%z')
-                        dt_string = datetime.strftime(dt_obj, '%Y-%m-%dT%H:%M:%SZ')
+                        dt_string = dt_obj.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
                     except ValueError:
                         dt_string = None
 
@@ -198,6 +201,9 @@ def process_cda_file(cda_file: Path, db_path: Path, batch_size: int = 1000) -> N
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             """, batch)
             conn.commit()
+        
+        catalog = build_cda_catalog(conn)
+        print(f"Catalog written: {len(catalog):,} observation types")
             
     except Exception as e:
         print(f"Error processing file: {e}")
@@ -339,6 +345,10 @@ def main():
 
     process_cda_file_with_cleanup(cda_file, db_path, args.batch_size)
 
+    unified_path = config.get_unified_database_path()
+    loaded = refresh_unified_store(unified_path, cda_db=db_path, force=True)
+    print(f"Unified store updated: {loaded.get('cda', 0):,} CDA values in {unified_path}")
+
 
 if __name__ == "__main__":
     main()
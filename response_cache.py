@@ -0,0 +1,156 @@
+"""
+A cache of finished API responses, for requests that are asked again, like a page reload or a second tab.
+
+Responses are kept as the bytes that were sent, under a key the caller makes from the endpoint, its parameters and
+the generation of the data behind it, like the file_signature() of the database. When the data changes, so does
+the key, and the old entries are never hit again; they go when they are the least recently used. The cache holds at
+most max_bytes of bodies.
+
+Identical requests that arrive while the first one is still being computed wait for it, instead of running the
+same query again (single-flight), so ten tabs opening the same chart run its query once.
+"""
+
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, NamedTuple, Optional
+
+# Bytes counted for an entry besides its body: the key, the headers and the bookkeeping
+ENTRY_OVERHEAD = 512
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    media_type: Optional[str]
+    headers: tuple[tuple[str, str], ...] = ()
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + ENTRY_OVERHEAD
+
+
+class ResponseCache:
+    """
+    LRU cache of CachedResponse, by total size, with single-flight for keys being computed. Lookups and stores
+    are thread-safe; get_or_compute() must be called from one event loop.
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: Optional[int] = None):
+        """
+        :param max_bytes: Total size of the entries kept. 0 keeps nothing, but concurrent requests are still
+            coalesced.
+        :param max_entry_bytes: Bigger responses aren't kept, so one huge chart can't push out everything else.
+            A quarter of max_bytes by default.
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 4 if max_entry_bytes is None else max_entry_bytes
+        self._entries: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+        self._bytes = 0
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._counts: dict[str, dict[str, int]] = {}
+        self._evictions = 0
+        self._too_large = 0
+
+    def _count(self, label: str, what: str) -> None:
+        counts = self._counts.setdefault(label, {"hits": 0, "misses": 0, "coalesced": 0})
+        counts[what] += 1
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        """The entry for key, which becomes the most recently used, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, entry: CachedResponse) -> bool:
+        """Keep entry for key, evicting the least recently used entries to make room. False if it is too big."""
+        if entry.size > min(self.max_entry_bytes, self.max_bytes):
+            with self._lock:
+                self._too_large += 1
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self._evictions += 1
+        return True
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Optional[CachedResponse]]],
+                             label: str = "") -> Optional[CachedResponse]:
+        """
+        The entry for key, from the cache, from a computation of it already running, or from compute().
+        :param compute: Makes the entry, or returns None for a response that can't be cached, like a stream. Then
+            the requests that were waiting for it call compute() themselves.
+        :param label: What hits and misses are counted under in stats(), like the endpoint's name
+        """
+        while True:
+            entry = self.get(key)
+            if entry is not None:
+                with self._lock:
+                    self._count(label, "hits")
+                return entry
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            with self._lock:
+                self._count(label, "coalesced")
+            try:
+                entry = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue  # The request computing it went away, not this one: compute it here
+                raise
+            return entry if entry is not None else await compute()
+
+        with self._lock:
+            self._count(label, "misses")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            entry = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # The waiters, if any, raise it; without them it needn't be logged
+            raise
+        finally:
+            del self._inflight[key]
+        if entry is not None:
+            self.put(key, entry)
+        future.set_result(entry)
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            endpoints = {label: dict(counts) for label, counts in sorted(self._counts.items())}
+            hits = sum(c["hits"] + c["coalesced"] for c in endpoints.values())
+            requests = hits + sum(c["misses"] for c in endpoints.values())
+            for counts in endpoints.values():
+                total = counts["hits"] + counts["coalesced"] + counts["misses"]
+                counts["hit_rate"] = round((counts["hits"] + counts["coalesced"]) / total, 3) if total else None
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entry_bytes": self.max_entry_bytes,
+                "in_flight": len(self._inflight),
+                "evictions": self._evictions,
+                "too_large": self._too_large,
+                "requests": requests,
+                "hit_rate": round(hits / requests, 3) if requests else None,
+                "endpoints": endpoints,
+            }
@@ -71,8 +71,14 @@ def main():
     parser.add_argument("--port", type=int, default=8000, help="Port to bind to (default: 8000)")
     parser.add_argument("--reload", action="store_true", help="Enable auto-reload for development")
     parser.add_argument("--no-checks", action="store_true", help="Skip configuration checks")
+    parser.add_argument("--fhir-scan-interval", type=float, default=None,
+                        help="Seconds between background scans of clinical-records for changed files (default: off)")
     args = parser.parse_args()
 
+    if args.fhir_scan_interval is not None:
+        # Read by config.get_fhir_scan_interval() in the server process
+        os.environ['HEALTH_FHIR_SCAN_INTERVAL'] = str(args.fhir_scan_interval)
+
     print("Health Data Explorer - Starting Server")
     print("=" * 40)
 
@@ -0,0 +1,121 @@
+/**
+ * Compact chart payloads, the client side of chart_payload.py.
+ *
+ * ChartPayload.fetch(url) asks a chart endpoint for its columnar form and puts the ECharts option back together
+ * from the scaffold, the option's differences from it, and the data columns. It resolves to what the endpoint
+ * returns without format=columnar, chart_config and all, so callers don't change. Scaffolds are fetched once per
+ * page, and their URLs change when they do, so the browser can cache them too.
+ *
+ * ChartPayload.fetch(url, {binary: true}) asks for the binary form. It keeps every value exactly, but for
+ * regular times it is bigger than the JSON, where a run of minutes is a run of 1s.
+ */
+const ChartPayload = (() => {
+    const MAGIC = 'HCOL';
+    const BINARY_MEDIA_TYPE = 'application/octet-stream';
+    const scaffolds = new Map();   // URL -> promise of the scaffold
+
+    function isObject(value) {
+        return value !== null && typeof value === 'object' && !Array.isArray(value);
+    }
+
+    // The inverse of option_diff(): null removes a key
+    function merge(base, diff) {
+        if (!isObject(base) || !isObject(diff)) return diff;
+        const merged = Object.assign({}, base);
+        for (const [key, value] of Object.entries(diff)) {
+            if (value === null) delete merged[key];
+            else merged[key] = key in merged ? merge(merged[key], value) : value;
+        }
+        return merged;
+    }
+
+    function pad(n, width) {
+        return String(n).padStart(width, '0');
+    }
+
+    // Like Python's time.strftime with time.gmtime, for the formats of chart_payload.TIME_LABEL_FORMATS
+    function formatTime(ms, format) {
+        const d = new Date(ms);
+        const fields = {
+            Y: pad(d.getUTCFullYear(), 4), m: pad(d.getUTCMonth() + 1, 2), d: pad(d.getUTCDate(), 2),
+            H: pad(d.getUTCHours(), 2), M: pad(d.getUTCMinutes(), 2), S: pad(d.getUTCSeconds(), 2)
+        };
+        return format.replace(/%([YmdHMS])/g, (_, field) => fields[field]);
+    }
+
+    function decodeColumn(column) {
+        if (column.x) return column.x.map((x, i) => [x, column.v[i]]);
+        let times = column.times;
+        if (!times) {
+            let t = column.base;
+            times = column.t.map(delta => t += delta * column.step);
+        }
+        if (column.format) times = times.map(t => formatTime(t, column.format));
+        return times.map((t, i) => [t, column.v[i]]);
+    }
+
+    // See pack_binary() for the layout
+    function unpack(buffer) {
+        const view = new DataView(buffer);
+        const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+        if (magic !== MAGIC) throw new Error('Not a columnar chart payload');
+        const length = view.getUint32(4, true);
+        const payload = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, length)));
+        let offset = 8 + length;
+        payload.columns = payload.columns.map(column => {
+            if (!column || column.binary === undefined) return column;
+            const n = column.binary;
+            const times = new Array(n);
+            const values = new Array(n);
+            for (let i = 0; i < n; i++) {
+                times[i] = Number(view.getBigInt64(offset + 8 * i, true));
+                const v = view.getFloat64(offset + 8 * (n + i), true);
+                values[i] = isNaN(v) ? null : v;
+            }
+            offset += 16 * n;
+            return {times: times, v: values, format: column.format};
+        });
+        return payload;
+    }
+
+    function getScaffold(url) {
+        if (!scaffolds.has(url)) {
+            scaffolds.set(url, fetch(url).then(response => {
+                if (!response.ok) {
+                    scaffolds.delete(url);
+                    throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+                }
+                return response.json();
+            }));
+        }
+        return scaffolds.get(url);
+    }
+
+    function restore(payload, scaffold) {
+        const {option, columns, scaffold: _, ...rest} = payload;
+        const {series, ...config} = option;
+        const chartConfig = merge(scaffold.option, config);
+        chartConfig.series = series.map((s, i) => {
+            const merged = merge(scaffold.series, s);
+            if (columns[i]) merged.data = decodeColumn(columns[i]);
+            return merged;
+        });
+        // The vital chart endpoint also has the series outside the option
+        return Object.assign(rest, {chart_config: chartConfig, series: chartConfig.series});
+    }
+
+    async function fetchChart(url, options = {}) {
+        const columnarUrl = url + (url.includes('?') ? '&' : '?') + 'format=columnar';
+        const accept = options.binary ? `${BINARY_MEDIA_TYPE}, application/json` : 'application/json';
+        const response = await fetch(columnarUrl, {headers: {'Accept': accept}});
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+        }
+        const binary = (response.headers.get('Content-Type') || '').startsWith(BINARY_MEDIA_TYPE);
+        const payload = binary ? unpack(await response.arrayBuffer()) : await response.json();
+        if (!payload.scaffold) return payload;   // No data, or nothing to make columns of: the plain response
+        return restore(payload, await getScaffold(payload.scaffold));
+    }
+
+    return {fetch: fetchChart};
+})();
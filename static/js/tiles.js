@@ -0,0 +1,133 @@
+/**
+ * Zoom-driven chart data.
+ *
+ * A chart first shows coarse data for the whole time range, like daily averages. When it is zoomed in with the
+ * dataZoom, ChartTiles fetches the tiles of /api/series/{id}/tiles/{level}/{index} that cover the visible window,
+ * at the level that gives about one bucket per pixel, and shows their points in place of the coarse ones inside
+ * the window. Tiles are cached, so zooming back to a window already seen needs no requests.
+ *
+ * Usage, with the "tiles" object of a chart API response:
+ *     ChartTiles.attach(chart, chartData.tiles);
+ */
+const ChartTiles = (() => {
+    const TILE_BUCKETS = 256;     // buckets per tile, as in health_lib.TILE_BUCKETS
+    const MAX_LEVEL = 32;
+    const MAX_TILES = 16;         // per window, in case of a very wide chart
+    const DEBOUNCE_MS = 150;
+
+    // Apple Health times are local times, sent as if they were UTC. These convert between those and real times.
+    function fromServerTime(ms, localTime) {
+        if (!localTime) return ms;
+        const d = new Date(ms);
+        return new Date(d.getUTCFullYear(), d.getUTCMonth(), d.getUTCDate(),
+                        d.getUTCHours(), d.getUTCMinutes(), d.getUTCSeconds()).getTime();
+    }
+
+    function toServerTime(ms, localTime) {
+        if (!localTime) return ms;
+        const d = new Date(ms);
+        return Date.UTC(d.getFullYear(), d.getMonth(), d.getDate(),
+                        d.getHours(), d.getMinutes(), d.getSeconds());
+    }
+
+    function parseTime(value) {
+        return typeof value === 'number' ? value : echarts.time.parse(value).getTime();
+    }
+
+    function attach(chart, tiles) {
+        if (!chart || !tiles) return;
+        const option = chart.getOption();
+        if (!option.xAxis || option.xAxis[0].type !== 'time' || !option.dataZoom || !option.dataZoom.length) return;
+
+        // The coarse data, as [ms, value], to put back outside the window and when zoomed out again
+        const coarse = option.series.map(s => (s.data || [])
+            .map(point => [parseTime(point[0]), point[1]])
+            .filter(point => !isNaN(point[0])));
+        const times = coarse.flat().map(point => point[0]);
+        if (!times.length) return;
+        const min = Math.min(...times);
+        const max = Math.max(...times);
+        // Fixed, so the dataZoom percentages mean the same window whatever points are shown
+        chart.setOption({xAxis: {min: min, max: max}});
+
+        const cache = new Map();   // "level/index" -> promise of the tile
+        let timer = null;
+        let generation = 0;
+
+        function fetchTile(level, index) {
+            const key = `${level}/${index}`;
+            if (!cache.has(key)) {
+                const params = new URLSearchParams();
+                if (tiles.by_source) params.append('by_source', 'true');
+                if (tiles.source) params.append('source', tiles.source);
+                const request = fetch(`${tiles.url}/${key}?` + params.toString())
+                    .then(response => {
+                        if (!response.ok) throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+                        return response.json();
+                    })
+                    .catch(error => {
+                        cache.delete(key);  // try again next time
+                        throw error;
+                    });
+                cache.set(key, request);
+            }
+            return cache.get(key);
+        }
+
+        function show(range, tileList) {
+            const fine = option.series.map(() => []);
+            for (const tile of tileList) {
+                for (const series of tile.series) {
+                    const i = tiles.by_source ? option.series.findIndex(s => s.name === series.source) : 0;
+                    if (i < 0) continue;
+                    for (const point of series.points) {
+                        const t = fromServerTime(point[0], tiles.local_time);
+                        if (t >= range[0] && t <= range[1]) fine[i].push([t, point[1]]);
+                    }
+                }
+            }
+            chart.setOption({
+                series: coarse.map((points, i) => ({
+                    data: points.filter(p => p[0] < range[0]).concat(fine[i], points.filter(p => p[0] > range[1]))
+                }))
+            });
+        }
+
+        function update() {
+            const zoom = chart.getOption().dataZoom[0];
+            const start = min + (max - min) * (zoom.start || 0) / 100;
+            const end = min + (max - min) * (zoom.end === undefined ? 100 : zoom.end) / 100;
+            const current = ++generation;
+
+            // Zoomed out, or the coarse data already has about a point per pixel: nothing finer to get
+            const width = chart.getWidth();
+            const shown = coarse.reduce((n, points) => n + points.filter(p => p[0] >= start && p[0] <= end).length, 0);
+            if (end - start >= (max - min) * 0.9 || shown >= width / 4) {
+                chart.setOption({series: coarse.map(points => ({data: points}))});
+                return;
+            }
+
+            const secondsPerPixel = Math.max((end - start) / 1000 / width, 1);
+            const level = Math.min(Math.ceil(Math.log2(secondsPerPixel)), MAX_LEVEL);
+            const span = TILE_BUCKETS * Math.pow(2, level) * 1000;
+            const first = Math.floor(toServerTime(start, tiles.local_time) / span);
+            const last = Math.floor(toServerTime(end, tiles.local_time) / span);
+            if (last - first + 1 > MAX_TILES) return;
+
+            const requests = [];
+            for (let index = first; index <= last; index++) requests.push(fetchTile(level, index));
+            Promise.all(requests)
+                .then(tileList => {
+                    if (current === generation) show([start, end], tileList);
+                })
+                .catch(error => console.error('Error loading chart tiles:', error));
+        }
+
+        chart.on('datazoom', () => {
+            clearTimeout(timer);
+            timer = setTimeout(update, DEBOUNCE_MS);
+        });
+    }
+
+    return {attach: attach};
+})();
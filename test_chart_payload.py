@@ -0,0 +1,81 @@
+from unittest import TestCase
+
+from chart_payload import (option_diff, merge_option, encode_column, decode_column, make_scaffold, columnar,
+                           restore_chart_config, pack_binary, unpack_binary)
+
+
+class TestChartPayload(TestCase):
+    def setUp(self):
+        self.scaffold = make_scaffold(
+            {"tooltip": {"trigger": "axis"}, "grid": {"left": "3%", "bottom": "80px"}, "legend": {"top": 10}},
+            {"type": "line", "smooth": True, "symbol": "none"},
+        )
+        self.chart_config = {
+            "title": {"text": "Heart Rate"},
+            "tooltip": {"trigger": "axis"},
+            "grid": {"left": "3%", "bottom": "60px"},
+            "series": [
+                {"name": "Watch", "type": "line", "smooth": True, "symbol": "none",
+                 "data": [[1700000000000 + 60000 * i, 60.0 + i] for i in range(10)]},
+                {"name": "Weekly", "type": "bar", "data": [["2024-W01", 1.5], ["2024-W02", 2.5]]},
+                {"name": "Marks", "type": "scatter", "data": [{"value": 1}]},
+            ],
+        }
+
+    def test_option_diff(self):
+        option = self.chart_config.copy()
+        del option["series"]
+        diff = option_diff(option, self.scaffold["option"])
+        self.assertEqual({"title": {"text": "Heart Rate"}, "grid": {"bottom": "60px"}, "legend": None}, diff)
+        self.assertEqual(option, merge_option(self.scaffold["option"], diff))
+        self.assertEqual({}, option_diff(self.scaffold["option"], self.scaffold["option"]))
+
+    def test_encode_timestamps(self):
+        data = [[1700000000000, 1.0], [1700000060000, 2.5], [1700000180000, None]]
+        column = encode_column(data)
+        self.assertEqual({"base": 1700000000000, "step": 60000, "t": [0, 1, 2], "v": [1, 2.5, None]}, column)
+        self.assertEqual([[1700000000000, 1], [1700000060000, 2.5], [1700000180000, None]], decode_column(column))
+        self.assertEqual({"base": 0, "step": 1, "t": [], "v": []}, encode_column([]))
+
+    def test_encode_labels(self):
+        data = [["2024-01-01", 1.0], ["2024-01-02", 2.0], ["2024-01-04", 3.0]]
+        column = encode_column(data)
+        self.assertEqual("%Y-%m-%d", column["format"])
+        self.assertEqual([0, 1, 2], column["t"])
+        self.assertEqual(86400000, column["step"])
+        self.assertEqual([[x, int(v)] for x, v in data], decode_column(column))
+
+        # Labels that aren't times, or don't format back the same, go as they are
+        weeks = [["2024-W01", 1.5], ["2024-W02", 2.5]]
+        self.assertEqual({"x": ["2024-W01", "2024-W02"], "v": [1.5, 2.5]}, encode_column(weeks))
+        self.assertIn("x", encode_column([["2024-1-5", 1.0]]))
+        self.assertIsNone(encode_column([{"value": 1}]))
+
+    def test_precision(self):
+        column = encode_column([[0, 72.34567], [1000, 0.000123456], [2000, 1234567.0]], precision=3)
+        self.assertEqual([72.3, 0.000123, 1230000], column["v"])
+        self.assertEqual([72.34567], encode_column([[0, 72.34567]])["v"])
+
+    def test_columnar_round_trip(self):
+        payload = columnar(self.chart_config, self.scaffold, "/api/chart-scaffold/vital?v=1")
+        self.assertEqual("/api/chart-scaffold/vital?v=1", payload["scaffold"])
+        self.assertEqual({"name": "Watch"}, payload["option"]["series"][0])
+        self.assertIsNone(payload["columns"][2])
+        self.assertEqual([{"value": 1}], payload["option"]["series"][2]["data"])
+        self.assertEqual(self.chart_config, restore_chart_config(payload, self.scaffold))
+
+    def test_binary_round_trip(self):
+        payload = columnar(self.chart_config, self.scaffold, "/api/chart-scaffold/vital?v=1")
+        payload["columns"][0]["v"][3] = None
+        body = pack_binary(payload)
+        self.assertEqual(b"HCOL", body[:4])
+        # The header is padded so the arrays after it are 8-byte aligned
+        self.assertEqual(0, (8 + int.from_bytes(body[4:8], "little")) % 8)
+        unpacked = unpack_binary(body)
+        self.assertEqual(1, unpacked["columns"][0]["step"])
+        self.assertEqual(payload["columns"][1:], unpacked["columns"][1:])
+        self.assertEqual(decode_column(payload["columns"][0])[:3], decode_column(unpacked["columns"][0])[:3])
+        self.assertNotEqual(unpacked["columns"][0]["v"][3], unpacked["columns"][0]["v"][3])  # NaN
+
+        with self.assertRaises(ValueError):
+            unpack_binary(b"JSON" + body[4:])
@@ -0,0 +1,65 @@
+import os
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+from unittest import TestCase
+
+from db_pool import ReadOnlyPool, tuple_cursor
+
+
+class TestReadOnlyPool(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = Path(self.tmp.name) / "test.db"
+        self.write_database(self.db, [1, 2, 3])
+        self.pool = ReadOnlyPool(row_factory=sqlite3.Row)
+
+    def tearDown(self):
+        self.pool.close_thread()
+        self.tmp.cleanup()
+
+    @staticmethod
+    def write_database(path: Path, values: list[int]):
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE t (value INTEGER)")
+        conn.executemany("INSERT INTO t VALUES (?)", [(v,) for v in values])
+        conn.commit()
+        conn.close()
+
+    def test_reuses_connection(self):
+        conn = self.pool.connection(self.db)
+        self.assertIs(conn, self.pool.connection(self.db))
+        self.assertEqual(3, conn.execute("SELECT COUNT(*) AS n FROM t").fetchone()["n"])
+        self.assertEqual({"opened": 1, "reopened": 0}, self.pool.stats())
+
+    def test_read_only(self):
+        conn = self.pool.connection(self.db)
+        with self.assertRaises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO t VALUES (4)")
+
+    def test_reopens_replaced_file(self):
+        conn = self.pool.connection(self.db)
+        replacement = Path(self.tmp.name) / "new.db"
+        self.write_database(replacement, [10, 20])
+        os.replace(replacement, self.db)
+        reopened = self.pool.connection(self.db)
+        self.assertIsNot(conn, reopened)
+        self.assertEqual([10, 20], [row[0] for row in reopened.execute("SELECT value FROM t")])
+        self.assertEqual({"opened": 2, "reopened": 1}, self.pool.stats())
+
+    def test_missing_database(self):
+        with self.assertRaises(FileNotFoundError):
+            self.pool.connection(Path(self.tmp.name) / "missing.db")
+
+    def test_one_connection_per_thread(self):
+        conns = []
+        thread = threading.Thread(target=lambda: conns.append(self.pool.connection(self.db)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(conns[0], self.pool.connection(self.db))
+
+    def test_tuple_cursor(self):
+        conn = self.pool.connection(self.db)
+        self.assertEqual((1,), tuple_cursor(conn).execute("SELECT value FROM t ORDER BY value").fetchone())
+        self.assertIsInstance(conn.execute("SELECT value FROM t").fetchone(), sqlite3.Row)
@@ -0,0 +1,59 @@
+import math
+from array import array
+from unittest import TestCase
+
+import numpy as np
+
+from downsample import m4_indices, lttb_indices, downsample_indices, downsample_pairs
+
+
+class TestDownsample(TestCase):
+    def setUp(self):
+        self.ts = np.arange(10_000, dtype=np.float64) * 60
+        self.values = np.sin(np.arange(10_000) / 100) * 50 + 100
+        self.values[1234] = 500  # a spike that must survive
+        self.values[5678] = -500
+
+    def test_m4_keeps_extremes(self):
+        picked = m4_indices(self.ts, self.values, 100)
+        self.assertLessEqual(len(picked), 400)
+        self.assertTrue(np.all(np.diff(picked) > 0))
+        self.assertIn(0, picked)
+        self.assertIn(9999, picked)
+        self.assertIn(1234, picked)
+        self.assertIn(5678, picked)
+
+    def test_m4_every_column(self):
+        # Each pixel column's min and max are among the points kept
+        picked = set(m4_indices(self.ts, self.values, 100).tolist())
+        for column in np.array_split(np.arange(10_000), 100):
+            values = self.values[column]
+            self.assertIn(column[np.argmin(values)], picked)
+            self.assertIn(column[np.argmax(values)], picked)
+
+    def test_lttb(self):
+        picked = lttb_indices(self.ts, self.values, 500)
+        self.assertEqual(500, len(picked))
+        self.assertEqual((0, 9999), (picked[0], picked[-1]))
+        self.assertTrue(np.all(np.diff(picked) > 0))
+        self.assertIn(1234, picked)
+        self.assertIn(5678, picked)
+        self.assertEqual([0, 1, 2], list(lttb_indices(self.ts[:3], self.values[:3], 500)))
+
+    def test_downsample_indices(self):
+        # Arrays from a TimeSeries work, NaNs are dropped and unsorted timestamps are sorted
+        ts = array("q", [3, 1, 2, 4, 5, 6])
+        values = array("d", [3.0, 1.0, math.nan, 4.0, 5.0, 6.0])
+        self.assertEqual([1, 0, 3, 4, 5], list(downsample_indices(ts, values, 2, "m4")))
+        self.assertEqual([1, 5], list(downsample_indices(ts, values, 2, "lttb")))
+        with self.assertRaises(ValueError):
+            downsample_indices(ts, values, 2, "fast")
+
+    def test_downsample_pairs(self):
+        pairs = [[t * 1000, v] for t, v in zip(self.ts.tolist(), self.values.tolist())]
+        short = pairs[:10]
+        self.assertIs(short, downsample_pairs(short, 100))
+        picked = downsample_pairs(pairs, 100, "lttb")
+        self.assertEqual(100, len(picked))
+        self.assertEqual(pairs[0], picked[0])
+        self.assertIn([1234 * 60 * 1000, 500.0], picked)
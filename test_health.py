@@ -1,10 +1,15 @@
 import json
+import os
+import shutil
 import sys
+import tempfile
 from pathlib import Path
 from typing import NoReturn
 from unittest import TestCase
 from health_lib import extract_value, list_vitals, list_prefixes, list_categories, get_value_quantity, get_reference_range, \
-    StatInfo, ValueQuantity, ReferenceRange
+    StatInfo, ValueQuantity, ReferenceRange, TimeSeries, get_prefix_catalog, ObservationIndex, extract_all_values, \
+    yield_observation_files, yield_ndjson_resources, observation_postings, parse_reference_range_text, out_of_range, \
+    yield_resources, extract_value_helper
 
 
 class Test(TestCase):
@@ -42,6 +47,103 @@ class Test(TestCase):
         self.assertEqual(2, vitals["Observation"])
         self.assertEqual(1, vitals["MedicationRequest"])
 
+    def test_prefix_catalog(self):
+        catalog = get_prefix_catalog(Path("test_data/list_prefixes_test_dir"))
+        self.assertEqual(list_prefixes(Path("test_data/list_prefixes_test_dir")), catalog.prefixes)
+        self.assertEqual(2, len(catalog.files["Observation"]))
+        self.assertEqual("MedicationRequest", catalog.resolve("medicationrequest"))
+        self.assertIsNone(catalog.resolve("condition"))
+        # Unchanged directory, so the cached catalog is reused
+        self.assertIs(catalog, get_prefix_catalog(Path("test_data/list_prefixes_test_dir")))
+
+        with tempfile.TemporaryDirectory() as d:
+            self.assertEqual(0, len(get_prefix_catalog(Path(d)).prefixes))
+            (Path(d) / "Condition-1.json").write_text("{}")
+            self.assertEqual(1, get_prefix_catalog(Path(d)).prefixes["Condition"])
+            # An .ndjson file counts a resource per line
+            (Path(d) / "Condition.ndjson").write_text("{}\n\n{}\n")
+            catalog = get_prefix_catalog(Path(d))
+            self.assertEqual(3, catalog.prefixes["Condition"])
+            self.assertEqual([Path(d) / "Condition-1.json", Path(d) / "Condition.ndjson"], catalog.files["Condition"])
+            self.assertEqual([0, 4], [offset for offset, _ in yield_resources(Path(d) / "Condition.ndjson")])
+            # Rewriting it in place leaves the directory alone, but still rebuilds the catalog
+            with open(Path(d) / "Condition.ndjson", "a") as f:
+                f.write("{}\n")
+            self.assertEqual(4, get_prefix_catalog(Path(d)).prefixes["Condition"])
+
+    def test_observation_index(self):
+        with tempfile.TemporaryDirectory() as d:
+            records = Path(d) / "clinical-records"
+            records.mkdir()
+            shutil.copy("test_data/Observation-test-bp.json", records)
+            index = ObservationIndex(Path(d) / "index.db", records)
+            self.assertEqual(1, index.build())
+            self.assertEqual(list_vitals(yield_observation_files(records), "Vital Signs"),
+                             index.list_vitals("Vital Signs"))
+            self.assertEqual(list_categories(records, False, one_prefix="Observation"), index.list_categories())
+
+            stat_info = StatInfo("Vital Signs", "Blood Pressure")
+            expected = extract_all_values(yield_observation_files(records), stat_info=stat_info)
+            found = index.extract_all_values(stat_info)
+            self.assertEqual([o.date for o in expected], [o.date for o in found])
+            self.assertEqual(expected[0].data, found[0].data)
+
+            # Incremental updates
+            shutil.copy("test_data/Observation-test-bp2.json", records)
+            changes = index.sync()
+            self.assertEqual((["Observation-test-bp2.json"], [], []), (changes.inserted, changes.updated, changes.deleted))
+            self.assertEqual(2, len(index.files_for(stat_info)))
+            (records / "Observation-test-bp.json").unlink()
+            self.assertEqual(["Observation-test-bp.json"], index.sync().deleted)
+            self.assertEqual([records / "Observation-test-bp2.json"], index.files_for(stat_info))
+
+            # Same content with a new mtime only updates the manifest. New content is re-indexed.
+            bp2 = records / "Observation-test-bp2.json"
+            os.utime(bp2, ns=(0, 0))
+            changes = index.sync()
+            self.assertEqual((["Observation-test-bp2.json"], []), (changes.touched, changes.updated))
+            self.assertFalse(index.sync().changed)
+            bp2.write_text(bp2.read_text().replace('"Blood Pressure"', '"BP"'))
+            self.assertEqual(["Observation-test-bp2.json"], index.sync().updated)
+            self.assertEqual([], index.files_for(stat_info))
+            self.assertEqual(1, index.list_vitals("Vital Signs")["BP"])
+
+            # A file that isn't JSON is kept with no postings, and one deleted before the changes are applied is
+            # dropped. Neither stops the others, or leaves a transaction open.
+            (records / "Observation-bad.json").write_text("{not json")
+            shutil.copy("test_data/Observation-test-bp.json", records)
+            (records / "Observation-gone.json").write_text("{}")
+            changes = index.scan()
+            (records / "Observation-gone.json").unlink()
+            index.apply_changes(changes)
+            self.assertFalse(index.conn.in_transaction)
+            self.assertEqual({"Observation-bad.json", "Observation-test-bp.json", "Observation-test-bp2.json"},
+                             index.indexed_filenames())
+            self.assertEqual(1, len(index.files_for(stat_info)))
+            self.assertFalse(index.sync().changed)
+            index.close()
+
+    def test_observation_index_ndjson(self):
+        with tempfile.TemporaryDirectory() as d:
+            records = Path(d)
+            lines = [json.dumps(json.load(open(f"test_data/Observation-test-{n}.json"))) for n in ("bp", "bp2")]
+            (records / "Observation.ndjson").write_text("\n".join(lines) + "\n")
+            self.assertEqual(2, len(list(yield_ndjson_resources(records / "Observation.ndjson"))))
+
+            index = ObservationIndex(records / "index.db", records)
+            self.assertEqual(1, index.build())
+            stat_info = StatInfo("Vital Signs", "Blood Pressure")
+            self.assertEqual(2, len(index.extract_all_values(stat_info)))
+            self.assertFalse(index.has_ingested_sources())
+
+            # Ingested resources have no file, and survive a directory scan
+            resource = json.load(open("test_data/Observation-test-bp.json"))
+            index.add_postings("synthea/bundle.json", [(0, observation_postings("bundle.json#1", resource))])
+            self.assertFalse(index.sync().changed)
+            self.assertEqual(3, index.list_vitals("Vital Signs")["Blood Pressure"])
+            self.assertTrue(index.has_ingested_sources())
+            index.close()
+
     def test_categories(self):
         category_list, category_counter, count = list_categories(Path("test_data/list_prefixes_test_dir"), False, one_prefix=None)
         self.assertEqual(2, len(category_list))
@@ -125,5 +227,68 @@ class Test(TestCase):
         range_ = rr.get_range()
         print(rr, range_)
 
+    def test_time_series(self):
+        series = TimeSeries("Heart Rate", "count/min").extend([(1, 60.0), (2, 61.5)])
+        series.append(3, 62)
+        self.assertEqual(3, len(series))
+        self.assertEqual([(1, 60.0), (2, 61.5), (3, 62.0)], list(series))
+        self.assertEqual([[1000, 60.0], [2000, 61.5], [3000, 62.0]], series.pairs_ms())
+        # Slotted records have no per-instance __dict__
+        self.assertFalse(hasattr(ValueQuantity(1, "g", "x"), "__dict__"))
+        self.assertFalse(hasattr(series, "__dict__"))
+
+    def test_parse_reference_range_text(self):
+        self.check_range("6.0 - 7.7 g/dL", 6.0, 7.7)
+        self.assertEqual((None, 36.0, "<"), parse_reference_range_text("<36"))
+        self.assertEqual((None, 5.0, "<="), parse_reference_range_text("<= 5 mg/dL"))
+        self.assertEqual((0.5, 1.5, "between"), parse_reference_range_text(".5-1.5"))
+        self.assertIsNone(parse_reference_range_text("NEGATIVE"))
+        self.assertIsNone(parse_reference_range_text("---"))
+        self.assertIsNone(ReferenceRange(None, None, "NEGATIVE").get_range())
+        self.assertEqual((140, 400, "between"),
+                         ReferenceRange(ValueQuantity(140, "K/uL", "low"), ValueQuantity(400, "K/uL", "high"), "").bounds())
+
+    def test_reference_range_text_units(self):
+        # Numbers in the text are in the file's unit, and are converted like the value is
+        observation = extract_value_helper(filename="test", condition={
+            "category": [{"text": "Vital Signs"}], "code": {"text": "Body Temperature"},
+            "effectiveDateTime": "2024-02-15T21:00:03Z", "valueQuantity": {"value": 38, "unit": "Cel"},
+            "referenceRange": [{"text": "36.1 - 37.2"}]}, stat_info=StatInfo("Vital Signs", "Body Temperature"))
+        self.assertEqual("Fah", observation.data[0].unit)
+        low, high, op = observation.range.bounds()
+        self.assertAlmostEqual(96.98, low)
+        self.assertAlmostEqual(98.96, high)
+        self.assertTrue(out_of_range(observation.data[0].value, low, high, op))
+        low, high, op = ReferenceRange(None, None, "<100", "kg").bounds()
+        self.assertEqual((None, "<"), (low, op))
+        self.assertAlmostEqual(220.0, high)
+        self.assertEqual((None, 100.0, "<"), ReferenceRange(None, None, "<100", "mg/dL").bounds())
+
+    def test_out_of_range(self):
+        self.assertTrue(out_of_range(36, None, 36, "<"))
+        self.assertFalse(out_of_range(36, None, 36, "<="))
+        self.assertTrue(out_of_range(7.7, 7.7, None, ">"))
+        self.assertFalse(out_of_range(7.7, 7.7, None, ">="))
+        self.assertTrue(out_of_range(5, 6.0, 7.7, "between"))
+        self.assertFalse(out_of_range(7.7, 6.0, 7.7, "between"))
+        self.assertTrue(out_of_range(7.8, 7.9, 7.9, "="))
+
+    def test_observation_index_ranges(self):
+        with tempfile.TemporaryDirectory() as d:
+            records = Path(d)
+            shutil.copy("test_data/ref_range_text.json", records / "Observation-ref_range_text.json")
+            resource = json.load(open("test_data/ref_range_text.json"))
+            resource["valueQuantity"]["value"] = 40
+            (records / "Observation-high.json").write_text(json.dumps(resource))
+
+            index = ObservationIndex(records / "index.db", records)
+            index.build()
+            self.assertEqual((None, 36.0, "<"), index.reference_range(StatInfo("Laboratory", "ALT")))
+            self.assertIsNone(index.reference_range(StatInfo("Laboratory", "Nothing")))
+            rows = index.list_out_of_range("Laboratory")
+            self.assertEqual([("ALT", 40.0, "Observation-high.json")], [(r[1], r[3], r[7]) for r in rows])
+            self.assertEqual(2, len(index.list_out_of_range()))  # Also in the "Lab" category
+            index.close()
+
 
 
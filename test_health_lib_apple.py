@@ -0,0 +1,144 @@
+import sqlite3
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from health_lib_apple import get_apple_health_records, iter_apple_health_records, get_activity_summaries, \
+    iter_activity_summaries, get_apple_health_series, get_apple_catalog, build_apple_catalog, \
+    list_apple_health_categories, get_apple_health_statistics, refresh_apple_rollups, get_apple_rollups, \
+    count_apple_records, get_record_data_for_chart, get_apple_tile, resolve_record_type, get_record_type_info
+from preprocess_apple_health import create_database_schema
+
+
+class TestAppleQueries(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = db_path = Path(self.tmp.name) / "apple_health.db"
+        conn = sqlite3.connect(db_path)
+        create_database_schema(conn)
+        conn.executemany("INSERT INTO apple_health_records (type, unit, value, source_name, start_date, end_date) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         [("HKQuantityTypeIdentifierHeartRate", "count/min", 60 + i, "Watch",
+                           f"2024-02-{i + 1:02}T08:00:00", f"2024-02-{i + 1:02}T08:00:00") for i in range(25)] +
+                         [("HKQuantityTypeIdentifierStepCount", "count", 100, "Phone",
+                           "2024-01-01T08:00:00", "2024-01-01T08:05:00")])
+        conn.executemany("INSERT INTO activity_summaries (date_components, active_energy_burned) VALUES (?, ?)",
+                         [(f"2024-02-{i + 1:02}", 100.0 * i) for i in range(5)])
+        conn.commit()
+        conn.close()
+        self.patch = patch("config.get_apple_health_database_path", return_value=db_path)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.tmp.cleanup()
+
+    def test_iter_records(self):
+        records = list(iter_apple_health_records("HKQuantityTypeIdentifierHeartRate", chunk_size=4))
+        self.assertEqual(records, get_apple_health_records("HKQuantityTypeIdentifierHeartRate"))
+        self.assertEqual(25, len(records))
+        self.assertEqual(84, records[0].value)  # Newest first
+
+        projected = list(iter_apple_health_records("HKQuantityTypeIdentifierHeartRate", limit=3, after="2024-02-10",
+                                                   columns=["start_date", "value"]))
+        self.assertEqual([("2024-02-25T08:00:00", 84.0), ("2024-02-24T08:00:00", 83.0), ("2024-02-23T08:00:00", 82.0)],
+                         projected)
+        with self.assertRaises(ValueError):
+            list(iter_apple_health_records("HKQuantityTypeIdentifierHeartRate", columns=["value; DROP TABLE x"]))
+
+    def test_iter_activity_summaries(self):
+        summaries = list(iter_activity_summaries(chunk_size=2))
+        self.assertEqual(summaries, get_activity_summaries())
+        self.assertEqual("2024-02-05", summaries[0].date)
+        self.assertEqual([("2024-02-02", 100.0)],
+                         list(iter_activity_summaries(before="2024-02-02", after="2024-02-02",
+                                                      columns=("date_components", "active_energy_burned"))))
+
+    def test_series(self):
+        series = get_apple_health_series("HKQuantityTypeIdentifierHeartRate", after="2024-02-20")
+        self.assertEqual([79.0, 80.0, 81.0, 82.0, 83.0, 84.0], list(series.values))
+        self.assertEqual("count/min", series.unit)
+
+    def test_catalog(self):
+        # Without a catalog table, the same entries are computed from the records
+        computed = get_apple_catalog()
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(computed, build_apple_catalog(conn))
+        conn.close()
+        self.assertEqual(computed, get_apple_catalog())
+
+        heart = computed[0]
+        self.assertEqual(("HKQuantityTypeIdentifierHeartRate", "heartrate", 25), (heart.name, heart.slug, heart.count))
+        self.assertEqual(("2024-02-01T08:00:00", "2024-02-25T08:00:00"), (heart.min_date, heart.max_date))
+        self.assertEqual((["count/min"], {"Watch": 25}), (heart.units, heart.sources))
+
+        self.assertEqual([("HKQuantityTypeIdentifierHeartRate", 25, "/apple/heartrate"),
+                          ("HKQuantityTypeIdentifierStepCount", 1, "/apple/stepcount")],
+                         [(c.name, c.count, c.url) for c in list_apple_health_categories()])
+        stats = get_apple_health_statistics()
+        self.assertEqual((26, 5, 0), (stats["total_records"], stats["total_activities"], stats["total_workouts"]))
+        self.assertEqual({"min": "2024-01-01T08:00:00", "max": "2024-02-25T08:00:00"}, stats["date_range"])
+        self.assertEqual({"Watch": 25, "Phone": 1}, stats["sources"])
+
+    def test_resolve_record_type(self):
+        self.assertEqual("HKQuantityTypeIdentifierHeartRate", resolve_record_type("heartrate"))
+        self.assertEqual("HKQuantityTypeIdentifierHeartRate", resolve_record_type("HKQuantityTypeIdentifierHeartRate"))
+        self.assertIsNone(resolve_record_type("bodymass"))  # Displayed, but no records of it
+
+        # A type without display information, added after the index was built
+        self.assertIsNone(resolve_record_type("headphoneaudioexposure"))
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO apple_health_records (type, unit, value, source_name, start_date, end_date) "
+                     "VALUES ('HKQuantityTypeIdentifierHeadphoneAudioExposure', 'dBASPL', 70, 'Phone', "
+                     "'2024-01-01T08:00:00', '2024-01-01T08:00:00')")
+        conn.commit()
+        conn.close()
+        self.assertEqual("HKQuantityTypeIdentifierHeadphoneAudioExposure", resolve_record_type("headphoneaudioexposure"))
+        self.assertEqual(("HeadphoneAudioExposure", "Other"),
+                         tuple(get_record_type_info("HKQuantityTypeIdentifierHeadphoneAudioExposure")[k]
+                               for k in ("display_name", "category")))
+
+    def test_rollups(self):
+        self.assertIsNone(get_apple_rollups("HKQuantityTypeIdentifierHeartRate", "day"))
+        self.assertEqual(25, count_apple_records("HKQuantityTypeIdentifierHeartRate"))
+
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(26, refresh_apple_rollups(conn))
+        self.assertEqual(0, refresh_apple_rollups(conn))
+        self.assertEqual(25, count_apple_records("HKQuantityTypeIdentifierHeartRate"))
+        self.assertEqual(6, count_apple_records("HKQuantityTypeIdentifierHeartRate", after="2024-02-20"))
+
+        month = get_apple_rollups("HKQuantityTypeIdentifierHeartRate", "month")
+        self.assertEqual([("2024-02", 72.0, 60.0, 84.0, 25, "count/min")], [tuple(row) for row in month])
+
+        # New records are added to the existing buckets
+        conn.execute("INSERT INTO apple_health_records (type, unit, value, source_name, start_date, end_date) "
+                     "VALUES ('HKQuantityTypeIdentifierStepCount', 'count', 50, 'Phone', "
+                     "'2024-01-01T09:00:00', '2024-01-01T09:05:00')")
+        conn.commit()
+        self.assertEqual(1, refresh_apple_rollups(conn))
+        conn.close()
+        day = get_apple_rollups("HKQuantityTypeIdentifierStepCount", "day", cumulative=True)
+        self.assertEqual([("2024-01-01", 150.0, 50.0, 100.0, 2, "count")], [tuple(row) for row in day])
+        self.assertEqual([], get_apple_rollups("HKQuantityTypeIdentifierStepCount", "day", source="Watch"))
+        self.assertEqual(list(range(60, 85)), [p["value"] for p in get_record_data_for_chart(
+            "HKQuantityTypeIdentifierHeartRate")])
+
+    def test_tiles(self):
+        # 2024-02-01T08:00:00 is 1706774400, bucket 62 of tile 104173 of level 6 (64 s buckets)
+        minute = [{"source": None, "points": [[1706774400000, 60.0, 60.0, 60.0, 1]]}]
+        self.assertEqual(minute, get_apple_tile("HKQuantityTypeIdentifierHeartRate", 6, 104173))  # from records
+        conn = sqlite3.connect(self.db_path)
+        refresh_apple_rollups(conn)
+        conn.close()
+        self.assertEqual(minute, get_apple_tile("HKQuantityTypeIdentifierHeartRate", 6, 104173))  # from rollups
+
+        # Level 20 buckets are about 12 days
+        tile = get_apple_tile("HKQuantityTypeIdentifierHeartRate", 20, 6, by_source=True)
+        self.assertEqual(["Watch"], [series["source"] for series in tile])
+        self.assertEqual([(61.5, 60.0, 63.0, 4), (70.0, 64.0, 76.0, 13), (80.5, 77.0, 84.0, 8)],
+                         [tuple(point[1:]) for point in tile[0]["points"]])
+        self.assertEqual([], get_apple_tile("HKQuantityTypeIdentifierHeartRate", 20, 6, source="Phone"))
+        with self.assertRaises(ValueError):
+            get_apple_tile("HKQuantityTypeIdentifierHeartRate", 33, 0)
@@ -0,0 +1,108 @@
+import sqlite3
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from health_lib_cda import get_cda_observations, iter_cda_observations, search_cda_observations, \
+    iter_search_cda_observations, get_cda_series, get_cda_catalog, build_cda_catalog, get_cda_catalog_entry, \
+    list_cda_categories, list_cda_observation_types, get_cda_statistics, count_cda_chart_points, get_cda_chart_series, \
+    get_cda_tile, get_cda_catalog_index, resolve_cda_category
+from preprocess_cda import create_database, get_all_observations
+
+
+class TestCDAQueries(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = db_path = Path(self.tmp.name) / "cda_observations.db"
+        conn = create_database(db_path)
+        conn.executemany("INSERT INTO cda_observations (name, category, value, unit, date, source_name) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         [("Heart Rate", "Vital Signs", 60 + i, "count/min", f"2024-02-{i + 1:02}T08:00:00Z",
+                           "Clinic" if i % 2 else "Watch") for i in range(10)] +
+                         [("Body Weight", "Biometrics", 150, "lb", "2024-02-01T08:00:00Z", "Clinic")])
+        conn.commit()
+        conn.close()
+        self.patch = patch("config.get_cda_database_path", return_value=db_path)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.tmp.cleanup()
+
+    def test_iter_observations(self):
+        observations = list(iter_cda_observations("Vital Signs", chunk_size=3))
+        self.assertEqual(observations, get_cda_observations("Vital Signs"))
+        self.assertEqual(10, len(observations))
+        self.assertEqual(69, observations[0].value)
+        self.assertEqual([(69.0,), (68.0,)],
+                         list(iter_cda_observations("Vital Signs", "Heart Rate", limit=2, columns=["value"])))
+
+    def test_iter_search(self):
+        found = list(iter_search_cda_observations("Clinic", chunk_size=2))
+        self.assertEqual(found, search_cda_observations("Clinic"))
+        self.assertEqual(6, len(found))
+        self.assertEqual([("Body Weight",)], list(iter_search_cda_observations("Weight", columns=["name"])))
+
+    def test_series(self):
+        series = get_cda_series("Vital Signs", "Heart Rate")
+        self.assertEqual(list(range(60, 70)), list(series.values))
+        self.assertEqual("count/min", series.unit)
+
+    def test_catalog(self):
+        # Without a catalog table, the same entries are computed from the observations
+        computed = get_cda_catalog()
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(computed, build_cda_catalog(conn))
+        conn.close()
+        self.assertEqual(computed, get_cda_catalog())
+
+        heart = get_cda_catalog_entry("Vital Signs", "Heart Rate")
+        self.assertEqual(("heart-rate", 10, ["count/min"]), (heart.slug, heart.count, heart.units))
+        self.assertEqual(["Clinic", "Watch"], heart.source_names())
+        self.assertIsNone(get_cda_catalog_entry("Vital Signs", "Body Weight"))
+
+        self.assertEqual([("Vital Signs", 10, "/cda/vital-signs"), ("Biometrics", 1, "/cda/biometrics")],
+                         [(c.name, c.count, c.url) for c in list_cda_categories()])
+        self.assertEqual([("Body Weight", 1)], list_cda_observation_types("Biometrics"))
+        stats = get_cda_statistics()
+        self.assertEqual(11, stats["total_observations"])
+        self.assertEqual({"min": "2024-02-01T08:00:00Z", "max": "2024-02-10T08:00:00Z"}, stats["date_range"])
+        self.assertEqual({"Clinic": 6, "Watch": 5}, stats["sources"])
+
+    def test_resolve_category(self):
+        self.assertEqual("Vital Signs", resolve_cda_category("vital-signs"))
+        self.assertEqual("Vital Signs", resolve_cda_category("Vital Signs"))
+        self.assertIsNone(resolve_cda_category("laboratory"))
+        index = get_cda_catalog_index()
+        self.assertEqual("Heart Rate", index.entry_by_slug("observation", "heart-rate", "vital-signs").name)
+        self.assertIsNone(index.entry_by_slug("observation", "heart-rate", "biometrics"))
+
+    def test_chart_series(self):
+        self.assertEqual((10, "count/min"), count_cda_chart_points("Vital Signs", "Heart Rate"))
+        self.assertEqual((5, "count/min"), count_cda_chart_points("Vital Signs", "Heart Rate", source="Clinic"))
+
+        raw = get_cda_chart_series("Vital Signs", "Heart Rate")
+        self.assertEqual(["Watch", "Clinic"], list(raw))
+        self.assertEqual([1706774400000, 60.0], raw["Watch"][0])  # 2024-02-01T08:00:00Z
+
+        # Monday 2024-01-29 to Sunday 2024-02-04 is the first week, in UTC
+        weeks = get_cda_chart_series("Vital Signs", "Heart Rate", "week")
+        self.assertEqual([[1706486400000, 61.0], [1707091200000, 66.0]], weeks["Watch"][:2])
+        self.assertEqual([[1706745600000, 61.0]], get_cda_chart_series("Vital Signs", "Heart Rate", "month",
+                                                                        before="2024-02-04", source="Clinic")["Clinic"])
+
+    def test_tile(self):
+        # 2024-02-01T08:00:00Z is 1706774400, bucket 62 of tile 104173 of level 6 (64 s buckets)
+        self.assertEqual([{"source": "Watch", "points": [[1706774400000, 60.0, 60.0, 60.0, 1]]}],
+                         get_cda_tile("Vital Signs", "Heart Rate", 6, 104173, by_source=True))
+        # Level 20 buckets are about 12 days, the first ending on 2024-02-04
+        tile = get_cda_tile("Vital Signs", "Heart Rate", 20, 6)
+        self.assertEqual([(61.5, 60.0, 63.0, 4), (66.5, 64.0, 69.0, 6)],
+                         [tuple(point[1:]) for point in tile[0]["points"]])
+        self.assertEqual([], get_cda_tile("Vital Signs", "Heart Rate", 20, 5))
+
+    def test_dates_in_utc(self):
+        # The export has 20210426004829-0800, which the preprocessor stores in UTC
+        observations = list(get_all_observations("test_data/export_cda_fraction_source.xml"))
+        self.assertEqual(["2021-04-26T08:48:29Z"], [ob.date for ob in observations])
@@ -0,0 +1,156 @@
+import json
+import shutil
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+from unittest import TestCase
+
+from health_lib import ObservationIndex
+from health_lib_unified import metric_id, convert_unit, refresh_unified_store, list_metrics, query_metric, \
+    query_metric_series, connect_unified
+from preprocess_apple_health import create_database_schema
+from preprocess_cda import create_database
+
+
+class TestUnified(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        d = Path(self.tmp.name)
+        self.unified = d / "unified.db"
+
+        self.cda = d / "cda.db"
+        conn = create_database(self.cda)
+        conn.executemany("INSERT INTO cda_observations (name, category, value, unit, date, source_name) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", [
+                             ("Heart Rate", "Vital Signs", 61, "count/min", "2024-02-15T20:00:00Z", "Clinic"),
+                             ("Body Weight", "Biometrics", 150, "lb", "2024-02-15T20:00:00Z", "Clinic"),
+                             ("Body Weight", "Biometrics", 151, "lb", "not a date", "Clinic"),
+                         ])
+        conn.commit()
+        conn.close()
+
+        self.apple = d / "apple.db"
+        conn = sqlite3.connect(self.apple)
+        create_database_schema(conn)
+        conn.executemany("INSERT INTO apple_health_records (type, unit, value, source_name, start_date, end_date) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", [
+                             ("HKQuantityTypeIdentifierHeartRate", "count/min", 72, "Watch",
+                              "2024-02-16T22:00:00", "2024-02-16T22:00:00"),
+                             ("HKQuantityTypeIdentifierOxygenSaturation", "%", 0.97, "Watch",
+                              "2024-02-16T22:00:00", "2024-02-16T22:00:00"),
+                             ("HKQuantityTypeIdentifierStepCount", "count", 100, "Phone",
+                              "2024-02-16T22:00:00", "2024-02-16T22:05:00"),
+                         ])
+        conn.commit()
+        conn.close()
+
+        records = d / "clinical-records"
+        records.mkdir()
+        shutil.copy("test_data/Observation-test-bp.json", records)
+        self.records = records
+        self.index = ObservationIndex(d / "index.db", records)
+        self.index.build()
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp.cleanup()
+
+    def test_metric_id(self):
+        self.assertEqual("body_weight", metric_id("Body Weight"))
+        self.assertEqual("body_weight", metric_id("HKQuantityTypeIdentifierBodyMass"))
+        self.assertEqual("heart_rate", metric_id("heart rate"))
+        self.assertEqual("systolic_blood_pressure", metric_id("Systolic blood pressure"))
+        self.assertEqual("step_count", metric_id("HKQuantityTypeIdentifierStepCount"))
+        self.assertEqual("glucose_serum", metric_id("Glucose, Serum"))
+
+    def test_convert_unit(self):
+        unit, factor, offset = convert_unit("body_temperature", "degF")
+        self.assertEqual("Cel", unit)
+        self.assertAlmostEqual(37.0, 98.6 * factor + offset)
+        self.assertEqual(("mg/dL", 1.0, 0.0), convert_unit("glucose", "mg/dL"))
+
+    def test_refresh_and_query(self):
+        loaded = refresh_unified_store(self.unified, cda_db=self.cda, apple_db=self.apple, fhir_index=self.index)
+        self.assertEqual({"cda": 2, "apple": 3, "fhir": 2}, loaded)
+
+        heart = query_metric(self.unified, "heart_rate")
+        self.assertEqual([("cda", 61.0, "/min"), ("apple", 72.0, "/min")],
+                         [(p.source, p.value, p.unit) for p in heart])
+        self.assertEqual(["cda"], [p.source for p in query_metric(self.unified, "heart_rate", sources=["cda"])])
+        self.assertEqual(["apple"], [p.source for p in query_metric(self.unified, "heart_rate", start=heart[1].ts)])
+
+        weight = query_metric(self.unified, "body_weight")
+        self.assertAlmostEqual(68.04, weight[0].value, places=2)
+        self.assertEqual("kg", weight[0].unit)
+        self.assertAlmostEqual(97.0, query_metric(self.unified, "oxygen_saturation")[0].value)
+
+        systolic = query_metric(self.unified, "systolic_blood_pressure")
+        self.assertEqual([("fhir", 130.0, "Observation-test-bp.json")], [(p.source, p.value, p.origin) for p in systolic])
+
+        metrics = {m["metric_id"]: m for m in list_metrics(self.unified)}
+        self.assertEqual({"cda": 1, "apple": 1}, metrics["heart_rate"]["sources"])
+
+        # Nothing changed, so nothing is reloaded. A new FHIR file reloads only FHIR.
+        self.assertEqual({}, refresh_unified_store(self.unified, cda_db=self.cda, apple_db=self.apple,
+                                                   fhir_index=self.index))
+        shutil.copy("test_data/Observation-test-bp2.json", self.records)
+        self.index.sync()
+        self.assertEqual({"fhir": 4}, refresh_unified_store(self.unified, cda_db=self.cda, apple_db=self.apple,
+                                                            fhir_index=self.index))
+
+        # A source database that is gone takes its rows with it.
+        self.cda.unlink()
+        self.assertEqual({"cda": 0}, refresh_unified_store(self.unified, cda_db=self.cda))
+        self.assertEqual(["apple"], [p.source for p in query_metric(self.unified, "heart_rate")])
+
+    def test_query_metric_series(self):
+        refresh_unified_store(self.unified, cda_db=self.cda, apple_db=self.apple, fhir_index=self.index)
+        series = query_metric_series(self.unified, "heart_rate")
+        self.assertEqual(["cda", "apple"], list(series))
+        self.assertEqual([(p.ts, p.value) for p in query_metric(self.unified, "heart_rate", sources=["apple"])],
+                         list(series["apple"]))
+        self.assertEqual("/min", series["cda"].unit)
+        self.assertEqual([[series["cda"].ts[0] * 1000, 61.0]], series["cda"].pairs_ms())
+        self.assertEqual({}, query_metric_series(self.unified, "nothing"))
+
+    def test_concurrent_refreshes(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(refresh_unified_store(
+            self.unified, cda_db=self.cda, apple_db=self.apple, fhir_index=self.index, force=True)))
+            for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([{"cda": 2, "apple": 3, "fhir": 2}] * 3, results)
+
+        # A reload in progress doesn't stop the reads, and they see the store as it was
+        writer = connect_unified(self.unified)
+        self.assertEqual("wal", writer.execute("PRAGMA journal_mode").fetchone()[0])
+        writer.execute("PRAGMA cache_size = 1")
+        writer.execute("DELETE FROM unified_observations")
+        writer.executemany("INSERT INTO unified_observations VALUES ('x', ?, 1, NULL, 'cda', NULL, 'x')",
+                           ((i,) for i in range(20000)))
+        self.assertEqual(2, len(query_metric(self.unified, "heart_rate")))
+        writer.rollback()
+        writer.close()
+
+    def test_fhir_units(self):
+        # The index holds these as lb and Fah; the store gets the kg and Cel back
+        for name, value, unit in [("Body Weight", 70, "kg"), ("Body Temperature", 37, "Cel")]:
+            (self.records / f"Observation-{unit}.json").write_text(json.dumps({
+                "resourceType": "Observation",
+                "category": [{"text": "Vital Signs"}],
+                "effectiveDateTime": "2024-02-15T21:00:03Z",
+                "code": {"text": name},
+                "valueQuantity": {"value": value, "unit": unit},
+            }))
+        self.index.sync()
+        refresh_unified_store(self.unified, fhir_index=self.index)
+        weight = query_metric(self.unified, "body_weight")
+        self.assertEqual([("kg", "fhir")], [(p.unit, p.source) for p in weight])
+        self.assertAlmostEqual(70.0, weight[0].value)
+        temperature = query_metric(self.unified, "body_temperature")
+        self.assertEqual([("Cel", "fhir")], [(p.unit, p.source) for p in temperature])
+        self.assertAlmostEqual(37.0, temperature[0].value)
@@ -0,0 +1,258 @@
+import json
+import os
+import re
+import sqlite3
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import config
+import main
+from preprocess_apple_health import create_database_schema
+from preprocess_cda import create_database
+
+
+class ServerTestCase(TestCase):
+    """
+    A server over small CDA and Apple Health databases and a clinical-records directory. The databases live in the
+    current directory, so the tests run in a temporary one, with the templates and static files linked in.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.dir = Path(cls.tmp.name)
+        cls.cwd = os.getcwd()
+        for name in ("static", "templates"):
+            (cls.dir / name).symlink_to(Path(cls.cwd) / name)
+        cls.source_dir = config.get_source_dir()
+        cls.environ = {name: os.environ.get(name) for name in ("HEALTH_FHIR_INDEX", "HEALTH_UNIFIED_DB")}
+        os.environ["HEALTH_FHIR_INDEX"] = str(cls.dir / "fhir_index.db")
+        os.environ["HEALTH_UNIFIED_DB"] = str(cls.dir / "unified_observations.db")
+        config.set_source_dir(cls.dir)
+        os.chdir(cls.dir)
+
+        # Values repeat, so sorting by value needs the id to break ties
+        conn = create_database(Path("cda_observations.db"))
+        conn.executemany("INSERT INTO cda_observations (name, category, value, unit, date, source_name) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         [("Heart Rate", "Vital Signs", 60 + i % 7, "count/min",
+                           f"2024-01-01T00:{i // 60:02}:{i % 60:02}Z", "Clinic" if i % 3 else "Lab")
+                          for i in range(250)])
+        conn.commit()
+        conn.close()
+
+        conn = sqlite3.connect("apple_health.db")
+        create_database_schema(conn)
+        conn.executemany("INSERT INTO apple_health_records (type, unit, value, source_name, start_date, end_date) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         [("HKQuantityTypeIdentifierHeartRate", "count/min", 70 + i % 5, "Watch" if i % 2 else "Phone",
+                           f"2024-01-01T01:{i // 60:02}:{i % 60:02}", f"2024-01-01T01:{i // 60:02}:{i % 60:02}")
+                          for i in range(150)])
+        conn.commit()
+        conn.close()
+
+        records = cls.dir / "clinical-records"
+        records.mkdir()
+        for i in range(30):
+            (records / f"Condition-{i:02}.json").write_text(json.dumps({
+                "resourceType": "Condition", "id": f"condition-{i:02}", "recordedDate": f"2023-0{1 + i % 3}-01",
+                "clinicalStatus": {"coding": [{"code": "resolved" if i % 4 else "active"}]},
+                "code": {"text": f"Condition {i % 10}"},
+            }))
+        cls.client = TestClient(main.app)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.cwd)
+        config.set_source_dir(cls.source_dir)
+        for name, value in cls.environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        cls.tmp.cleanup()
+
+    def get_all(self, url: str, key: str, **params) -> list:
+        """Every row of a paged table, following next_cursor"""
+        rows = []
+        cursor = None
+        while True:
+            response = self.client.get(url, params={**params, **({"cursor": cursor} if cursor else {})})
+            self.assertEqual(200, response.status_code, response.text)
+            rows += response.json()[key]
+            cursor = response.json()["next_cursor"]
+            if cursor is None:
+                return rows
+
+
+class TestTables(ServerTestCase):
+    CDA = "/api/cda/vital-signs/Heart Rate/data"
+    APPLE = "/api/apple/HKQuantityTypeIdentifierHeartRate/data"
+
+    def test_cda_paging(self):
+        for sort in ("-date", "date", "value", "-value"):
+            field = sort.lstrip("-")
+            everything = self.client.get(self.CDA, params={"sort": sort}).json()["data"]
+            self.assertEqual(250, len(everything))
+            keys = [(row[field], row["id"]) for row in everything]
+            self.assertEqual(sorted(keys, reverse=sort.startswith("-")), keys)
+            self.assertEqual(everything, self.get_all(self.CDA, "data", sort=sort, page_size=7))
+
+        lab = self.get_all(self.CDA, "data", q="la", sort="value", page_size=10)
+        self.assertEqual(84, len(lab))
+        self.assertEqual({"Lab"}, {row["source_name"] for row in lab})
+
+    def test_apple_paging(self):
+        for sort in ("-date", "value"):
+            everything = self.client.get(self.APPLE, params={"sort": sort}).json()["data"]
+            self.assertEqual(150, len(everything))
+            self.assertEqual(everything, self.get_all(self.APPLE, "data", sort=sort, page_size=11))
+        watch = self.get_all(self.APPLE, "data", q="watch", page_size=20)
+        self.assertEqual(75, len(watch))
+        self.assertEqual({"Watch"}, {row["source_name"] for row in watch})
+
+    def test_bad_parameters(self):
+        cursor = self.client.get(self.CDA, params={"page_size": 5}).json()["next_cursor"]
+        self.assertEqual(200, self.client.get(self.CDA, params={"page_size": 5, "cursor": cursor}).status_code)
+        for params in ({"cursor": "not a cursor"}, {"cursor": "WzEsMl0"}, {"cursor": cursor, "sort": "value"},
+                       {"cursor": cursor, "sort": "date"}, {"sort": "name"}, {"page_size": 0}):
+            for url in (self.CDA, self.APPLE, "/api/data/Condition"):
+                self.assertEqual(400, self.client.get(url, params=params).status_code, (url, params))
+
+    def test_fhir_table(self):
+        for sort in ("-date", "text", "-status"):
+            field = sort.lstrip("-")
+            everything = self.client.get("/api/data/Condition", params={"sort": sort}).json()["records"]
+            self.assertEqual(30, len(everything))
+            keys = [(row[field], row["id"]) for row in everything]
+            self.assertEqual(sorted(keys, reverse=sort.startswith("-")), keys)
+            self.assertEqual(everything, self.get_all("/api/data/Condition", "records", sort=sort, page_size=4))
+
+        page = self.client.get("/api/data/Condition", params={"q": "condition 3", "status": "resolved"}).json()
+        self.assertEqual(["condition-03", "condition-13", "condition-23"], sorted(r["id"] for r in page["records"]))
+        self.assertEqual((3, 30), (page["count"], page["total"]))
+
+    def test_fhir_record(self):
+        record = self.client.get("/api/data/condition/condition-07").json()
+        self.assertEqual(("condition-07", "Condition 7"), (record["id"], record["code"]["text"]))
+        self.assertEqual(404, self.client.get("/api/data/Condition/condition-99").status_code)
+        self.assertEqual(404, self.client.get("/api/data/Patient/condition-07").status_code)
+
+
+class TestConditionalResponses(ServerTestCase):
+    CDA = "/api/cda/vital-signs/Heart Rate/data"
+
+    def test_etag(self):
+        response = self.client.get(self.CDA, params={"page_size": 5})
+        etag = response.headers["etag"]
+        self.assertEqual("no-cache", response.headers["cache-control"])
+        self.assertIn("last-modified", response.headers)
+
+        not_modified = self.client.get(self.CDA, params={"page_size": 5}, headers={"If-None-Match": etag})
+        self.assertEqual((304, b""), (not_modified.status_code, not_modified.content))
+        self.assertEqual(etag, not_modified.headers["etag"])
+        weak = self.client.get(self.CDA, params={"page_size": 5}, headers={"If-None-Match": "W/" + etag})
+        self.assertEqual(304, weak.status_code)
+
+        # Other parameters are another response
+        other = self.client.get(self.CDA, params={"page_size": 6}, headers={"If-None-Match": etag})
+        self.assertEqual(200, other.status_code)
+        self.assertNotEqual(etag, other.headers["etag"])
+        self.assertEqual(200, self.client.get("/api/prefixes", headers={"If-None-Match": etag}).status_code)
+
+    def test_etag_changes_with_the_database(self):
+        params = {"sort": "-date", "page_size": 1}
+        etag = self.client.get(self.CDA, params=params).headers["etag"]
+        conn = sqlite3.connect("cda_observations.db")
+        conn.execute("INSERT INTO cda_observations (name, category, value, unit, date, source_name) "
+                     "VALUES ('Heart Rate', 'Vital Signs', 99, 'count/min', '2025-01-01T00:00:00Z', 'Clinic')")
+        conn.commit()
+        conn.close()
+        response = self.client.get(self.CDA, params=params, headers={"If-None-Match": etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers["etag"])
+        self.assertEqual(99, response.json()["data"][0]["value"])
+
+    def test_etag_changes_with_an_ndjson_file(self):
+        path = Path("clinical-records") / "Immunization.ndjson"
+        self.addCleanup(path.unlink)
+        path.write_text(json.dumps({"resourceType": "Immunization", "id": "immunization-1"}) + "\n")
+        etag = self.client.get("/api/data/Immunization").headers["etag"]
+        # Rewritten in place, so only the file's own signature changes
+        with open(path, "a") as f:
+            f.write(json.dumps({"resourceType": "Immunization", "id": "immunization-2"}) + "\n")
+        response = self.client.get("/api/data/Immunization", headers={"If-None-Match": etag})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(["immunization-1", "immunization-2"], sorted(r["id"] for r in response.json()["records"]))
+
+    def test_hashed_static_urls(self):
+        page = self.client.get("/")
+        self.assertEqual(200, page.status_code)
+        url = re.search(r'href="(/static/css/custom\.css\?v=[0-9a-f]+)"', page.text).group(1)
+        self.assertEqual(url, main.static_url("css/custom.css"))
+
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("public, max-age=31536000, immutable", response.headers["cache-control"])
+        # Without the file's current hash, browsers have to revalidate
+        for stale in ("/static/css/custom.css", "/static/css/custom.css?v=0123456789ab"):
+            response = self.client.get(stale)
+            self.assertEqual(200, response.status_code)
+            self.assertNotIn("immutable", response.headers.get("cache-control", ""))
+
+
+class TestExports(ServerTestCase):
+    CDA = "/api/cda/vital-signs/Heart Rate/data"
+    APPLE = "/api/apple/HKQuantityTypeIdentifierHeartRate/data"
+
+    def test_csv(self):
+        response = self.client.get(self.CDA, params={"format": "csv", "page_size": 5, "sort": "value"})
+        self.assertEqual("text/csv; charset=utf-8", response.headers["content-type"])
+        self.assertEqual('attachment; filename="Heart_Rate_data.csv"', response.headers["content-disposition"])
+        lines = response.text.splitlines()
+        self.assertEqual("date,value,unit,source_name", lines[0])
+        self.assertEqual(250, len(lines) - 1)
+        values = [float(line.split(",")[1]) for line in lines[1:]]
+        self.assertEqual(sorted(values), values)
+
+        lines = self.client.get("/api/data/Condition", params={"format": "csv", "page_size": 4}).text.splitlines()
+        self.assertEqual(("description,date,status,resource_type,id", 30), (lines[0], len(lines) - 1))
+        empty = self.client.get(self.CDA, params={"format": "csv", "q": "nobody"})
+        self.assertEqual(["date,value,unit,source_name"], empty.text.splitlines())
+
+    def test_json(self):
+        response = self.client.get(self.CDA, params={"format": "json", "page_size": 5})
+        self.assertEqual("application/json", response.headers["content-type"])
+        observations = response.json()["observations"]
+        self.assertEqual(250, len(observations))
+        self.assertEqual(["id", "name", "category", "value", "unit", "date", "source_name"], list(observations[0]))
+        self.assertEqual(json.dumps({"observations": observations}, ensure_ascii=False, separators=(",", ":")),
+                         response.text)
+        self.assertEqual('{"observations":[]}', self.client.get(self.CDA, params={"format": "json", "q": "x"}).text)
+
+        # Apple exports are an array, indented like json.dumps(indent=2), and only limit cuts them short
+        response = self.client.get(self.APPLE, params={"format": "json", "page_size": 5})
+        records = response.json()
+        self.assertEqual(150, len(records))
+        self.assertEqual(["date", "value", "unit", "source_name", "creation_date"], list(records[0]))
+        self.assertEqual(json.dumps(records, indent=2), response.text)
+        self.assertEqual(10, len(self.client.get(self.APPLE, params={"format": "json", "limit": 10}).json()))
+
+    def test_ndjson(self):
+        response = self.client.get(self.APPLE, params={"format": "ndjson", "page_size": 5, "q": "phone"})
+        self.assertEqual("application/x-ndjson", response.headers["content-type"])
+        records = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(75, len(records))
+        self.assertEqual({"Phone"}, {r["source_name"] for r in records})
+        self.assertTrue(response.text.endswith("}\n"))
+
+    def test_chunks(self):
+        # Chunks join up to the same body, whatever their size
+        for params in ({"format": "csv"}, {"format": "json"}, {"format": "ndjson"}):
+            whole = self.client.get(self.APPLE, params=params).text
+            with patch.object(main, "EXPORT_CHUNK_ROWS", 7):
+                self.assertEqual(whole, self.client.get(self.APPLE, params={**params, "sort": "-date"}).text)
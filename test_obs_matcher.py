@@ -1,9 +1,20 @@
+import json
+import os
+import tempfile
 import unittest
+from pathlib import Path
 from obs_matcher import (
+    ConceptIndex,
     ObservationCodeMapper,
+    cluster_similar_names,
+    load_concepts,
+    minhash_signature,
+    similar_name_pairs,
+    token_jaccard,
     observations_equivalent,
     NameMismatchError,
     STANDARD_LOINC,
+    yield_observations,
 )
 
 def obs(codeable):
@@ -83,5 +94,113 @@ class TestObservationMatcher(unittest.TestCase):
             observations_equivalent(o1, o2, self.mapper, enable_text_fallback=True, text_similarity_threshold=0.8)
         )
 
+
+class TestConceptIndex(unittest.TestCase):
+
+    def setUp(self):
+        # The local-only observation comes first, before the one that teaches its mapping.
+        self.observations = [
+            ("a.json", obs(cc("EOS ABS (AUTO)", [coding("urn:oid:1.2.3.4", "2000395")]))),
+            ("b.json", obs(cc("Eosinophils, Automated Count", [
+                coding(STANDARD_LOINC, "711-2"),
+                coding("urn:oid:1.2.3.4", "2000395"),
+            ]))),
+            ("c.json", obs(cc("Eosinophils", [coding(STANDARD_LOINC, "711-2")]))),
+            ("d.json", obs(cc("Random Test", [coding("urn:oid:x", "X1")]))),
+            ("e.json", obs(cc(None, [coding("urn:oid:y", "Y1")]))),
+        ]
+
+    def test_concepts(self):
+        index = ConceptIndex().build(self.observations)
+        self.assertEqual("loinc:711-2", index.concept_id("a.json"))
+        self.assertEqual("loinc:711-2", index.concept_id("b.json"))
+        self.assertEqual("loinc:711-2", index.concept_id("c.json"))
+        self.assertEqual("name:random test", index.concept_id("d.json"))
+        self.assertEqual("code:urn:oid:y|Y1", index.concept_id("e.json"))
+        self.assertEqual(5, len(index))
+        self.assertEqual(["a.json", "b.json", "c.json"], index.groups()["loinc:711-2"])
+        self.assertEqual({"eos abs auto", "eosinophils automated count", "eosinophils"},
+                         index.names("loinc:711-2"))
+
+    def test_stable_across_order(self):
+        forward = ConceptIndex().build(self.observations)
+        backward = ConceptIndex().build(reversed(self.observations))
+        self.assertEqual(forward.groups().keys(), backward.groups().keys())
+        for key, _ in self.observations:
+            self.assertEqual(forward.concept_id(key), backward.concept_id(key))
+
+    def test_add_after_build(self):
+        index = ConceptIndex().build(self.observations[:1])
+        self.assertEqual("name:eos abs auto", index.concept_id("a.json"))
+        index.add("b.json", self.observations[1][1])
+        self.assertEqual("loinc:711-2", index.concept_id("a.json"))
+
+    def test_save_and_load(self):
+        index = ConceptIndex().build(self.observations)
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "concepts.db")
+            index.save(db)
+            mapper = ObservationCodeMapper.load(db)
+            self.assertEqual(index.mapper.local_to_loinc, mapper.local_to_loinc)
+            self.assertEqual(index.mapper.loinc_names, mapper.loinc_names)
+            concepts = load_concepts(db)
+            self.assertEqual("loinc:711-2", concepts["a.json"])
+            # A second save replaces rather than appends.
+            index.save(db)
+            self.assertEqual(len(self.observations), len(load_concepts(db)))
+
+
+class TestNameClustering(unittest.TestCase):
+
+    def test_signature_estimates_jaccard(self):
+        a, b = "hemoglobin a1c blood", "hemoglobin a1c whole blood"
+        sa, sb = minhash_signature(a, 256), minhash_signature(b, 256)
+        estimate = sum(x == y for x, y in zip(sa, sb)) / 256
+        self.assertAlmostEqual(token_jaccard(a, b), estimate, delta=0.15)
+        self.assertEqual(sa, minhash_signature(a, 256))
+        self.assertEqual((), minhash_signature(""))
+
+    def test_pairs_are_verified(self):
+        names = ["eosinophils automated count", "automated count eosinophils", "eosinophils",
+                 "glucose serum plasma", "glucose serum plasma fasting", "sodium"]
+        self.assertEqual({("automated count eosinophils", "eosinophils automated count")},
+                         similar_name_pairs(names, threshold=0.85))
+        self.assertIn(("glucose serum plasma", "glucose serum plasma fasting"), similar_name_pairs(names, threshold=0.7))
+        with self.assertRaises(ValueError):
+            similar_name_pairs(names, num_perm=64, bands=10)
+
+    def test_clusters(self):
+        clusters = cluster_similar_names(["a b c", "c b a", "b c a", "x y", "y x", "z"])
+        self.assertEqual([{"a b c", "b c a", "c b a"}, {"x y", "y x"}], clusters)
+
+    def test_merge_into_concept_index(self):
+        index = ConceptIndex().build([
+            ("a.json", obs(cc("Eosinophils, Automated Count", [coding(STANDARD_LOINC, "711-2")]))),
+            ("b.json", obs(cc("Automated Count - Eosinophils", [coding("urn:oid:x", "X1")]))),
+            ("c.json", obs(cc("Random Test", [coding("urn:oid:y", "Y1")]))),
+            ("d.json", obs(cc("Test, Random", [coding("urn:oid:z", "Z1")]))),
+        ])
+        self.assertEqual("name:automated count eosinophils", index.concept_id("b.json"))
+        index.merge_similar_names(0.85)
+        self.assertEqual("loinc:711-2", index.concept_id("b.json"))
+        self.assertEqual("name:random test", index.concept_id("c.json"))
+        self.assertEqual("name:random test", index.concept_id("d.json"))
+
+
+class TestYieldObservations(unittest.TestCase):
+    def test_json_and_ndjson(self):
+        with tempfile.TemporaryDirectory() as d:
+            weight = obs(cc("Body weight", [coding("http://loinc.org", "29463-7")]))
+            Path(d, "Observation-1.json").write_text(json.dumps(weight))
+            lines = json.dumps(weight) + "\n"
+            Path(d, "Observation.ndjson").write_text(lines * 2)
+            Path(d, "Condition.ndjson").write_text(json.dumps({"resourceType": "Condition"}) + "\n")
+            found = list(yield_observations(Path(d)))
+            self.assertEqual(["Observation-1.json", "Observation.ndjson#0", f"Observation.ndjson#{len(lines)}"],
+                             [key for key, _ in found])
+            index = ConceptIndex(ObservationCodeMapper()).build(found)
+            self.assertEqual(1, len(index.groups()))
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
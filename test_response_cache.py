@@ -0,0 +1,89 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from response_cache import ResponseCache, CachedResponse, ENTRY_OVERHEAD
+
+
+def response(size: int) -> CachedResponse:
+    return CachedResponse(b"x" * (size - ENTRY_OVERHEAD), "application/json")
+
+
+class TestResponseCache(IsolatedAsyncioTestCase):
+    def test_lru_by_bytes(self):
+        cache = ResponseCache(3000, max_entry_bytes=1500)
+        cache.put("a", response(1000))
+        cache.put("b", response(1000))
+        cache.put("c", response(1000))
+        self.assertIsNotNone(cache.get("a"))  # now b is the least recently used
+        cache.put("d", response(1000))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(["a", "c", "d"], sorted(k for k in "abcd" if cache.get(k)))
+
+        self.assertFalse(cache.put("e", response(2000)))
+        stats = cache.stats()
+        self.assertEqual((3, 3000, 1, 1), (stats["entries"], stats["bytes"], stats["evictions"], stats["too_large"]))
+        cache.clear()
+        self.assertEqual((0, 0), (cache.stats()["entries"], cache.stats()["bytes"]))
+
+    async def test_single_flight(self):
+        cache = ResponseCache(1 << 20)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return response(1000)
+
+        results = await asyncio.gather(*[cache.get_or_compute("k", compute, "chart") for _ in range(5)])
+        self.assertEqual(1, len(calls))
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertIs(results[0], await cache.get_or_compute("k", compute, "chart"))
+        self.assertEqual({"hits": 1, "misses": 1, "coalesced": 4, "hit_rate": 0.833},
+                         cache.stats()["endpoints"]["chart"])
+
+    async def test_errors_not_cached(self):
+        cache = ResponseCache(1 << 20)
+        calls = []
+
+        async def fail():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("no such chart")
+
+        results = await asyncio.gather(*[cache.get_or_compute("k", fail) for _ in range(3)], return_exceptions=True)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(1, len(calls))
+        with self.assertRaises(ValueError):
+            await cache.get_or_compute("k", fail)
+        self.assertEqual(2, len(calls))
+        self.assertEqual(0, cache.stats()["entries"])
+
+    async def test_uncacheable(self):
+        # A compute that returns None, like a stream, runs for every request
+        cache = ResponseCache(1 << 20)
+        calls = []
+
+        async def stream():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return None
+
+        results = await asyncio.gather(*[cache.get_or_compute("k", stream) for _ in range(3)])
+        self.assertEqual([None] * 3, results)
+        self.assertEqual(3, len(calls))
+
+    async def test_cancelled_leader(self):
+        # Requests waiting for one that goes away compute the response themselves
+        cache = ResponseCache(1 << 20)
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            return response(1000)
+
+        leader = asyncio.create_task(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        self.assertEqual(response(1000), await waiter)
+        self.assertTrue(leader.cancelled())
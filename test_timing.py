@@ -0,0 +1,74 @@
+import time
+from unittest import TestCase
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from timing import LatencyHistogram, Metrics, TimingMiddleware, RequestTiming, span, timed, record, _current
+
+
+class TestTiming(TestCase):
+    def test_spans(self):
+        @timed("query")
+        def query(depth):
+            # Nested calls are counted once
+            return query(depth - 1) if depth else time.sleep(0.01)
+
+        with span("query"):
+            pass  # Outside a request, nothing to add to
+
+        timing = RequestTiming()
+        token = _current.set(timing)
+        try:
+            query(3)
+            with span("render"):
+                pass
+            record("queue", 0.5)
+        finally:
+            _current.reset(token)
+        self.assertEqual(["query", "render", "queue"], list(timing.spans))
+        self.assertTrue(0.01 <= timing.spans["query"] < 0.035)  # Four times that if the nested calls counted
+        self.assertEqual(set(), timing.active)
+        self.assertRegex(timing.header(1.0),
+                         r"^query;dur=\d+\.\d, render;dur=0\.\d, queue;dur=500\.0, total;dur=1000\.0$")
+
+    def test_histogram(self):
+        histogram = LatencyHistogram()
+        self.assertIsNone(histogram.percentile(0.5))
+        for ms in range(1, 101):
+            histogram.add(ms / 1000)
+        for p, expected in ((0.5, 0.050), (0.95, 0.095), (0.99, 0.099)):
+            self.assertTrue(expected <= histogram.percentile(p) <= expected * 1.19, p)
+        self.assertEqual(0.1, histogram.percentile(1))
+        histogram.add(1000)  # Past the last bucket
+        self.assertEqual(1000, histogram.percentile(1))
+
+    def test_middleware(self):
+        app = FastAPI()
+        metrics = Metrics()
+        app.add_middleware(TimingMiddleware, metrics=metrics)
+
+        @app.get("/items/{item}")
+        def item(item: str):
+            # Sync endpoints run in a worker thread, with the request's spans
+            with span("query"):
+                time.sleep(0.005)
+            if item == "bad":
+                raise ValueError(item)
+            return {"item": item}
+
+        client = TestClient(app, raise_server_exceptions=False)
+        for item in ("a", "b", "bad"):
+            response = client.get(f"/items/{item}")
+        self.assertRegex(client.get("/items/c").headers["server-timing"], r"^query;dur=\d+\.\d, total;dur=\d+\.\d$")
+        self.assertEqual(500, response.status_code)
+        client.get("/nothing")
+
+        stats = metrics.stats()["routes"]
+        self.assertEqual(["GET /items/{item}", "GET (unmatched)"], list(stats))
+        route = stats["GET /items/{item}"]
+        self.assertEqual((4, 1), (route["count"], route["errors"]))
+        self.assertGreaterEqual(route["spans_ms"]["query"], 5)
+        self.assertTrue(5 <= route["p50_ms"] <= route["p99_ms"] <= route["max_ms"])
+        metrics.reset()
+        self.assertEqual({"routes": {}}, metrics.stats())
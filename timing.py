@@ -0,0 +1,199 @@
+"""
+Where the time of each request goes.
+
+Code marks the phases of a request with span(), like opening the database, the query, or rendering the template.
+TimingMiddleware sends their durations in a Server-Timing header, which the browser's developer tools show with the
+request, and keeps a latency histogram per route, for the p50, p95 and p99 of /api/debug/metrics.
+
+The spans of a request are kept in a context variable. The worker threads that run sync endpoints and stream
+responses get a copy of the request's context, so their spans add to the same request. Outside a request, like in
+the preprocessors or the tests, span() only looks the variable up.
+"""
+
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+# Upper bounds of the histogram buckets, in seconds: 0.1 ms to about 100 s, each 2**0.25 times the one before, so a
+# percentile read from the buckets is at most 19% above the real one
+BUCKET_BOUNDS = tuple(0.0001 * 2 ** (i / 4) for i in range(81))
+
+
+class RequestTiming:
+    """
+    The spans of one request: seconds per span name. Spans with the same name add up; one inside another of the
+    same name, like a query function calling another, isn't counted twice. Spans with other names overlap.
+    """
+
+    def __init__(self):
+        self.spans: dict[str, float] = {}
+        self.active: set[str] = set()
+
+    def add(self, name: str, seconds: float) -> None:
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def header(self, total: float) -> str:
+        """The Server-Timing header, with durations in milliseconds"""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}"
+                         for name, seconds in [*self.spans.items(), ("total", total)])
+
+
+_current: contextvars.ContextVar[Optional[RequestTiming]] = contextvars.ContextVar("request_timing", default=None)
+
+
+def record(name: str, seconds: float) -> None:
+    """Add a duration measured some other way to the current request's span name"""
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the block as part of the current request's span name"""
+    timing = _current.get()
+    if timing is None or name in timing.active:
+        yield
+        return
+    timing.active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - start)
+        timing.active.discard(name)
+
+
+def timed(name: str) -> Callable:
+    """Decorator that times every call as part of span name. Not for generators, which run after they return."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class LatencyHistogram:
+    """Counts of durations in BUCKET_BOUNDS buckets, and their total and maximum"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        The duration that a fraction p (0 to 1) of the durations are at most: the upper bound of its bucket, or
+        the maximum if that is less. None if there are none.
+        """
+        if not self.count:
+            return None
+        rank = max(1, round(p * self.count))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(BUCKET_BOUNDS[i], self.max) if i < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+
+class Metrics:
+    """Latency histograms, error counts and span totals per route. Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: dict[str, dict] = {}
+
+    def record(self, route: str, seconds: float, status: int, spans: dict[str, float]) -> None:
+        with self._lock:
+            metrics = self._routes.get(route)
+            if metrics is None:
+                metrics = self._routes[route] = {"histogram": LatencyHistogram(), "errors": 0, "spans": {}}
+            metrics["histogram"].add(seconds)
+            if status >= 500:
+                metrics["errors"] += 1
+            for name, span_seconds in spans.items():
+                metrics["spans"][name] = metrics["spans"].get(name, 0.0) + span_seconds
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
+
+    def stats(self) -> dict:
+        """Per route, the most total time first: request count, errors, latencies and mean span times in ms"""
+        def ms(seconds: Optional[float]) -> Optional[float]:
+            return None if seconds is None else round(seconds * 1000, 2)
+
+        with self._lock:
+            routes = sorted(self._routes.items(), key=lambda item: item[1]["histogram"].total, reverse=True)
+            return {"routes": {
+                route: {
+                    "count": metrics["histogram"].count,
+                    "errors": metrics["errors"],
+                    "mean_ms": ms(metrics["histogram"].total / metrics["histogram"].count),
+                    "p50_ms": ms(metrics["histogram"].percentile(0.5)),
+                    "p95_ms": ms(metrics["histogram"].percentile(0.95)),
+                    "p99_ms": ms(metrics["histogram"].percentile(0.99)),
+                    "max_ms": ms(metrics["histogram"].max),
+                    "spans_ms": {name: ms(seconds / metrics["histogram"].count)
+                                 for name, seconds in sorted(metrics["spans"].items())},
+                }
+                for route, metrics in routes
+            }}
+
+
+def route_name(scope: dict) -> str:
+    """The route that handled a request, like GET /api/apple/{record_type}/data, or GET /static/* for a mount"""
+    route = scope.get("route")
+    if route is not None:
+        path = route.path
+    else:
+        # Mounted apps, like the static files, set root_path to where they are mounted
+        mounted = scope.get("root_path", "")[len(scope.get("app_root_path", scope.get("root_path", ""))):]
+        path = mounted + "/*" if mounted else "(unmatched)"
+    return f"{scope.get('method', '')} {path}"
+
+
+class TimingMiddleware:
+    """ASGI middleware that times each HTTP request, adds its Server-Timing header and records it in metrics"""
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timing = RequestTiming()
+        token = _current.set(timing)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                # A streamed response's header has the time until its first bytes; the metrics have all of it
+                status = message["status"]
+                header = timing.header(time.perf_counter() - start).encode("latin-1")
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            self.metrics.record(route_name(scope), time.perf_counter() - start, status, timing.spans)